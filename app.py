@@ -3,8 +3,17 @@ Flask app logic for P1M3
 """
 # pylint: disable=no-member
 # pylint: disable=too-few-public-methods
+import asyncio
+import atexit
+import contextvars
+import functools
+import io
+import json
+import logging
 import os
-import requests
+from collections import namedtuple
+from contextlib import contextmanager
+
 import time
 import flask
 
@@ -18,25 +27,271 @@ from flask_login import (
     UserMixin,
     login_required,
 )
-from flask_sqlalchemy import SQLAlchemy
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateColumn, CreateTable
+from sqlalchemy.sql import Select
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.util import find_tables
+
+import click
+
+from db_pool import engine_options
+from email_validation import build_validator
+from helpers import (
+    getCompoundName,
+    legacy_date_to_timestamp,
+    validate_new_instr_form,
+)
+from password_hashing import PasswordHasher, PoolSaturated
+from password_policy import LOWER, NUMBER, SPECIAL, UPPER, PasswordPolicy
+from replicas import Heartbeat, ReplicaSet, replica_bind_key, replica_urls
+from running_stats import RunningStats
+from session_import import RowError, detect_format, import_sessions, parse_record
+from session_journal import SessionJournal
+import sketches
+from sketches import CountMinSketch, HyperLogLog, QuantileSketch, SketchBuffer
+from sharding import (
+    NoShardSelected,
+    Placement,
+    ShardMoving,
+    ShardRouter,
+    bind_key,
+    shard_urls,
+)
+from string_health import compute_health
+from user_cache import UserCache
+import app_logging
+import assets
+import metrics
+import string_health
+import time_buckets
+
+logger = logging.getLogger(__name__)
+
+# Services configured from the environment by create_app (see init_services)
+email_checker = None
+password_hasher = None
+password_policy = None
+user_cache = None
+# write-behind session journal, None unless SESSION_WRITE_BEHIND is set
+session_journal = None
+# user -> shard placements; a single shard unless SHARD_DATABASE_URLS is set
+shard_router = None
+# read replicas of the main database; none unless REPLICA_DATABASE_URLS is set
+replica_set = None
+# bumps the replicas' heartbeat on the primary, None without replicas
+replica_heartbeat = None
+# this process's deltas of the community statistics, None when turned off
+community_stats = None
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class RoutingSession(SignallingSession):
+    """
+    Sends statements on sharded tables to the shard from current_shard(),
+    and everything else to the main database. Plain SELECTs on the main
+    database go to a replica in views marked with replica_reads.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        shard = 0
+        if shard_router is not None and shard_router.sharded:
+            if touches_sharded_table(mapper, clause):
+                shard = current_shard()
+        if self._flushing or isinstance(clause, UpdateBase):
+            note_primary_write()
+        elif shard == 0 and is_plain_select(clause):
+            replica = current_replica()
+            if replica is not None:
+                return db.get_engine(self.app, bind=replica_bind_key(replica))
+        if shard:
+            return db.get_engine(self.app, bind=bind_key(shard))
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def touches_sharded_table(mapper, clause):
+    if mapper is not None:
+        return mapper.persist_selectable.info.get("sharded", False)
+    if clause is None:
+        return False
+    tables = find_tables(clause, check_columns=True, include_crud=True)
+    return any(table.info.get("sharded", False) for table in tables)
+
+
+def is_plain_select(clause):
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+# set by run_sync for the blocking calls it runs
+_session_owner = contextvars.ContextVar("session_owner", default=None)
+
+
+def session_scope():
+    """
+    Scope of db.session: one session per app context (a request, a CLI
+    command, a background flush) instead of one per thread, so an async view,
+    which Flask runs in a thread of its own, uses its request's session.
+    Calls awaited with run_sync get a session of their own.
+    """
+    owner = _session_owner.get()
+    if owner is not None:
+        return owner
+    return id(flask._app_ctx_stack.top)  # pylint: disable=protected-access
+
+
+db = RoutingSQLAlchemy(session_options={"scopefunc": session_scope})
+login_manager = LoginManager()
+login_manager.login_view = "tracker.login"
+# routes and CLI commands; registered on the app by create_app
+bp = flask.Blueprint("tracker", __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """
+    Builds the Flask app from the environment (and .env, unless
+    FLASK_SKIP_DOTENV is set), with `config` overriding any setting. Nothing
+    connects to the database until it is first used; create the schema with
+    `flask init-db`.
+    """
+    if not os.environ.get("FLASK_SKIP_DOTENV"):
+        load_dotenv(find_dotenv())
+    # /static is served by assets.init_assets
+    app = flask.Flask(__name__, static_folder=None)
+    # Point SQLAlchemy to your Heroku database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL1")
+    # Gets rid of a warning
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # string health uses the learned average lifespan of a string model once
+    # it has this many samples, and the default (hours) until then
+    app.config["DEFAULT_LIFESPAN_HRS"] = float(os.getenv("DEFAULT_LIFESPAN_HRS", "100"))
+    app.config["LIFESPAN_MIN_SAMPLES"] = int(os.getenv("LIFESPAN_MIN_SAMPLES", "3"))
+    app.config["SECRET_KEY"] = os.getenv("SECRET_KEY")
+    app.config.update(config or {})
+    # per-worker connection pool; see db_pool.engine_options for the settings
+    app.config.setdefault(
+        "SQLALCHEMY_ENGINE_OPTIONS",
+        engine_options(os.environ, app.config["SQLALCHEMY_DATABASE_URI"]),
+    )
+    # shards 1..N-1 of the user-owned tables; see sharding.py
+    urls = shard_urls({**os.environ, **app.config})
+    app.config["SQLALCHEMY_BINDS"] = {
+        **(app.config.get("SQLALCHEMY_BINDS") or {}),
+        **{bind_key(shard): url for shard, url in enumerate(urls, start=1)},
+        # replicas of the main database; see replicas.py
+        **{
+            replica_bind_key(replica): url
+            for replica, url in enumerate(replica_urls({**os.environ, **app.config}))
+        },
+    }
+
+    settings = {**os.environ, **app.config}
+    # structured, queued logging; see app_logging.setup_logging for the settings
+    app_logging.setup_logging(settings)
+    init_services(settings)
+    init_session_journal(app, settings)
+    init_community_stats(app, settings)
+    init_replica_heartbeat(app, settings)
+    db.init_app(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    metrics.init_metrics(app)
+    assets.init_assets(app)
+    return app
+
+
+def init_services(config):
+    """
+    (Re)builds the process-wide services from a mapping of settings. They are
+    shared by every app in the process.
+    """
+    global email_checker, password_hasher, password_policy, user_cache  # pylint: disable=global-statement
+    global shard_router, replica_set  # pylint: disable=global-statement
+    if password_hasher is not None:
+        password_hasher.shutdown()
+    # signup email checks; see email_validation.build_validator for the settings
+    email_checker = build_validator(config)
+    if email_checker.remote is not None:
+        email_checker.remote.validate = metrics.timed(
+            email_checker.remote.validate, "email_validation"
+        )
+    # password hashing runs in a bounded process pool; see PasswordHasher.from_config
+    password_hasher = PasswordHasher.from_config(config)
+    password_policy = PasswordPolicy.from_config(config)
+    user_cache = UserCache.from_config(config, lambda user_id: User.query.get(user_id))
+    shard_router = ShardRouter.from_config(config, load_placement)
+    replica_set = ReplicaSet.from_config(config, measure_replica_lag)
 
-load_dotenv(find_dotenv())
 
+def init_session_journal(app, config):
+    """
+    Replaces the write-behind journal: on when SESSION_WRITE_BEHIND is set,
+    see SessionJournal.from_config for its other settings
+    """
+    global session_journal  # pylint: disable=global-statement
+    if session_journal is not None:
+        session_journal.stop()
+        session_journal = None
+    if str(config.get("SESSION_WRITE_BEHIND", "")).lower() in ("", "0", "false", "no"):
+        return
+    session_journal = SessionJournal.from_config(config, JournalStore(app))
+    atexit.register(session_journal.stop)
+
+    @app.before_request
+    def start_session_journal():
+        # in the worker process, not in a preloading master
+        if session_journal is not None:
+            session_journal.start()
+
+
+def init_community_stats(app, config):
+    """
+    Replaces the community statistics buffer: on unless COMMUNITY_STATS is
+    "0", merged into the stored sketches every COMMUNITY_STATS_INTERVAL
+    seconds (default 60)
+    """
+    global community_stats  # pylint: disable=global-statement
+    if community_stats is not None:
+        community_stats.stop()
+        community_stats = None
+    if str(config.get("COMMUNITY_STATS", "1")).lower() in ("0", "false", "no"):
+        return
+    community_stats = SketchBuffer(
+        SketchStore(app), interval=float(config.get("COMMUNITY_STATS_INTERVAL", 60))
+    )
+    atexit.register(community_stats.stop)
 
-app = flask.Flask(__name__, static_folder="./build/static")
-# Point SQLAlchemy to your Heroku database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.getenv("DATABASE_URL1")
-# Gets rid of a warning
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.secret_key = os.getenv("SECRET_KEY")
-uri = os.getenv("DATABASE_URL1")
 
-# rest of connection code using the connection string `uri`
-db = SQLAlchemy(app)
+def init_replica_heartbeat(app, config):
+    """
+    Replaces the replica heartbeat: on when REPLICA_DATABASE_URLS is set,
+    bumped every REPLICA_CHECK_INTERVAL seconds (default 5)
+    """
+    global replica_heartbeat  # pylint: disable=global-statement
+    if replica_heartbeat is not None:
+        replica_heartbeat.stop()
+        replica_heartbeat = None
+    if not replica_urls(config):
+        return
+    replica_heartbeat = Heartbeat.from_config(
+        config, functools.partial(beat_replica_heartbeat, app)
+    )
+    atexit.register(replica_heartbeat.stop)
 
-# first connect Heroku Postgres to SQLAlchemy
-# https://help.heroku.com/ZKNTJQSK/why-is-sqlalchemy-1-4-x-not-connecting-to-heroku-postgres
+    @app.before_request
+    def start_replica_heartbeat():
+        # in the worker process, not in a preloading master
+        if replica_heartbeat is not None:
+            replica_heartbeat.start()
 
 
 class User(UserMixin, db.Model):
@@ -55,7 +310,7 @@ class User(UserMixin, db.Model):
     def __init__(self, email, username, password):
         self.email = email
         self.username = username
-        self.password = generate_password_hash(password)
+        self.password = password_hasher.hash(password)
 
     def __repr__(self):
         """
@@ -77,29 +332,55 @@ class User(UserMixin, db.Model):
         return self.password
 
     def verify_password(self, password):
-        return check_password_hash(self.password, password)
+        return password_hasher.verify(self.password, password)
+
+    def upgrade_password_hash(self, password):
+        """
+        Re-hashes a verified password if it was stored with outdated cost
+        parameters. Returns True when the hash changed.
+        """
+        if not password_hasher.needs_rehash(self.password):
+            return False
+        self.password = password_hasher.hash(password)
+        return True
 
 
 class Instruments(db.Model):
     # TODO: Should instr_id be a compound, like Type:Name, or just an int?
+    # getCurrentInstrument looks instruments up by (user_id, instr_name)
+    # and the database page lists them a page at a time by (user_id, instr_id)
+    __table_args__ = (
+        db.Index("ix_instruments_user_id_instr_name", "user_id", "instr_name"),
+        db.Index("ix_instruments_user_id_instr_id", "user_id", "instr_id"),
+        db.Index("ix_instruments_user_id_data_version", "user_id", "data_version"),
+    )
     instr_id = db.Column(db.Integer, primary_key=True)
     compound_name = db.Column(db.String(240), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     strings = db.relationship("Strings", backref="user", lazy=True)
     instr_name = db.Column(db.String(120), nullable=False)
     instr_type = db.Column(db.String(120), nullable=False)
+    # UserDataVersion.version of the write that added the row (NULL for rows
+    # older than the change feed); the same for Strings and Sessions
+    data_version = db.Column(db.BigInteger, nullable=True)
 
 
 class Strings(db.Model):
+    __table_args__ = (
+        db.Index("ix_strings_instr_id_data_version", "instr_id", "data_version"),
+    )
     str_id = db.Column(db.Integer, primary_key=True)
     instr_id = db.Column(
-        db.Integer, db.ForeignKey("instruments.instr_id"), nullable=False
+        db.Integer, db.ForeignKey("instruments.instr_id"), nullable=False, index=True
     )
     str_name = db.Column(db.String(120), nullable=False)
     str_cost = db.Column(db.Integer, nullable=False)
+    data_version = db.Column(db.BigInteger, nullable=True)
 
 
 class Stringlifespans(db.Model):
+    # Legacy: superseded by StringLifespan/StringLifespanStats below. Import
+    # existing rows with `flask import-lifespan-blobs`.
     str_lifespan_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     # string_lifespans is a JSON object stored as a string
@@ -113,6 +394,70 @@ class Stringlifespans(db.Model):
     string_lifespans = db.Column(db.String(65535), nullable=False)
 
 
+class StringHealth(db.Model):
+    """
+    Latest health score of every string, written in bulk by
+    `flask compute-string-health` and refreshed for a string whenever a
+    session is logged on it. The analytics page and the due-for-restring
+    notices read from here.
+    """
+
+    __table_args__ = (
+        db.Index("ix_string_health_user_id_due", "user_id", "due_for_restring"),
+    )
+    str_id = db.Column(db.Integer, db.ForeignKey("strings.str_id"), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    playtime_hrs = db.Column(db.Float, nullable=False)
+    string_life = db.Column(db.Float, nullable=False)
+    health_tier = db.Column(db.SmallInteger, nullable=False)
+    cost_per_hr = db.Column(db.Float, nullable=False)
+    due_for_restring = db.Column(db.Boolean, nullable=False)
+    computed_at = db.Column(db.BigInteger, nullable=False)
+
+
+class StringLifespan(db.Model):
+    """
+    One recorded lifespan (hours played before the strings were replaced).
+    Rows are only ever appended.
+    """
+
+    lifespan_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    # the string product, e.g. "D'Addario EXL110"; matches Strings.str_name
+    string_model = db.Column(db.String(120), nullable=False, index=True)
+    # free-form origin, e.g. the "Guitar A - String B" key of a legacy blob
+    label = db.Column(db.String(240), nullable=True)
+    # Instruments.instr_type the strings were on, when known
+    instr_type = db.Column(db.String(120), nullable=True)
+    lifespan_hrs = db.Column(db.Float, nullable=False)
+    recorded_at = db.Column(db.BigInteger, nullable=False)
+    source = db.Column(db.String(16), nullable=False, default="app")
+
+
+class StringLifespanStats(db.Model):
+    """
+    Running count/mean/m2 of the lifespans of each string model across all
+    users, updated in O(1) per recorded lifespan (see running_stats)
+    """
+
+    string_model = db.Column(db.String(120), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    mean_hrs = db.Column(db.Float, nullable=False, default=0.0)
+    m2 = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class CommunitySketch(db.Model):
+    """
+    A stored sketch of the community statistics (see sketches.py), merged
+    with the deltas of every process. `version` is bumped on every merge so
+    concurrent merges can't overwrite each other.
+    """
+
+    name = db.Column(db.String(300), primary_key=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+
+
 """
 Sessions:
 - session_id (primary key)
@@ -120,11 +465,17 @@ Sessions:
 - instrument_id (relationship with instrument table) -  many:one (session:instr)
 - string_id (relationship with string table) - many:one (session:str) 
 - playtime_mins (integer) 
-- date (string)
+- date (epoch seconds)
 """
 
 
 class Sessions(db.Model):
+    # Leading string_id serves the per-string lookups, date the range queries
+    # and (user_id, data_version) the change feed
+    __table_args__ = (
+        db.Index("ix_sessions_string_id_date", "string_id", "date"),
+        db.Index("ix_sessions_user_id_data_version", "user_id", "data_version"),
+    )
     session_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
     user = db.relationship("User")
@@ -133,24 +484,353 @@ class Sessions(db.Model):
     string_id = db.Column(db.Integer, db.ForeignKey("strings.str_id"))
     string = db.relationship("Strings")
     playtime_mins = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.BigInteger, nullable=False)
+    data_version = db.Column(db.BigInteger, nullable=True)
 
 
-db.create_all()
-login_manager = LoginManager()
-login_manager.login_view = "login"
-login_manager.init_app(app)
+class StringTotals(db.Model):
+    """
+    Running playtime aggregate for one set of strings. Kept in step with
+    Sessions on every insert so /analytics can read a single row instead of
+    summing every session. Rebuild with `flask rebuild-string-totals`.
+    """
+
+    string_id = db.Column(db.Integer, db.ForeignKey("strings.str_id"), primary_key=True)
+    total_playtime_mins = db.Column(db.Integer, nullable=False, default=0)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+    first_session_date = db.Column(db.BigInteger, nullable=True)
+    last_session_date = db.Column(db.BigInteger, nullable=True)
+
+
+class SessionRollups(db.Model):
+    """
+    Playtime per string bucketed by UTC day and ISO week, maintained on every
+    session insert so time-range queries read a handful of buckets instead of
+    raw sessions. bucket_start is the epoch second the bucket starts at.
+    Rebuild with `flask rebuild-rollups`.
+    """
+
+    __table_args__ = (
+        db.UniqueConstraint(
+            "string_id", "period", "bucket_start", name="uq_session_rollups_bucket"
+        ),
+    )
+    rollup_id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    string_id = db.Column(db.Integer, db.ForeignKey("strings.str_id"), nullable=False)
+    period = db.Column(db.String(8), nullable=False)
+    bucket_start = db.Column(db.BigInteger, nullable=False)
+    total_playtime_mins = db.Column(db.Integer, nullable=False, default=0)
+    session_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class JournalCheckpoint(db.Model):
+    """
+    Sequence number of the last entry of each write-behind journal that is in
+    Sessions, updated in the same transaction as the sessions it covers
+    """
+
+    journal = db.Column(db.String(64), primary_key=True)
+    last_seq = db.Column(db.BigInteger, nullable=False)
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response to an upload sent with an Idempotency-Key header, saved in the
+    upload's transaction and returned again when the client retries it
+    """
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    key = db.Column(db.String(128), primary_key=True)
+    status = db.Column(db.SmallInteger, nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.BigInteger, nullable=False, index=True)
+
+
+class UserDataVersion(db.Model):
+    """
+    Counter bumped in the same transaction as every write to a user's
+    instruments, strings or sessions. The JSON API derives its ETags from it,
+    so an unchanged version means the client's copy is still current.
+    """
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ShardAssignment(db.Model):
+    """
+    The shard holding a user's rows. Users without a row (everyone from
+    before sharding) are on shard 0, the main database.
+    """
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    shard = db.Column(db.SmallInteger, nullable=False)
+    # set while `flask move-user` copies the user's rows; writes get a 503
+    moving = db.Column(db.Boolean, nullable=False, default=False)
+    resync_after = db.Column(db.BigInteger, nullable=True)
+
+
+# User-owned tables, kept on the user's shard; the others (users, the shard
+# lookup, lifespan statistics) only live in the main database. Sharded tables
+# can't be joined with those: read them with separate queries.
+SHARDED_MODELS = (
+    Instruments,
+    Strings,
+    StringHealth,
+    Sessions,
+    StringTotals,
+    SessionRollups,
+    JournalCheckpoint,
+    IdempotencyKey,
+    UserDataVersion,
+)
+for _model in SHARDED_MODELS:
+    _model.__table__.info["sharded"] = True
+
+
+def load_placement(user_id):
+    # on a connection of its own: it can run while the session is flushing
+    with db.engine.connect() as conn:
+        row = conn.execute(
+            db.select(
+                [
+                    ShardAssignment.shard,
+                    ShardAssignment.moving,
+                    ShardAssignment.resync_after,
+                ]
+            ).where(ShardAssignment.user_id == user_id)
+        ).first()
+    return Placement(*row) if row else None
+
+
+def current_shard():
+    """
+    Shard for statements on sharded tables: the one selected with on_shard()
+    or for_user(), else the logged in user's
+    """
+    shard = flask.g.get("shard")
+    if shard is None:
+        if not (flask.has_request_context() and current_user.is_authenticated):
+            raise NoShardSelected("Select a shard with on_shard() or for_user().")
+        shard = flask.g.shard = shard_router.shard_for(current_user.id)
+    return shard
+
+
+@contextmanager
+def on_shard(shard):
+    previous = flask.g.get("shard")
+    flask.g.shard = shard
+    try:
+        yield shard
+    finally:
+        flask.g.shard = previous
+
+
+def for_user(user_id):
+    return on_shard(shard_router.shard_for(user_id))
+
+
+def shard_engine(shard):
+    return db.get_engine(flask.current_app, bind=bind_key(shard))
+
+
+def per_shard(command):
+    """
+    Runs a maintenance command on every shard in turn, or only on the
+    selected one when another command running per shard invokes it
+    """
+
+    @functools.wraps(command)
+    def wrapper(*args, **kwargs):
+        if flask.g.get("shard") is not None:
+            return command(*args, **kwargs)
+        for shard in range(shard_router.count):
+            with on_shard(shard):
+                command(*args, **kwargs)
+        return None
+
+    return wrapper
+
+
+@bp.before_app_request
+def select_shard():
+    """
+    Pins the request to the logged in user's shard, and turns writes away
+    while the user is being moved to another one
+    """
+    if not shard_router.sharded or not current_user.is_authenticated:
+        return
+    placement = shard_router.placement(current_user.id)
+    flask.g.shard = placement.shard
+    if placement.moving and flask.request.method not in SAFE_METHODS:
+        raise ShardMoving()
+
+
+class ReplicaHeartbeat(db.Model):
+    """
+    A single row whose timestamp every process bumps on the primary; how old
+    a replica's copy of it is tells how far the replica is behind
+    """
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.Float, nullable=False)
+
+
+def measure_replica_lag(replica):
+    """
+    Seconds replica `replica` is behind the primary: how much older its
+    heartbeat is than the primary's. Only reads; beat_replica_heartbeat
+    bumps the primary's.
+    """
+    heartbeat = ReplicaHeartbeat.__table__
+    query = db.select([heartbeat.c.beat_at]).where(heartbeat.c.id == 1)
+    app = flask.current_app
+    with db.get_engine(app, bind=replica_bind_key(replica)).connect() as conn:
+        replica_beat = conn.execute(query).scalar()
+    with db.engine.connect() as conn:
+        primary_beat = conn.execute(query).scalar()
+    if primary_beat is None:
+        return 0.0
+    if replica_beat is None:
+        return float("inf")
+    return max(0.0, primary_beat - replica_beat)
+
+
+def beat_replica_heartbeat(app):
+    """
+    Bumps the heartbeat row on the primary, from the Heartbeat thread
+    """
+    with app.app_context():
+        now = time.time()
+        upsert(ReplicaHeartbeat, {"id": 1, "beat_at": now}, ["id"], {"beat_at": now})
+        db.session.commit()
+
+
+def current_replica():
+    """
+    Replica for the reads of this request, or None for the primary: only in
+    views marked with replica_reads, and never for a user who just wrote
+    """
+    if not (replica_set is not None and replica_set.count):
+        return None
+    if not flask.has_request_context() or not flask.g.get("replica_reads"):
+        return None
+    if flask.g.get("wrote_primary"):
+        return None
+    if "replica" not in flask.g:
+        sticky = flask.session.get("primary_until", 0) > time.time()
+        flask.g.replica = None if sticky else replica_set.choose()
+    return flask.g.replica
+
+
+def note_primary_write():
+    if flask.has_request_context():
+        flask.g.wrote_primary = True
+
+
+def replica_reads(view):
+    """
+    Lets a read-only view, and the helpers it calls (getUserInstrumentNames,
+    getCurrentInstrument, ...), read from a replica. Goes below
+    login_required, so the user is still loaded from the primary.
+    """
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        flask.g.replica_reads = True
+        return flask.current_app.ensure_sync(view)(*args, **kwargs)
+
+    return wrapper
+
+
+"""
+Async views. Flask runs an `async def` view in an event loop of its own, so
+the view can wait on the email validation API while it queries the database
+instead of one after the other. Blocking calls are awaited with run_sync,
+which runs them in a worker thread so the loop keeps going; the request's
+app context, g and current_user come along.
+
+This only shortens a request. The server is still WSGI (gunicorn gthread),
+so an async view holds its worker thread until it returns, and the queries
+still go through the synchronous driver: capacity is what it was.
+"""
+
+
+async def run_sync(func, *args):
+    """
+    Awaits func(*args) in a worker thread, with a database session of its
+    own that is closed afterwards: ORM objects it returns are detached
+    """
+    owner = object()
+
+    def call():
+        _session_owner.set(owner)
+        try:
+            return func(*args)
+        finally:
+            db.session.remove()
+
+    # `call` runs in a copy of this context, so the owner set there doesn't
+    # leak into the view's own session
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, functools.partial(context.run, call)
+    )
+
+
+async def run_concurrently(*calls):
+    """
+    Runs independent blocking calls, (func, *args) tuples, at once with
+    run_sync and returns their results in order. Each call that queries takes
+    a database connection of its own while it runs, so the views overlap at
+    most one database call with calls that don't query (the email API).
+    """
+    return await asyncio.gather(*(run_sync(*call) for call in calls))
+
+
+@bp.after_app_request
+def stick_to_primary(response):
+    """
+    Serves a user from the primary for a while after each of their writes,
+    so pages never miss them while a replica catches up
+    """
+    if replica_set.count and (
+        flask.request.method not in SAFE_METHODS or flask.g.get("wrote_primary")
+    ):
+        flask.session["primary_until"] = time.time() + replica_set.sticky
+    return response
+
+
+@bp.app_errorhandler(ShardMoving)
+def shard_moving(error):
+    return flask.make_response(
+        "Your data is being moved, please try again in a moment.",
+        503,
+        {"Retry-After": "5"},
+    )
+
+
+@bp.app_errorhandler(PoolSaturated)
+def password_pool_saturated(error):
+    """
+    Sheds login/signup load when the password hashing pool is full
+    """
+    return flask.make_response(
+        "The server is busy, please try again in a moment.", 503, {"Retry-After": "1"}
+    )
 
 
 @login_manager.user_loader
 def load_user(user_name):
     """
-    Required by flask_login
+    Required by flask_login. Returns a cached UserSnapshot; use
+    User.query.get(current_user.id) where the ORM object is needed.
     """
-    return User.query.get(user_name)
+    return user_cache.get(user_name)
 
 
-@app.route("/index")
+@bp.route("/index")
 @login_required
 def index():
     """
@@ -160,14 +840,14 @@ def index():
     return flask.render_template("index.html")
 
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     logout_user()
-    return flask.redirect(flask.url_for("login"))
+    return flask.redirect(flask.url_for("tracker.login"))
 
 
-@app.route("/signup")
+@bp.route("/signup")
 def signup():
     """
     Signup endpoint for GET requests
@@ -175,10 +855,11 @@ def signup():
     return flask.render_template("signup.html")
 
 
-@app.route("/signup", methods=["POST"])
-def signup_post():
+@bp.route("/signup", methods=["POST"])
+async def signup_post():
     """
-    Handler for signup form data
+    Handler for signup form data. The email check and the uniqueness
+    lookups are independent, so they run concurrently.
     """
     email = flask.request.form.get("email")
     username = flask.request.form.get("username")
@@ -187,19 +868,21 @@ def signup_post():
         signup_flash = Markup("Please fill in all account information.")
         return flask.render_template("signup.html", signup_flash=signup_flash)
 
-    password_safe = password_meet_requirements(
-        password
-    )  # does password meet requrements? T or F?
+    password_check = password_policy.check(password)
+    password_safe = password_check.passed
     # email_ending_valid = check_email(email)
-    email_validator_status = email_validator(email)
-    print("PASSWORD TRIALS!!!")
-    print(password_safe)
-    print(email_validator_status)
-    print(password)
+    email_validator_status, (user_byusername, user_byemail) = await run_concurrently(
+        (email_validator, email), (find_signup_conflicts, username, email)
+    )
+    logger.debug(
+        "signup checks",
+        extra={
+            "failed_rules": password_check.failed_rules,
+            "email_status": email_validator_status,
+        },
+    )
 
     if password_safe and email_validator_status == "valid":
-        user_byusername = get_user_by_username(username)
-        user_byemail = get_user_by_email(email)
         if user_byusername:
             signup_flash = Markup(
                 "Username taken. Please pick another username, or login with your existing account."
@@ -213,15 +896,13 @@ def signup_post():
             return flask.render_template("signup.html", signup_flash=signup_flash)
 
         else:
-            user = User(email=email, username=username, password=password)
-            db.session.add(user)
-            db.session.commit()
-            return flask.redirect(flask.url_for("login"))
+            await run_sync(create_user, email, username, password)
+            return flask.redirect(flask.url_for("tracker.login"))
     else:
         if password_safe == False:
-            signup_flash = Markup(
-                "Password not secure enough.<br>Password must meet the following requirements:<br>1. At least 1 special character:  ~`! @#$%^&*()_-+={[}]|\:;\"'<,>.?/ <br>2. Must contain both uppercase and lowercase letters.<br>3. Must be 8 characters or longer.<br>4. Must contain at least one number 0-9."
-            )
+            signup_flash = Markup("Password not secure enough.<br>") + Markup(
+                "<br>"
+            ).join(failure.message for failure in password_check.failures)
             return flask.render_template("signup.html", signup_flash=signup_flash)
         elif email_validator_status == "invalid":
             signup_flash = Markup(
@@ -230,27 +911,43 @@ def signup_post():
             return flask.render_template("signup.html", signup_flash=signup_flash)
 
 
-@app.route("/login")
+def create_user(email, username, password):
+    """
+    Adds a user and, when sharded, their shard assignment, in one transaction
+    """
+    user = User(email=email, username=username, password=password)
+    db.session.add(user)
+    if shard_router.sharded:
+        db.session.flush()
+        db.session.add(
+            ShardAssignment(user_id=user.id, shard=shard_router.new_user_shard(user.id))
+        )
+    db.session.commit()
+    # placements load on a connection of their own, so a lookup made before
+    # the commit cached a miss (shard 0); drop it
+    shard_router.invalidate(user.id)
+
+
+@bp.route("/login")
 def login():
     return flask.render_template("login.html")
 
 
-@app.route("/login", methods=["POST"])
-def login_post():
+@bp.route("/login", methods=["POST"])
+async def login_post():
     email = flask.request.form.get("email")
     password = flask.request.form.get("password")
-    user = get_user_by_email(email)
-    user_exists = user_login_success(user, password)
-    if user_exists:
-        print(user_exists)
-        print(user)
+    # one worker thread and session for the lookup, the password check
+    # (which waits on the hashing pool) and the rehash
+    user = await run_sync(authenticate, email, password)
+    if user is not None:
         login_user(user)
-        print("DO WE GET HERE")
+        logger.info("user logged in", extra={"user_id": user.id})
         # return flask.render_template("home.html") #manual patch to get to home, but anywhere @login_required is, it wont work
-        return flask.redirect(flask.url_for("home"))
+        return flask.redirect(flask.url_for("tracker.home"))
     else:
         flask.flash("Invalid email/password. Retry or Sigin Up.")
-        return flask.redirect(flask.url_for("login"))
+        return flask.redirect(flask.url_for("tracker.login"))
 
 
 """
@@ -268,128 +965,67 @@ def get_user_by_email(email):
     return user
 
 
+def find_signup_conflicts(username, email):
+    """
+    The users that already have this username and this email (or None), looked
+    up one after the other on one connection
+    """
+    return get_user_by_username(username), get_user_by_email(email)
+
+
+def authenticate(email, password):
+    """
+    The user with this email and password, or None. A password hash made with
+    outdated cost parameters is replaced and committed.
+    """
+    user = get_user_by_email(email)
+    if not user_login_success(user, password):
+        return None
+    if user.upgrade_password_hash(password):
+        db.session.commit()
+        # loaded again now, as the caller gets it detached
+        db.session.refresh(user)
+    return user
+
+
 def user_login_success(user, password):
     if user and user.verify_password(password):
-        print("USER IS VERIFIED")
         return True
     else:
-        print("USER UNABLE TO BE VERIFIED")
+        logger.info("login failed", extra={"user_found": user is not None})
         return False
 
 
 def password_meet_requirements(password):
-    contains_special_char = does_contains_special_char(password)
-    contains_number = does_contains_number(password)
-    mixed_case = is_mixed_case(password)
-    if len(password) >= 8 and contains_special_char and contains_number and mixed_case:
-        return True
-    else:
-        return False
+    return password_policy.check(password).passed
 
 
 def does_contains_special_char(password):
-    if (
-        ("!" in password)
-        or ("@" in password)
-        or ("~" in password)
-        or ("#" in password)
-        or ("$" in password)
-        or ("%" in password)
-        or ("^" in password)
-        or ("^" in password)
-        or ("&" in password)
-        or ("*" in password)
-        or ("(" in password)
-        or (")" in password)
-        or ("_" in password)
-        or ("-" in password)
-        or ("+" in password)
-        or ("=" in password)
-        or ("{" in password)
-        or ("}" in password)
-        or ("[" in password)
-        or ("]" in password)
-        or (":" in password)
-        or (";" in password)
-        or ("'" in password)
-        or ('"' in password)
-        or ("<" in password)
-        or (">" in password)
-        or ("," in password)
-        or ("." in password)
-        or ("?" in password)
-        or ("/" in password)
-    ):
-        return True
-    else:
-        return False
+    return bool(password_policy.classify(password) & SPECIAL)
 
 
 def does_contains_number(password):
-    if (
-        ("0" in password)
-        or ("1" in password)
-        or ("2" in password)
-        or ("3" in password)
-        or ("4" in password)
-        or ("5" in password)
-        or ("6" in password)
-        or ("7" in password)
-        or ("8" in password)
-        or ("9" in password)
-    ):
-        return True
-    else:
-        return False
-
-
-def is_mixed_case(
-    password,
-):  # are there upper and lowercase letters? https://www.kite.com/python/answers/how-to-check-if-a-string-is-upper,-lower,-or-mixed-case-in-python
-    if password.islower() or password.isupper():
-        return False
-    elif not password.islower() and not password.isupper():
-        return True
-    else:
-        return False
+    return bool(password_policy.classify(password) & NUMBER)
 
 
-def check_email(email):
-    if (
-        email.endswith("@gmail.com")
-        or email.endswith("@yahoo.com")
-        or email.endswith("@aol.com")
-        or email.endswith("@hotmail.com")
-    ):
-        return True
-    else:
-        return False
+def is_mixed_case(password):
+    seen = password_policy.classify(password)
+    return bool(seen & UPPER and seen & LOWER)
 
 
 def email_validator(email):
-    email_valid_status = ""
-    response = requests.get(
-        "https://isitarealemail.com/api/email/validate", params={"email": email}
-    )
-    status = response.json()["status"]
-    if status == "valid":
-        email_valid_status = "valid"
-    elif status == "invalid":
-        email_valid_status = "invalid"
-    else:
-        email_valid_status = "invalid"
-    return email_valid_status
+    return email_checker.validate(email)
 
 
-@app.route("/")
+@bp.route("/")
 def main():
     """
     Main page just reroutes to index or login depending on whether the
     user is authenticated
     """
     if current_user.is_authenticated:
-        return flask.redirect(flask.url_for("home"))
-    return flask.redirect(flask.url_for("login"))
+        return flask.redirect(flask.url_for("tracker.home"))
+    return flask.redirect(flask.url_for("tracker.login"))
 
 
 """
@@ -397,85 +1033,30 @@ Code for String Squad's HTML:
 """
 
 
-@app.route("/home")
+@bp.route("/home")
 @login_required
+@replica_reads
 def home():
-    try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
-        )
-    except AttributeError:
-        curr_instr_name = ""
-
-    try:
-        curr_str_name = (
-            Strings.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .str_name
-        )
-    except AttributeError:
-        curr_str_name = ""
-
+    context = get_current_context()
     return flask.render_template(
-        "home.html", curr_instr_name=curr_instr_name, curr_str_name=curr_str_name
+        "home.html",
+        curr_instr_name=context.instr_name,
+        curr_str_name=context.str_name,
+        strings_due=get_strings_due(current_user.id),
     )
 
 
-@app.route("/database", methods=["GET"])
+@bp.route("/database", methods=["GET"])
 @login_required
+@replica_reads
 def database():
-    print("Proc'ing database GET:")
-    instr_names = getUserInstrumentNames()
-    instr_names_len = int(len(instr_names))
-
-    print("O_O")
-    print(type(instr_names_len))
-
-    str_names = getUserStringNames()
-    str_names_len = int(len(str_names))
-
-    try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
-        )
-    except AttributeError:
-        curr_instr_name = ""
-
-    # get current string name
-    try:
-        curr_str_name = (
-            Strings.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .str_name
-        )
-    except AttributeError:
-        curr_str_name = ""
-
-    return flask.render_template(
-        "database.html",
-        curr_instr_name=curr_instr_name,
-        instr_names=instr_names,
-        instr_names_len=instr_names_len,
-        str_names=str_names,
-        str_names_len=str_names_len,
-        curr_str_name=curr_str_name,
-    )
-
-
-def validate_new_instr_form(instr_name, instr_type):
-    if instr_name != "" and instr_type != "":
-        return True
-    return False
+    context = get_current_context()
+    return render_database(context.instr_name, context.str_name)
 
 
-@app.route("/database", methods=["POST"])
+@bp.route("/database", methods=["POST"])
 @login_required
 def database_post():
-    print("/database POST request received.")
     instr_type = flask.request.form.get("instr_type")
     instr_name = flask.request.form.get("instr_name")
     compound_name = getCompoundName(instr_name, instr_type)
@@ -486,206 +1067,1122 @@ def database_post():
 
     if not is_valid:
         # TODO: Return to database.HTML and don't add to DB
-        print("Implement this")
+        logger.warning(
+            "invalid instrument form",
+            extra={"instr_name": instr_name, "instr_type": instr_type},
+        )
 
     new_instr = Instruments(
         compound_name=compound_name,
         user_id=user_id,
         instr_name=instr_name,
         instr_type=instr_type,
+        data_version=bump_data_version(user_id),
     )
-    print(f"Adding {new_instr} to DB.")
     db.session.add(new_instr)
     db.session.commit()
 
-    set_of_instr = current_user.instruments
-
-    added_instr_id = 0
-    for instr in set_of_instr:
-        if instr.instr_name == instr_name:
-            added_instr_id = instr.instr_id
+    set_current_instrument(new_instr.instr_id)
+    logger.info(
+        "instrument added",
+        extra={"user_id": user_id, "instr_id": new_instr.instr_id},
+    )
 
-    current_user.current_instr_id = added_instr_id
+    context = get_current_context()
+    return render_database(context.instr_name, context.str_name)
 
-    db.session.add(current_user)
-    db.session.commit()
 
-    print(f"user1 is {current_user.id}")
-    print(f"attached instrument id {current_user.current_instr_id}")
+@bp.route("/addsession", methods=["POST"])
+@login_required
+async def addsession_post():
+    playtime_mins = flask.request.form.get("playmins", "").strip()
 
-    instr_names = getUserInstrumentNames()
-    instr_names_len = int(len(instr_names))
+    user_id = current_user.id
 
-    str_names = getUserStringNames()
-    str_names_len = int(len(str_names))
+    context = await run_sync(get_write_context)
 
-    try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
+    if not playtime_mins.isdigit() or int(playtime_mins) == 0:
+        session_flash = Markup(
+            "Please enter your playtime as a whole number of minutes."
         )
-    except AttributeError:
-        curr_instr_name = ""
+        return flask.render_template(
+            "home.html",
+            curr_instr_name=context.instr_name,
+            curr_str_name=context.str_name,
+            strings_due=await run_sync(get_strings_due, user_id),
+            session_flash=session_flash,
+        )
+
+    session_row = {
+        "user_id": user_id,
+        "instr_id": context.instr_id,
+        "string_id": context.str_id,
+        "playtime_mins": int(playtime_mins),
+        "date": time_buckets.now(),
+    }
+    if session_journal is not None:
+        # appending waits for an fsync
+        await run_sync(session_journal.append, session_row)
+    else:
+        # in a worker thread's session, like every other query of the view
+        await run_sync(insert_session_batch, user_id, [session_row])
+    logger.debug("session added", extra=session_row)
 
     return flask.render_template(
-        "database.html",
-        instr_names=instr_names,
-        instr_names_len=instr_names_len,
-        curr_instr_name=curr_instr_name,
-        str_names=str_names,
-        str_names_len=str_names_len,
+        "home.html",
+        curr_instr_name=context.instr_name,
+        curr_str_name=context.str_name,
+        strings_due=await run_sync(get_strings_due, user_id),
     )
 
 
-@app.route("/addsession", methods=["POST"])
-@login_required
-def addsession_post():
-    print("/addsession POST request received.")
-    playtime_mins = flask.request.form.get("playmins")
+def build_string_lookup(user_id):
+    """
+    Maps (instrument name, string name) to (instr_id, str_id) for every string
+    the user owns, in one query, so imports resolve names without the DB
+    """
+    rows = (
+        db.session.query(
+            Instruments.instr_name,
+            Strings.str_name,
+            Instruments.instr_id,
+            Strings.str_id,
+        )
+        .join(Strings, Strings.instr_id == Instruments.instr_id)
+        .filter(Instruments.user_id == user_id)
+        .order_by(Strings.str_id)
+    )
+    lookup = {}
+    for instr_name, str_name, instr_id, str_id in rows:
+        # like the rest of the app, the set fitted last wins on a name clash
+        lookup[(instr_name, str_name)] = (instr_id, str_id)
+    return lookup
 
-    user_id = current_user.id
 
-    # get current string id
-    curr_instr_id = current_user.current_instr_id
-    try:
-        curr_string_id = Strings.query.filter_by(instr_id=curr_instr_id).first().str_id
-    except AttributeError:
-        curr_string_id = ""
+def add_session_rows(user_id, rows):
+    """
+    Inserts sessions of one user with one multi-row statement and folds them
+    into the totals and rollups, in the caller's transaction. Returns the
+    data version they were stamped with.
+    """
+    version = bump_data_version(user_id)
+    for row in rows:
+        row["user_id"] = user_id
+        row["data_version"] = version
+    db.session.execute(Sessions.__table__.insert(), rows)
+    record_session_aggregates(rows)
+    return version
 
-    # TODO: add in form validation
-    new_session = Sessions(
-        user_id=user_id,
-        instr_id=curr_instr_id,
-        string_id=curr_string_id,
-        playtime_mins=playtime_mins,
-        date="12022021",  # TODO: get actual date
-    )
-    print(f"adding new session: {new_session} to DB")
-    db.session.add(new_session)
-    db.session.commit()
 
+def insert_session_batch(user_id, rows):
+    """
+    Inserts a batch of sessions in a single transaction
+    """
     try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
+        add_session_rows(user_id, rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def write_journal_batch(journal, entries):
+    """
+    Inserts (seq, row) entries of a write-behind journal like
+    insert_session_batch: one transaction per shard, which also advances the
+    journal's checkpoint on that shard. Entries behind a shard's checkpoint
+    were written before and are skipped.
+    """
+    by_shard = {}
+    for seq, row in entries:
+        placement = shard_router.placement(row["user_id"])
+        if placement.moving:
+            raise ShardMoving(f"user {row['user_id']} is being moved")
+        by_shard.setdefault(placement.shard, []).append((seq, row))
+    for shard, shard_entries in sorted(by_shard.items()):
+        with on_shard(shard):
+            write_journal_shard(journal, shard_entries)
+
+
+def get_journal_checkpoint(journal):
+    row = (
+        db.session.query(JournalCheckpoint.last_seq).filter_by(journal=journal).first()
+    )
+    return row[0] if row else 0
+
+
+def write_journal_shard(journal, entries):
+    try:
+        last_seq = get_journal_checkpoint(journal)
+        entries = [entry for entry in entries if entry[0] > last_seq]
+        if not entries:
+            return
+        versions = {
+            user_id: bump_data_version(user_id)
+            for user_id in sorted({row["user_id"] for _, row in entries})
+        }
+        rows = [dict(row, data_version=versions[row["user_id"]]) for _, row in entries]
+        db.session.execute(Sessions.__table__.insert(), rows)
+        record_session_aggregates(rows)
+        last_seq = entries[-1][0]
+        upsert(
+            JournalCheckpoint,
+            {"journal": journal, "last_seq": last_seq},
+            ["journal"],
+            {"last_seq": last_seq},
         )
-    except AttributeError:
-        curr_instr_name = ""
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+class JournalStore:
+    """
+    Database side of the session journal. It runs on the journal's thread,
+    so every call has an app context of its own.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def last_seq(self, journal):
+        # write() skips what each shard has, so the lowest checkpoint will do
+        with self.app.app_context():
+            checkpoints = []
+            for shard in range(shard_router.count):
+                with on_shard(shard):
+                    checkpoints.append(get_journal_checkpoint(journal))
+            return min(checkpoints)
+
+    def write(self, journal, entries):
+        with self.app.app_context():
+            write_journal_batch(journal, entries)
+
+    def forget(self, journal):
+        with self.app.app_context():
+            for shard in range(shard_router.count):
+                with on_shard(shard):
+                    JournalCheckpoint.query.filter_by(journal=journal).delete()
+                    db.session.commit()
+
+
+def buffered_sessions(user_id):
+    """
+    The user's sessions still waiting in this process's write-behind journal,
+    for reads that must include them
+    """
+    if session_journal is None:
+        return []
+    return session_journal.pending(user_id)
+
+
+def run_session_import(user_id, stream, fmt):
+    """
+    Imports a CSV/JSONL stream of sessions for one user and returns the report
+    """
+    lookup = build_string_lookup(user_id)
+    return import_sessions(
+        stream,
+        fmt,
+        lookup,
+        lambda rows: insert_session_batch(user_id, rows),
+        batch_size=flask.current_app.config.get("IMPORT_BATCH_SIZE", 500),
+    )
+
 
+@bp.route("/import_sessions", methods=["POST"])
+@login_required
+def import_sessions_post():
+    """
+    Bulk import of practice sessions from an uploaded CSV or JSONL file.
+    Responds with a JSON report of imported rows and per-row errors.
+    """
+    upload = flask.request.files.get("sessions_file")
+    if upload is None or upload.filename == "":
+        return flask.jsonify(error="Please choose a CSV or JSONL file."), 400
     try:
-        curr_str_name = (
-            Strings.query.filter_by(instr_id=current_user.current_instr_id)
+        fmt = detect_format(upload.filename, flask.request.form.get("format"))
+    except ValueError as exc:
+        return flask.jsonify(error=str(exc)), 400
+
+    # werkzeug spools large uploads to disk, so this streams from a temp file
+    stream = io.TextIOWrapper(upload.stream, encoding="utf-8", newline="")
+    report = run_session_import(current_user.id, stream, fmt)
+    reset_current_context()
+    return flask.jsonify(report.to_dict())
+
+
+@bp.cli.command("import-sessions")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "email", required=True, help="Email of the owning user.")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None)
+def import_sessions_command(path, email, fmt):
+    """
+    Bulk imports practice sessions for a user from a CSV or JSONL file
+    """
+    user = get_user_by_email(email)
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    fmt = detect_format(path, fmt)
+    with open(path, encoding="utf-8", newline="") as stream, for_user(user.id):
+        report = run_session_import(user.id, stream, fmt)
+    logger.info("Imported %d sessions, %d rows failed.", report.imported, report.failed)
+    for error in report.errors:
+        logger.warning(
+            "session row rejected", extra={"line": error.line, "error": error.error}
+        )
+
+
+def analytics_summary():
+    """
+    Health, playtime and cost per hour of the current string, as shown on the
+    analytics page
+    """
+    context = get_current_context()
+    if context.str_id is None:
+        return analytics_figures(context)
+    buffered_mins = buffered_string_mins(context.str_id)
+    health = get_string_health(context.str_id, buffered_mins)
+    recent_mins = minutes_played_since(context.str_id, 30)
+    return analytics_figures(context, health, recent_mins + buffered_mins)
+
+
+def buffered_string_mins(str_id):
+    # sessions this user just logged in write-behind mode count too
+    return sum(
+        row["playtime_mins"]
+        for row in buffered_sessions(current_user.id)
+        if row["string_id"] == str_id
+    )
+
+
+def analytics_figures(context, health=None, recent_mins=0):
+    if health is None:
+        return {
+            "current_instr_name": context.instr_name,
+            "current_str_name": context.str_name,
+            "string_health": 3,
+            "total_playtime_hrs": 0,
+            "recent_playtime_hrs": 0,
+            "avg_cost_hr": 0,
+        }
+    return {
+        "current_instr_name": context.instr_name,
+        "current_str_name": context.str_name,
+        "string_health": health["health_tier"],
+        "total_playtime_hrs": round(health["playtime_hrs"], 2),
+        "recent_playtime_hrs": round(recent_mins / 60, 2),
+        "avg_cost_hr": round(health["cost_per_hr"], 2),
+    }
+
+
+# Community statistics: sketches over every user's strings, sessions and
+# lifespans, so the community page costs a few primary key reads however
+# much data there is. See sketches.py for their error bounds.
+PLAYTIME_SKETCH = "string_playtime"
+FITTED_SKETCH = "string_sets"
+PLAYERS_SKETCH = "players"
+
+
+def players_sketch_name(string_model):
+    return f"players:{string_model}"
+
+
+def lifespan_sketch_name(string_model, instr_type=None):
+    if instr_type:
+        return f"lifespan:{string_model}|{instr_type.lower()}"
+    return f"lifespan:{string_model}"
+
+
+def new_players_sketch():
+    return HyperLogLog(p=14)
+
+
+def new_model_players_sketch():
+    # one per string model, so smaller: about 3% error in 1 KB
+    return HyperLogLog(p=10)
+
+
+def count_strings_fitted(user_id, string_model):
+    if community_stats is None:
+        return
+    community_stats.add(FITTED_SKETCH, CountMinSketch, string_model)
+    community_stats.add(
+        players_sketch_name(string_model), new_model_players_sketch, user_id
+    )
+
+
+def count_sessions(rows, names):
+    """
+    Folds newly added sessions (dicts of Sessions column values) into the
+    playtime and player sketches; `names` maps their string ids to names
+    """
+    if community_stats is None:
+        return
+    for row in rows:
+        community_stats.add(PLAYERS_SKETCH, new_players_sketch, row["user_id"])
+        name = names.get(row["string_id"])
+        if name is None:
+            continue
+        community_stats.add(PLAYTIME_SKETCH, CountMinSketch, name, row["playtime_mins"])
+        community_stats.add(
+            players_sketch_name(name), new_model_players_sketch, row["user_id"]
+        )
+
+
+def count_lifespan(string_model, lifespan_hrs, instr_type=None):
+    if community_stats is None:
+        return
+    community_stats.add(
+        lifespan_sketch_name(string_model), QuantileSketch, lifespan_hrs
+    )
+    if instr_type:
+        community_stats.add(
+            lifespan_sketch_name(string_model, instr_type), QuantileSketch, lifespan_hrs
+        )
+
+
+def merge_sketch(name, delta):
+    """
+    Merges a sketch into the stored one of the same name and commits. The
+    UPDATE only applies while the row is still the one read, so a concurrent
+    merge makes this one read and merge again instead of being lost.
+    """
+    while True:
+        row = (
+            db.session.query(CommunitySketch.data, CommunitySketch.version)
+            .filter_by(name=name)
             .first()
-            .str_name
         )
-    except AttributeError:
-        curr_str_name = ""
+        if row is None:
+            db.session.add(
+                CommunitySketch(name=name, data=sketches.dumps(delta), version=1)
+            )
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:
+                db.session.rollback()
+                continue
+        merged = sketches.loads(row.data).merge(delta)
+        updated = CommunitySketch.query.filter_by(
+            name=name, version=row.version
+        ).update(
+            {
+                CommunitySketch.data: sketches.dumps(merged),
+                CommunitySketch.version: row.version + 1,
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if updated:
+            return
+
+
+class SketchStore:
+    """
+    Stores the community statistics deltas of a SketchBuffer, from its
+    background thread
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def merge(self, name, sketch):
+        with self.app.app_context():
+            merge_sketch(name, sketch)
 
+
+def load_sketches(*names):
+    """
+    Stored sketches by name; missing ones are None
+    """
+    rows = CommunitySketch.query.filter(CommunitySketch.name.in_(names)).all()
+    stored = {row.name: sketches.loads(row.data) for row in rows}
+    return [stored.get(name) for name in names]
+
+
+def community_summary(string_model=None, instr_type=None, top=10):
+    """
+    Community statistics from the stored sketches, with their error bounds.
+    Folded writes show up once their process merges them (see
+    COMMUNITY_STATS_INTERVAL).
+    """
+    playtime, fitted, players = load_sketches(
+        PLAYTIME_SKETCH, FITTED_SKETCH, PLAYERS_SKETCH
+    )
+    summary = {
+        "players": round(players.count()) if players else 0,
+        "players_error_pct": round(new_players_sketch().standard_error * 100, 1),
+        "most_played": [
+            {"string": name, "playtime_hrs": round(mins / 60, 1)}
+            for name, mins in (playtime.most_common(top) if playtime else [])
+        ],
+        "most_played_error_hrs": round(playtime.error_bound / 60, 1) if playtime else 0,
+        "most_fitted": [
+            {"string": name, "fitted": count}
+            for name, count in (fitted.most_common(top) if fitted else [])
+        ],
+        "most_fitted_error": round(fitted.error_bound, 1) if fitted else 0,
+        "string": None,
+    }
+    if string_model:
+        model_players, lifespans = load_sketches(
+            players_sketch_name(string_model),
+            lifespan_sketch_name(string_model, instr_type),
+        )
+        summary["string"] = {
+            "string": string_model,
+            "instr_type": instr_type or None,
+            "players": round(model_players.count()) if model_players else 0,
+            "players_error_pct": round(
+                new_model_players_sketch().standard_error * 100, 1
+            ),
+            "lifespans": lifespans.count if lifespans else 0,
+            "lifespan_hrs": {
+                name: round(lifespans.quantile(q), 1) if lifespans else None
+                for name, q in (("p10", 0.1), ("median", 0.5), ("p90", 0.9))
+            },
+            "lifespan_error_pct": QuantileSketch().alpha * 100,
+        }
+    return summary
+
+
+@bp.route("/community")
+@login_required
+@replica_reads
+def community():
+    string_model = flask.request.args.get("string", "").strip()
+    instr_type = flask.request.args.get("instr_type", "").strip()
     return flask.render_template(
-        "home.html", curr_instr_name=curr_instr_name, curr_str_name=curr_str_name
+        "community.html",
+        **community_summary(string_model, instr_type),
+        string_model=string_model,
+        instr_type=instr_type,
     )
 
 
-@app.route("/analytics")
+@bp.route("/api/community")
 @login_required
-def analytics():
-    try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
+def api_community():
+    return flask.jsonify(
+        community_summary(
+            flask.request.args.get("string", "").strip(),
+            flask.request.args.get("instr_type", "").strip(),
         )
-    except AttributeError:
-        curr_instr_name = ""
+    )
 
-    # get current string
-    curr_instr_id = current_user.current_instr_id
-    try:
-        curr_str = Strings.query.filter_by(instr_id=curr_instr_id).first()
-    except AttributeError:
-        curr_str = ""
 
-    # get the id, name, cost of the current string
-    try:
-        curr_str_id = curr_str.str_id
-        curr_str_name = curr_str.str_name
-        curr_str_cost = curr_str.str_cost
-    except AttributeError:
-        curr_str_id = ""
-        curr_str_name = ""
-        curr_str_cost = 0
-
-    # get all the sessions associated with our string
-
-    print("do we get a string?????")
-    print(curr_str)
-
-    if curr_str == None:
-        string_health = (3,)
-        current_instr_name = ""
-        current_str_name = ""
-        total_playtime_hrs = 0
-        avg_cost_hr = 0
+@bp.route("/analytics")
+@login_required
+@replica_reads
+async def analytics():
+    return flask.render_template("analytics.html", **await run_sync(analytics_summary))
+
+
+"""
+JSON API: the same data as the pages, for clients that only need to refresh
+a few numbers. Responses carry an ETag built from the user's data version, so
+a conditional GET of unchanged data is answered with a 304 before any of the
+page queries run.
+"""
+API_VERSION = 1
+
+
+def get_data_version(user_id):
+    row = db.session.query(UserDataVersion.version).filter_by(user_id=user_id).first()
+    return row[0] if row else 0
+
+
+def bump_data_version(user_id):
+    """
+    Marks the user's data as changed and returns the new version, which the
+    rows of the write are stamped with. Runs in the caller's transaction, so
+    commit alongside the write it describes; the updated row stays locked
+    until then, so a user's versions are committed in order.
+    """
+    upsert(
+        UserDataVersion,
+        {"user_id": user_id, "version": 1},
+        ["user_id"],
+        {"version": UserDataVersion.__table__.c.version + 1},
+    )
+    return get_data_version(user_id)
+
+
+def conditional_json(build, *etag_parts):
+    """
+    Answers a GET with build()'s result as JSON, or with 304 Not Modified when
+    If-None-Match matches the current ETag (build is not called then).
+    etag_parts add whatever else the payload depends on.
+    """
+    version = get_data_version(current_user.id)
+    etag = "-".join(
+        str(part) for part in (API_VERSION, current_user.id, version, *etag_parts)
+    )
+    if flask.request.if_none_match.contains(etag):
+        response = flask.Response(status=304)
     else:
-        print("entering else")
-        my_string_sessions = Sessions.query.filter_by(string_id=curr_str_id).all()
-        # TODO:  get total_playtime
-        total_playtime_mins = 0
-        for session in my_string_sessions:
-            total_playtime_mins = total_playtime_mins + session.playtime_mins
-
-        total_playtime_hrs = total_playtime_mins / 60
-
-        # TODO: Add this in for the color coding (string_health)
-        avg_lifespan = 100
-        string_life = 1 - (total_playtime_hrs / avg_lifespan)
-        string_health = 100
-        # when you have played more than 30% of the string's anticipated lifespan
-        if string_life > 0.3:
-            string_health = 3
-        elif string_life > 0.10:
-            string_health = 2
-        else:
-            string_health = 1
+        response = flask.jsonify(build())
+    response.set_etag(etag)
+    # per-user data: browsers may keep it but must revalidate, proxies may not
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Cookie")
+    return response
 
-        # get cost per hour
-        if total_playtime_hrs == 0:
-            avg_cost_hr = 0
-        else:
-            avg_cost_hr = curr_str_cost / total_playtime_hrs
 
-        total_playtime_hrs = round(total_playtime_hrs, 2)
-        avg_cost_hr = round(avg_cost_hr, 2)
+@bp.route("/api/analytics")
+@login_required
+def api_analytics():
+    # the recent playtime window moves once a day even without new writes
+    today = time_buckets.day_start(time_buckets.now())
+    # buffered sessions change the payload before the data version
+    buffered = len(buffered_sessions(current_user.id))
+    return conditional_json(analytics_summary, today, *([buffered] if buffered else []))
+
 
-    return flask.render_template(
-        "analytics.html",
-        string_health=string_health,
-        current_instr_name=curr_instr_name,
-        current_str_name=curr_str_name,
-        total_playtime_hrs=total_playtime_hrs,
-        avg_cost_hr=avg_cost_hr,
+@bp.route("/api/instruments")
+@login_required
+def api_instruments():
+    return conditional_json(
+        lambda: {
+            "instruments": getUserInstrumentNames(),
+            "current": get_current_context().instr_name,
+        }
+    )
+
+
+@bp.route("/api/strings")
+@login_required
+def api_strings():
+    return conditional_json(
+        lambda: {
+            "strings": getUserStringNames(),
+            "current": get_current_context().str_name,
+        }
+    )
+
+
+"""
+Sync API for clients that keep a copy of a user's data: a change feed keyed
+by the user's data version, and idempotent batch uploads of sessions.
+"""
+
+
+def changed_rows(query, column, cursor, version):
+    """
+    Rows of `query` stamped after `cursor` up to `version`, or all of them
+    (stamped or not) without a cursor
+    """
+    if cursor is None:
+        return query.filter(db.or_(column.is_(None), column <= version))
+    return query.filter(column > cursor, column <= version)
+
+
+def changes_since(user_id, cursor, version):
+    """
+    The user's instruments, strings and sessions added after data version
+    `cursor` (everything when it is None), read up to `version`
+    """
+    instruments = changed_rows(
+        db.session.query(
+            Instruments.instr_id,
+            Instruments.instr_name,
+            Instruments.instr_type,
+            Instruments.compound_name,
+        ).filter(Instruments.user_id == user_id),
+        Instruments.data_version,
+        cursor,
+        version,
+    ).order_by(Instruments.instr_id)
+    strings = changed_rows(
+        db.session.query(
+            Strings.str_id, Strings.instr_id, Strings.str_name, Strings.str_cost
+        )
+        .join(Instruments, Instruments.instr_id == Strings.instr_id)
+        .filter(Instruments.user_id == user_id),
+        Strings.data_version,
+        cursor,
+        version,
+    ).order_by(Strings.str_id)
+    sessions = changed_rows(
+        db.session.query(
+            Sessions.session_id,
+            Sessions.instr_id,
+            Sessions.string_id,
+            Sessions.playtime_mins,
+            Sessions.date,
+        ).filter(Sessions.user_id == user_id),
+        Sessions.data_version,
+        cursor,
+        version,
+    ).order_by(Sessions.session_id)
+    current_instr_id = (
+        db.session.query(User.current_instr_id).filter_by(id=user_id).scalar()
     )
+    return {
+        "reset": cursor is None,
+        "cursor": version,
+        "current_instr_id": current_instr_id,
+        "instruments": [row._asdict() for row in instruments],
+        "strings": [row._asdict() for row in strings],
+        "sessions": [row._asdict() for row in sessions],
+    }
+
+
+@bp.route("/api/changes")
+@login_required
+def api_changes():
+    """
+    What changed since ?cursor= (everything without one). Send the returned
+    cursor next time; the response is empty when nothing changed. When
+    "reset" is true the response holds everything: replace the local copy.
+    """
+    cursor = flask.request.args.get("cursor", type=int)
+    user_id = current_user.id
+    # a move to another shard gives every row new ids: start over
+    resync_after = shard_router.placement(user_id).resync_after
+    if cursor is not None and resync_after is not None and cursor < resync_after:
+        cursor = None
+    # read first: everything stamped up to it is already committed
+    version = get_data_version(user_id)
+    return conditional_json(
+        lambda: changes_since(user_id, cursor, version),
+        "changes",
+        "all" if cursor is None else cursor,
+    )
+
 
+def json_response(body, status):
+    return flask.Response(body, status=status, mimetype="application/json")
 
-@app.route("/settings")
+
+@bp.route("/api/sessions", methods=["POST"])
+@login_required
+def api_upload_sessions():
+    """
+    Adds a batch of sessions, {"sessions": [{"instrument", "string",
+    "playtime_mins", "date"}, ...]} as in imports, all or nothing. The
+    Idempotency-Key header is required: a retry with the same key gets the
+    first response back and adds nothing.
+    """
+    user_id = current_user.id
+    key = flask.request.headers.get("Idempotency-Key", "").strip()
+    if not key or len(key) > 128:
+        return flask.jsonify(error="An Idempotency-Key header is required."), 400
+    saved = IdempotencyKey.query.get((user_id, key))
+    if saved is not None:
+        return json_response(saved.response, saved.status)
+
+    payload = flask.request.get_json(silent=True) or {}
+    records = payload.get("sessions")
+    max_batch = int(flask.current_app.config.get("SYNC_MAX_BATCH", 500))
+    if not isinstance(records, list) or not records:
+        return flask.jsonify(error="Expected a non-empty sessions list."), 400
+    if len(records) > max_batch:
+        return flask.jsonify(error=f"At most {max_batch} sessions per upload."), 413
+
+    lookup = build_string_lookup(user_id)
+    rows = []
+    errors = []
+    for index, record in enumerate(records):
+        try:
+            if not isinstance(record, dict):
+                raise RowError("Expected an object.")
+            rows.append(parse_record(record, lookup))
+        except RowError as exc:
+            errors.append({"index": index, "error": str(exc)})
+    if errors:
+        # nothing was saved, so the key can be used again once fixed
+        return flask.jsonify(errors=errors), 400
+
+    try:
+        version = add_session_rows(user_id, rows)
+        body = json.dumps({"imported": len(rows), "cursor": version})
+        db.session.add(
+            IdempotencyKey(
+                user_id=user_id,
+                key=key,
+                status=201,
+                response=body,
+                created_at=time_buckets.now(),
+            )
+        )
+        db.session.commit()
+    except IntegrityError:
+        # a concurrent retry with the same key committed first
+        db.session.rollback()
+        saved = IdempotencyKey.query.get((user_id, key))
+        if saved is None:
+            raise
+        return json_response(saved.response, saved.status)
+    reset_current_context()
+    return json_response(body, 201)
+
+
+@bp.cli.command("prune-idempotency-keys")
+@click.option("--days", default=7, show_default=True)
+@per_shard
+def prune_idempotency_keys(days):
+    """
+    Forgets idempotency keys older than `days`; clients can't retry an
+    upload after that
+    """
+    cutoff = time_buckets.now() - days * time_buckets.DAY
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete()
+    db.session.commit()
+    logger.info("Pruned %d idempotency keys.", deleted)
+
+
+# sessions copied per statement by move_user
+MOVE_CHUNK_SIZE = 1000
+
+
+def move_user(user_id, target, wait=None):
+    """
+    Moves a user's rows to shard `target` while the app keeps serving them:
+
+    1. marks the user as moving (writes get a 503, reads still go to the
+       old shard) and waits out the router caches of other processes,
+    2. copies the rows to the target (with new ids) in one transaction,
+    3. points the lookup table at the target and waits again,
+    4. deletes the rows from the old shard.
+
+    Safe to run again after a failure at any step. `wait` defaults to
+    SHARD_CACHE_TTL. Returns the number of sessions moved.
+    """
+    if wait is None:
+        wait = shard_router.ttl
+    assignment = ShardAssignment.query.get(user_id)
+    source = assignment.shard if assignment else 0
+    if source == target:
+        # a move that died after switching shards leaves rows behind
+        for shard in range(shard_router.count):
+            if shard != target:
+                with shard_engine(shard).begin() as conn:
+                    delete_user_rows(conn, user_id)
+        return 0
+
+    if assignment is None:
+        assignment = ShardAssignment(user_id=user_id, shard=source)
+        db.session.add(assignment)
+    assignment.moving = True
+    db.session.commit()
+    shard_router.invalidate(user_id)
+    time.sleep(wait)
+
+    with shard_engine(source).connect() as src, shard_engine(target).begin() as dst:
+        delete_user_rows(dst, user_id)
+        version, instr_ids, moved = copy_user_rows(src, dst, user_id)
+
+    user = User.query.get(user_id)
+    if user.current_instr_id is not None:
+        user.current_instr_id = instr_ids.get(user.current_instr_id)
+    assignment.shard = target
+    assignment.moving = False
+    assignment.resync_after = version
+    db.session.commit()
+    shard_router.invalidate(user_id)
+    user_cache.invalidate(user_id)
+    time.sleep(wait)
+
+    with shard_engine(source).begin() as conn:
+        delete_user_rows(conn, user_id)
+    return moved
+
+
+def copy_user_rows(src, dst, user_id):
+    """
+    Copies a user's rows between shard connections, renumbering instruments,
+    strings and sessions. Every copied row is stamped with a new data
+    version. Returns (version, {old instr_id: new instr_id}, sessions).
+    """
+    instruments = Instruments.__table__
+    strings = Strings.__table__
+    sessions = Sessions.__table__
+    version = (
+        src.execute(
+            db.select([UserDataVersion.version]).where(
+                UserDataVersion.user_id == user_id
+            )
+        ).scalar()
+        or 0
+    ) + 1
+    dst.execute(
+        UserDataVersion.__table__.insert(), {"user_id": user_id, "version": version}
+    )
+
+    instr_ids = {}
+    for row in src.execute(
+        db.select([instruments])
+        .where(instruments.c.user_id == user_id)
+        .order_by(instruments.c.instr_id)
+    ):
+        values = {**row._mapping, "data_version": version}
+        old_id = values.pop("instr_id")
+        instr_ids[old_id] = dst.execute(
+            instruments.insert(), values
+        ).inserted_primary_key[0]
+
+    str_ids = {}
+    for row in src.execute(
+        db.select([strings])
+        .where(strings.c.instr_id.in_(list(instr_ids)))
+        .order_by(strings.c.str_id)
+    ):
+        values = {
+            **row._mapping,
+            "instr_id": instr_ids[row.instr_id],
+            "data_version": version,
+        }
+        old_id = values.pop("str_id")
+        str_ids[old_id] = dst.execute(strings.insert(), values).inserted_primary_key[0]
+
+    moved = 0
+    after = 0
+    while True:
+        rows = src.execute(
+            db.select([sessions])
+            .where(sessions.c.user_id == user_id, sessions.c.session_id > after)
+            .order_by(sessions.c.session_id)
+            .limit(MOVE_CHUNK_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        after = rows[-1].session_id
+        batch = []
+        for row in rows:
+            values = {
+                **row._mapping,
+                "instr_id": instr_ids.get(row.instr_id),
+                "string_id": str_ids.get(row.string_id),
+                "data_version": version,
+            }
+            del values["session_id"]
+            batch.append(values)
+        dst.execute(sessions.insert(), batch)
+        moved += len(batch)
+
+    renumbered = (
+        (StringTotals.__table__, "string_id", None),
+        (StringHealth.__table__, "str_id", None),
+        (SessionRollups.__table__, "string_id", "rollup_id"),
+    )
+    for table, string_column, id_column in renumbered:
+        batch = []
+        for row in src.execute(
+            db.select([table]).where(table.c[string_column].in_(list(str_ids)))
+        ):
+            values = {**row._mapping, string_column: str_ids[row[string_column]]}
+            values.pop(id_column, None)
+            batch.append(values)
+        if batch:
+            dst.execute(table.insert(), batch)
+
+    keys = IdempotencyKey.__table__
+    batch = [
+        dict(row._mapping)
+        for row in src.execute(db.select([keys]).where(keys.c.user_id == user_id))
+    ]
+    if batch:
+        dst.execute(keys.insert(), batch)
+    return version, instr_ids, moved
+
+
+def delete_user_rows(conn, user_id):
+    """
+    Deletes a user's rows from the sharded tables of one shard, children
+    first
+    """
+    instr_ids = db.select([Instruments.instr_id]).where(Instruments.user_id == user_id)
+    str_ids = db.select([Strings.str_id]).where(Strings.instr_id.in_(instr_ids))
+    for table, criterion in (
+        (Sessions.__table__, Sessions.user_id == user_id),
+        (SessionRollups.__table__, SessionRollups.string_id.in_(str_ids)),
+        (StringHealth.__table__, StringHealth.str_id.in_(str_ids)),
+        (StringTotals.__table__, StringTotals.string_id.in_(str_ids)),
+        (Strings.__table__, Strings.instr_id.in_(instr_ids)),
+        (Instruments.__table__, Instruments.user_id == user_id),
+        (IdempotencyKey.__table__, IdempotencyKey.user_id == user_id),
+        (UserDataVersion.__table__, UserDataVersion.user_id == user_id),
+    ):
+        conn.execute(table.delete().where(criterion))
+
+
+@bp.cli.command("move-user")
+@click.option("--user", "email", required=True, help="Email of the user to move.")
+@click.option("--to", "target", type=int, required=True, help="Target shard.")
+@click.option(
+    "--wait",
+    type=float,
+    default=None,
+    help="Seconds to let other processes notice each step (default SHARD_CACHE_TTL).",
+)
+def move_user_command(email, target, wait):
+    """
+    Moves a user's instruments, strings and sessions to another shard
+    """
+    if not 0 <= target < shard_router.count:
+        raise click.ClickException(
+            f"No shard {target}; there are {shard_router.count}."
+        )
+    user = get_user_by_email(email)
+    if user is None:
+        raise click.ClickException(f"No user with email {email}.")
+    moved = move_user(user.id, target, wait)
+    logger.info("Moved user %d to shard %d (%d sessions).", user.id, target, moved)
+
+
+@bp.route("/metrics")
+def metrics_endpoint():
+    """
+    Prometheus scrape target. Set METRICS_TOKEN to require
+    "Authorization: Bearer <token>".
+    """
+    token = flask.current_app.config.get("METRICS_TOKEN") or os.getenv("METRICS_TOKEN")
+    if token and flask.request.headers.get("Authorization") != f"Bearer {token}":
+        return flask.Response(status=401)
+    return flask.Response(
+        metrics.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@bp.route("/settings")
 @login_required
 def settings():
     # TODO: add code here
     return flask.render_template("settings.html")
 
 
-def getCompoundName(instr_name, instr_type):
-    return f"{instr_name} - {instr_type}"
+CurrentContext = namedtuple(
+    "CurrentContext", ["instr_id", "instr_name", "str_id", "str_name", "str_cost"]
+)
+EMPTY_CONTEXT = CurrentContext(None, "", None, "", 0)
+
+
+def get_current_context():
+    """
+    Returns the logged in user's current instrument and string (name, id and
+    cost) from a single joined query. The current string is the set fitted
+    last, as adding strings replaces the instrument's set. The result is
+    memoized on flask.g, so every lookup after the first in a request is free.
+    """
+    if "current_context" not in flask.g:
+        row = None
+        if current_user.current_instr_id is not None:
+            row = (
+                db.session.query(
+                    Instruments.instr_id,
+                    Instruments.instr_name,
+                    Strings.str_id,
+                    Strings.str_name,
+                    Strings.str_cost,
+                )
+                .outerjoin(Strings, Strings.instr_id == Instruments.instr_id)
+                .filter(Instruments.instr_id == current_user.current_instr_id)
+                .order_by(Strings.str_id.desc())
+                .first()
+            )
+        if row is None:
+            flask.g.current_context = EMPTY_CONTEXT
+        else:
+            instr_id, instr_name, str_id, str_name, str_cost = row
+            flask.g.current_context = CurrentContext(
+                instr_id, instr_name, str_id, str_name or "", str_cost or 0
+            )
+    return flask.g.current_context
+
+
+def reset_current_context():
+    """
+    Drops the memoized context after a write changes the current instrument
+    """
+    flask.g.pop("current_context", None)
+
+
+# one entry of an instrument or string listing, and one page of entries;
+# next_after is the cursor of the following page (None on the last one)
+Listing = namedtuple("Listing", ["id", "name"])
+ListingPage = namedtuple("ListingPage", ["entries", "next_after"])
+
+
+def page_listing(id_column, name_column, criterion, after=None, prefix="", limit=None):
+    """
+    Keyset-paginated (id, name) listing of the rows matching `criterion`,
+    ordered by id: the first `limit` rows (all when None) with an id above
+    `after` whose name starts with `prefix` (case-insensitive)
+    """
+    query = db.session.query(id_column, name_column).filter(criterion)
+    if after is not None:
+        query = query.filter(id_column > after)
+    if prefix:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(name_column.ilike(escaped + "%", escape="\\"))
+    query = query.order_by(id_column)
+    if limit is None:
+        return ListingPage([Listing(*row) for row in query], None)
+    # one extra row tells whether there is a next page
+    rows = query.limit(limit + 1).all()
+    entries = [Listing(*row) for row in rows[:limit]]
+    return ListingPage(entries, entries[-1].id if len(rows) > limit else None)
+
+
+def list_instruments(user_id, after=None, prefix="", limit=None):
+    return page_listing(
+        Instruments.instr_id,
+        Instruments.instr_name,
+        Instruments.user_id == user_id,
+        after,
+        prefix,
+        limit,
+    )
+
+
+def list_strings(instr_id, after=None, prefix="", limit=None):
+    return page_listing(
+        Strings.str_id,
+        Strings.str_name,
+        Strings.instr_id == instr_id,
+        after,
+        prefix,
+        limit,
+    )
 
 
 def getUserInstrumentNames():
-    set_of_instr = current_user.instruments
-    instr_names = []
-    for instr in set_of_instr:
-        instr_names.append(instr.instr_name)
-    return instr_names
+    return [entry.name for entry in list_instruments(current_user.id).entries]
+
+
+def set_current_instrument(instr_id):
+    """
+    Saves the user's current instrument through the ORM row (current_user is
+    a cached snapshot) and drops everything derived from the old one
+    """
+    user = User.query.get(current_user.id)
+    user.current_instr_id = instr_id
+    bump_data_version(user.id)
+    db.session.commit()
+    user_cache.invalidate(user.id)
+    current_user.current_instr_id = instr_id
+    reset_current_context()
+
+
+def get_write_context():
+    """
+    get_current_context() for a write. current_user is this process's cached
+    snapshot, which can be up to USER_CACHE_TTL old when another worker
+    changed the current instrument, so the instrument is read from the User
+    row (one primary key query) first.
+    """
+    instr_id = (
+        db.session.query(User.current_instr_id).filter_by(id=current_user.id).scalar()
+    )
+    if instr_id != current_user.current_instr_id:
+        user_cache.invalidate(current_user.id)
+        current_user.current_instr_id = instr_id
+        reset_current_context()
+    return get_current_context()
 
 
 # Get instrument ID using user ID and instrument name
@@ -700,17 +2197,770 @@ def getCurrentInstrument(curr_instr_name):
 
 # Get string names using current user's instrument id
 def getUserStringNames():
-    set_of_str = Strings.query.filter_by(instr_id=current_user.current_instr_id)
-    str_names = []
-    for str in set_of_str:
-        str_names.append(str.str_name)
-    return str_names
+    return [entry.name for entry in list_strings(current_user.current_instr_id).entries]
+
+
+def database_url(**changes):
+    """
+    URL of the database page with the current listing arguments, updated
+    """
+    args = {**flask.request.args.to_dict(), **changes}
+    return flask.url_for(
+        "tracker.database",
+        **{key: value for key, value in args.items() if value not in (None, "")},
+    )
+
+
+def render_database(curr_instr_name, curr_str_name):
+    """
+    Renders the database page with one page of each dropdown, chosen by the
+    instr_after/instr_q and str_after/str_q query arguments
+    """
+    args = flask.request.args
+    limit = int(flask.current_app.config.get("LISTING_PAGE_SIZE", 50))
+    instr_q = args.get("instr_q", "")
+    str_q = args.get("str_q", "")
+    instruments = list_instruments(
+        current_user.id, args.get("instr_after", type=int), instr_q, limit
+    )
+    strings = list_strings(
+        current_user.current_instr_id, args.get("str_after", type=int), str_q, limit
+    )
+    return flask.render_template(
+        "database.html",
+        curr_instr_name=curr_instr_name,
+        curr_str_name=curr_str_name,
+        instruments=instruments.entries,
+        strings=strings.entries,
+        instr_q=instr_q,
+        str_q=str_q,
+        instr_next_url=instruments.next_after
+        and database_url(instr_after=instruments.next_after),
+        str_next_url=strings.next_after and database_url(str_after=strings.next_after),
+        instr_first_url="instr_after" in args and database_url(instr_after=None),
+        str_first_url="str_after" in args and database_url(str_after=None),
+    )
+
+
+@bp.cli.command("init-db")
+def init_db():
+    """
+    Creates any missing tables, then adds columns and indexes missing from
+    existing ones. Run on deploy; the app no longer does this at import time.
+    """
+    for shard in range(shard_router.count):
+        engine, tables = shard_schema(shard)
+        inspector = inspect(engine)
+        with engine.begin() as conn:
+            for table in tables:
+                if inspector.has_table(table.name):
+                    continue
+                # shards other than 0 have no users table to point at
+                foreign_keys = [
+                    key
+                    for key in table.foreign_key_constraints
+                    if key.referred_table in tables
+                ]
+                conn.execute(
+                    CreateTable(table, include_foreign_key_constraints=foreign_keys)
+                )
+                for index in table.indexes:
+                    index.create(bind=conn)
+    ctx = click.get_current_context()
+    ctx.invoke(add_columns)
+    ctx.invoke(create_indexes)
+    logger.info("Database schema is up to date.")
+
+
+def shard_schema(shard):
+    """
+    Engine of a shard and the tables it holds: all of them on shard 0, only
+    the sharded ones elsewhere
+    """
+    engine = shard_engine(shard)
+    tables = [
+        table
+        for table in db.metadata.sorted_tables
+        if shard == 0 or table.info.get("sharded", False)
+    ]
+    return engine, tables
+
+
+@bp.cli.command("add-columns")
+def add_columns():
+    """
+    Adds model columns missing from existing tables. Only nullable columns
+    can be added this way; they start out NULL.
+    """
+    for shard in range(shard_router.count):
+        engine, tables = shard_schema(shard)
+        inspector = inspect(engine)
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise click.ClickException(
+                        f"Can't add NOT NULL column {table.name}.{column.name}."
+                    )
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                with engine.begin() as conn:
+                    conn.execute(db.text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                logger.info("Added column %s.%s.", table.name, column.name)
+
+
+@bp.cli.command("create-indexes")
+def create_indexes():
+    """
+    Adds any model indexes missing from an existing database. db.create_all()
+    only creates indexes alongside brand new tables.
+    """
+    for shard in range(shard_router.count):
+        engine, tables = shard_schema(shard)
+        for table in tables:
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    logger.info("Indexes are up to date.")
+
+
+def upsert(model, values, keys, changes):
+    """
+    Inserts a row of `values` into model's table, or, when a row with the same
+    `keys` (columns of a unique constraint) exists, applies `changes` (column
+    name -> SQL expression over the existing row) to it. One atomic statement
+    (INSERT ... ON CONFLICT DO UPDATE, PostgreSQL and SQLite), so concurrent
+    first writes can't both insert. Runs in the caller's transaction.
+    """
+    table = model.__table__
+    bind = db.session().get_bind(clause=table.insert())
+    insert = postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+    statement = insert(table).values(**values)
+    db.session.execute(
+        statement.on_conflict_do_update(index_elements=keys, set_=changes)
+    )
+
+
+def add_to_string_totals(string_id, playtime_mins, first_date, last_date=None, count=1):
+    """
+    Folds one or more new sessions for a string into its StringTotals row.
+    Runs in the caller's transaction, so commit alongside the Sessions insert.
+    The increment is done in SQL so concurrent submissions don't lose updates.
+    """
+    if last_date is None:
+        last_date = first_date
+    columns = StringTotals.__table__.c
+    first_col = columns.first_session_date
+    last_col = columns.last_session_date
+    upsert(
+        StringTotals,
+        {
+            "string_id": string_id,
+            "total_playtime_mins": playtime_mins,
+            "session_count": count,
+            "first_session_date": first_date,
+            "last_session_date": last_date,
+        },
+        ["string_id"],
+        {
+            "total_playtime_mins": columns.total_playtime_mins + playtime_mins,
+            "session_count": columns.session_count + count,
+            "first_session_date": db.case(
+                (db.or_(first_col.is_(None), first_col > first_date), first_date),
+                else_=first_col,
+            ),
+            "last_session_date": db.case(
+                (db.or_(last_col.is_(None), last_col < last_date), last_date),
+                else_=last_col,
+            ),
+        },
+    )
+
+
+def add_to_rollup(user_id, string_id, period, bucket, playtime_mins, count=1):
+    """
+    Adds playtime to one SessionRollups bucket, creating it if needed. Runs in
+    the caller's transaction like add_to_string_totals.
+    """
+    columns = SessionRollups.__table__.c
+    upsert(
+        SessionRollups,
+        {
+            "user_id": user_id,
+            "string_id": string_id,
+            "period": period,
+            "bucket_start": bucket,
+            "total_playtime_mins": playtime_mins,
+            "session_count": count,
+        },
+        ["string_id", "period", "bucket_start"],
+        {
+            "total_playtime_mins": columns.total_playtime_mins + playtime_mins,
+            "session_count": columns.session_count + count,
+        },
+    )
+
+
+def record_session_aggregates(rows):
+    """
+    Folds newly added sessions (dicts of Sessions column values) into
+    StringTotals and SessionRollups. Rows are grouped first, so a batch costs
+    one statement per string and bucket.
+    """
+    totals = {}
+    rollups = {}
+    for row in rows:
+        string_id, mins, date = row["string_id"], row["playtime_mins"], row["date"]
+        if string_id is None:
+            continue
+        total_mins, count, first, last = totals.get(string_id, (0, 0, date, date))
+        totals[string_id] = (
+            total_mins + mins,
+            count + 1,
+            min(first, date),
+            max(last, date),
+        )
+        for period, bucket in time_buckets.buckets_for(date):
+            key = (row["user_id"], string_id, period, bucket)
+            bucket_mins, count = rollups.get(key, (0, 0))
+            rollups[key] = (bucket_mins + mins, count + 1)
+    for string_id, (mins, count, first, last) in totals.items():
+        add_to_string_totals(string_id, mins, first, last, count=count)
+    for (user_id, string_id, period, bucket), (mins, count) in rollups.items():
+        add_to_rollup(user_id, string_id, period, bucket, mins, count=count)
+    if totals:
+        count_sessions(rows, refresh_string_health(list(totals)))
+
+
+def minutes_played(string_id, start, end):
+    """
+    Minutes played on a string between two epoch timestamps (whole UTC days),
+    read from the rollups: whole weeks from week buckets, the edges from day
+    buckets, so a year costs one indexed query over about 60 rows
+    """
+    ranges = time_buckets.split_range(start, end)
+    if not ranges:
+        return 0
+    conditions = [
+        db.and_(
+            SessionRollups.period == period,
+            SessionRollups.bucket_start >= first,
+            SessionRollups.bucket_start < last,
+        )
+        for period, first, last in ranges
+    ]
+    total = (
+        db.session.query(db.func.sum(SessionRollups.total_playtime_mins))
+        .filter(SessionRollups.string_id == string_id, db.or_(*conditions))
+        .scalar()
+    )
+    return total or 0
+
+
+def minutes_played_since(string_id, days=30):
+    """
+    Minutes played on a string over the last `days` days, today included
+    """
+    end = time_buckets.now()
+    return minutes_played(string_id, end - (days - 1) * time_buckets.DAY, end)
+
+
+def playtime_series(string_id, start, end, period="day"):
+    """
+    (bucket_start, minutes) pairs for chart data between two timestamps.
+    Buckets without any playtime are left out.
+    """
+    return (
+        db.session.query(
+            SessionRollups.bucket_start, SessionRollups.total_playtime_mins
+        )
+        .filter(
+            SessionRollups.string_id == string_id,
+            SessionRollups.period == period,
+            SessionRollups.bucket_start >= time_buckets.bucket_start(period, start),
+            SessionRollups.bucket_start < end,
+        )
+        .order_by(SessionRollups.bucket_start)
+        .all()
+    )
+
+
+@bp.cli.command("rebuild-rollups")
+@per_shard
+def rebuild_rollups():
+    """
+    Recomputes every SessionRollups bucket from the Sessions table. The
+    bucket arithmetic of time_buckets is plain integer maths, so it runs in
+    SQL as one INSERT ... SELECT per period.
+    """
+    SessionRollups.query.delete()
+    for period in time_buckets.PERIODS:
+        if period == "day":
+            bucket = Sessions.date - Sessions.date % time_buckets.DAY
+        else:
+            bucket = Sessions.date - (
+                (Sessions.date + time_buckets.WEEK_OFFSET) % time_buckets.WEEK
+            )
+        bucket = bucket.label("bucket_start")
+        rollup_select = (
+            db.select(
+                [
+                    db.func.min(Sessions.user_id),
+                    Sessions.string_id,
+                    db.literal(period),
+                    bucket,
+                    db.func.sum(Sessions.playtime_mins),
+                    db.func.count(Sessions.session_id),
+                ]
+            )
+            .where(Sessions.string_id.isnot(None))
+            .group_by(Sessions.string_id, bucket)
+        )
+        db.session.execute(
+            SessionRollups.__table__.insert().from_select(
+                [
+                    "user_id",
+                    "string_id",
+                    "period",
+                    "bucket_start",
+                    "total_playtime_mins",
+                    "session_count",
+                ],
+                rollup_select,
+            )
+        )
+    db.session.commit()
+    logger.info("Rebuilt %d rollup buckets.", SessionRollups.query.count())
+
+
+@bp.cli.command("migrate-session-dates")
+@per_shard
+def migrate_session_dates():
+    """
+    Converts legacy MMDDYYYY session dates (e.g. the old 12022021 placeholder)
+    to epoch timestamps at midnight UTC, then rebuilds totals and rollups
+    """
+    legacy_dates = [
+        value
+        for (value,) in db.session.query(Sessions.date)
+        .filter(Sessions.date < 100000000)
+        .distinct()
+    ]
+    for value in legacy_dates:
+        try:
+            timestamp = legacy_date_to_timestamp(value)
+        except ValueError:
+            logger.warning("Skipping sessions with unreadable date %r.", value)
+            continue
+        Sessions.query.filter_by(date=value).update(
+            {Sessions.date: timestamp}, synchronize_session=False
+        )
+    db.session.commit()
+    logger.info("Converted %d legacy session dates.", len(legacy_dates))
+    ctx = click.get_current_context()
+    ctx.invoke(rebuild_string_totals)
+    ctx.invoke(rebuild_rollups)
+
+
+def merge_lifespan_stats(string_model, stats):
+    """
+    Merges a RunningStats of new lifespans into the string model's stored
+    statistics. The merge is a single upsert (every right-hand side sees the
+    old row), so concurrent writers can't lose each other's data or both
+    insert the model's first row.
+    """
+    if stats.count == 0:
+        return
+    columns = StringLifespanStats.__table__.c
+    count, mean, m2 = columns.count, columns.mean_hrs, columns.m2
+    new_count = count + stats.count
+    delta = stats.mean - mean
+    upsert(
+        StringLifespanStats,
+        {
+            "string_model": string_model,
+            "count": stats.count,
+            "mean_hrs": stats.mean,
+            "m2": stats.m2,
+        },
+        ["string_model"],
+        {
+            "count": new_count,
+            "mean_hrs": mean + delta * stats.count / new_count,
+            "m2": m2 + stats.m2 + delta * delta * count * stats.count / new_count,
+        },
+    )
 
 
-@app.route("/changeinstr", methods=["POST"])
+def record_string_lifespan(
+    user_id, string_model, lifespan_hrs, label=None, instr_type=None
+):
+    """
+    Appends one lifespan and folds it into the running statistics, in the
+    caller's transaction
+    """
+    db.session.add(
+        StringLifespan(
+            user_id=user_id,
+            string_model=string_model,
+            label=label,
+            instr_type=instr_type,
+            lifespan_hrs=lifespan_hrs,
+            recorded_at=time_buckets.now(),
+        )
+    )
+    stats = RunningStats()
+    stats.push(lifespan_hrs)
+    merge_lifespan_stats(string_model, stats)
+    count_lifespan(string_model, lifespan_hrs, instr_type)
+
+
+def get_average_lifespans(string_models):
+    """
+    Learned average lifespan in hours of each of the string models, or the
+    configured default for the ones with too few recorded lifespans. The
+    statistics are shared by every shard, so they live in the main database.
+    """
+    config = flask.current_app.config
+    models = {model for model in string_models if model}
+    learned = (
+        dict(
+            db.session.query(
+                StringLifespanStats.string_model, StringLifespanStats.mean_hrs
+            )
+            .filter(
+                StringLifespanStats.string_model.in_(models),
+                StringLifespanStats.count >= config["LIFESPAN_MIN_SAMPLES"],
+            )
+            .all()
+        )
+        if models
+        else {}
+    )
+    default = config["DEFAULT_LIFESPAN_HRS"]
+    return {model: learned.get(model, default) for model in string_models}
+
+
+def get_average_lifespan(string_model):
+    """
+    Learned average lifespan in hours for a string model, or the configured
+    default until enough lifespans have been recorded
+    """
+    return get_average_lifespans([string_model])[string_model]
+
+
+def health_inputs_query():
+    """
+    (str_id, user_id, str_cost, playtime_mins, str_name) for strings, ordered
+    by str_id; add_lifespans() turns the names into expected lifespans
+    """
+    return (
+        db.session.query(
+            Strings.str_id,
+            Instruments.user_id,
+            Strings.str_cost,
+            db.func.coalesce(StringTotals.total_playtime_mins, 0),
+            Strings.str_name,
+        )
+        .join(Instruments, Instruments.instr_id == Strings.instr_id)
+        .outerjoin(StringTotals, StringTotals.string_id == Strings.str_id)
+        .order_by(Strings.str_id)
+    )
+
+
+def add_lifespans(rows):
+    """
+    Replaces the string model names of health_inputs_query() rows with the
+    learned average lifespan of the model (see get_average_lifespans), read
+    with one query of its own.
+    """
+    lifespans = get_average_lifespans({row[4] for row in rows})
+    return [
+        (str_id, user_id, cost, playtime_mins, lifespans[name])
+        for str_id, user_id, cost, playtime_mins, name in rows
+    ]
+
+
+def score_strings(rows):
+    """
+    Runs the health engine over rows of health_inputs_query() and returns
+    StringHealth column dicts
+    """
+    if not rows:
+        return []
+    str_ids, user_ids, costs, playtime_mins, lifespans = zip(*rows)
+    health = compute_health(playtime_mins, lifespans, costs)
+    due = health["health_tier"] == string_health.DUE
+    computed_at = time_buckets.now()
+    return [
+        {
+            "str_id": str_id,
+            "user_id": user_id,
+            "playtime_hrs": playtime_hrs,
+            "string_life": string_life,
+            "health_tier": health_tier,
+            "cost_per_hr": cost_per_hr,
+            "due_for_restring": is_due,
+            "computed_at": computed_at,
+        }
+        for str_id, user_id, playtime_hrs, string_life, health_tier, cost_per_hr, is_due in zip(
+            str_ids,
+            user_ids,
+            health["playtime_hrs"].tolist(),
+            health["string_life"].tolist(),
+            health["health_tier"].tolist(),
+            health["cost_per_hr"].tolist(),
+            due.tolist(),
+        )
+    ]
+
+
+def refresh_string_health(str_ids):
+    """
+    Re-scores a few strings (e.g. after new sessions) in the caller's
+    transaction. Returns their names by str_id, read on the way.
+    """
+    inputs = health_inputs_query().filter(Strings.str_id.in_(str_ids)).all()
+    rows = score_strings(add_lifespans(inputs))
+    StringHealth.query.filter(StringHealth.str_id.in_(str_ids)).delete(
+        synchronize_session=False
+    )
+    if rows:
+        db.session.execute(StringHealth.__table__.insert(), rows)
+    return {row[0]: row[4] for row in inputs}
+
+
+def get_string_health(str_id, extra_mins=0):
+    """
+    Health of one string as a dict, from StringHealth when it has been scored
+    and computed on the fly (without saving) when it hasn't, or when
+    `extra_mins` of not yet saved playtime must be added
+    """
+    health = None if extra_mins else StringHealth.query.get(str_id)
+    if health is not None:
+        return {
+            "playtime_hrs": health.playtime_hrs,
+            "string_life": health.string_life,
+            "health_tier": health.health_tier,
+            "cost_per_hr": health.cost_per_hr,
+        }
+    rows = score_strings(
+        [
+            (str_id, user_id, cost, playtime_mins + extra_mins, lifespan)
+            for str_id, user_id, cost, playtime_mins, lifespan in add_lifespans(
+                health_inputs_query().filter(Strings.str_id == str_id).all()
+            )
+        ]
+    )
+    if rows:
+        return rows[0]
+    return {
+        "playtime_hrs": 0,
+        "string_life": 1,
+        "health_tier": string_health.HEALTHY,
+        "cost_per_hr": 0,
+    }
+
+
+def get_strings_due(user_id):
+    """
+    (instrument name, string name) of the user's strings due for restringing
+    """
+    return (
+        db.session.query(Instruments.instr_name, Strings.str_name)
+        .select_from(StringHealth)
+        .join(Strings, Strings.str_id == StringHealth.str_id)
+        .join(Instruments, Instruments.instr_id == Strings.instr_id)
+        .filter(StringHealth.user_id == user_id, StringHealth.due_for_restring)
+        .order_by(Instruments.instr_name, Strings.str_name)
+        .all()
+    )
+
+
+@bp.cli.command("compute-string-health")
+@click.option("--chunk-size", default=100000, show_default=True)
+@per_shard
+def compute_string_health(chunk_size):
+    """
+    Scores every string of every user with the vectorized health engine and
+    rewrites the StringHealth table in one transaction. Meant to be run on a
+    schedule (e.g. Heroku Scheduler) so lifespan statistics learned since a
+    string's last session are reflected.
+    """
+    start = time.perf_counter()
+    StringHealth.query.delete()
+    insert = StringHealth.__table__.insert()
+    scored = due = 0
+    last_id = None
+    while True:
+        query = health_inputs_query()
+        if last_id is not None:
+            query = query.filter(Strings.str_id > last_id)
+        rows = query.limit(chunk_size).all()
+        if not rows:
+            break
+        health_rows = score_strings(add_lifespans(rows))
+        db.session.execute(insert, health_rows)
+        scored += len(health_rows)
+        due += sum(row["due_for_restring"] for row in health_rows)
+        last_id = rows[-1][0]
+    # rescoring can change any user's analytics
+    UserDataVersion.query.update(
+        {UserDataVersion.version: UserDataVersion.version + 1},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    elapsed = time.perf_counter() - start
+    logger.info(
+        "Scored %d strings in %.1fs, %d due for restringing.", scored, elapsed, due
+    )
+
+
+@bp.cli.command("import-lifespan-blobs")
+def import_lifespan_blobs():
+    """
+    Copies the legacy Stringlifespans JSON blobs into StringLifespan rows and
+    the running statistics. Users already imported are skipped, so it is safe
+    to run again.
+    """
+    imported_users = {
+        user_id
+        for (user_id,) in db.session.query(StringLifespan.user_id)
+        .filter_by(source="legacy")
+        .distinct()
+    }
+    per_model = {}
+    rows = 0
+    for blob in Stringlifespans.query.yield_per(500):
+        if blob.user_id in imported_users:
+            continue
+        try:
+            lifespans = json.loads(blob.string_lifespans)
+        except ValueError:
+            logger.warning("Skipping unreadable lifespans of user %d.", blob.user_id)
+            continue
+        for label, hours_list in lifespans.items():
+            # keys are "<instrument compound name> - <string name>"
+            string_model = label.rsplit(" - ", 1)[-1].strip()
+            for hours in hours_list:
+                db.session.add(
+                    StringLifespan(
+                        user_id=blob.user_id,
+                        string_model=string_model,
+                        label=label,
+                        lifespan_hrs=float(hours),
+                        recorded_at=time_buckets.now(),
+                        source="legacy",
+                    )
+                )
+                per_model.setdefault(string_model, RunningStats()).push(float(hours))
+                count_lifespan(string_model, float(hours))
+                rows += 1
+    for string_model, stats in per_model.items():
+        merge_lifespan_stats(string_model, stats)
+    db.session.commit()
+    logger.info("Imported %d lifespans for %d string models.", rows, len(per_model))
+
+
+@bp.cli.command("rebuild-community-stats")
+def rebuild_community_stats():
+    """
+    Rebuilds the community statistics sketches from every shard's strings
+    and sessions and the recorded lifespans, e.g. after turning them on
+    """
+    built = {}
+
+    def add(name, factory, *args):
+        sketch = built.get(name)
+        if sketch is None:
+            sketch = built[name] = factory()
+        sketch.add(*args)
+
+    for shard in range(shard_router.count):
+        with on_shard(shard):
+            for name, mins in (
+                db.session.query(Strings.str_name, db.func.sum(Sessions.playtime_mins))
+                .join(Sessions, Sessions.string_id == Strings.str_id)
+                .group_by(Strings.str_name)
+            ):
+                add(PLAYTIME_SKETCH, CountMinSketch, name, int(mins))
+            for (user_id,) in db.session.query(Sessions.user_id).distinct():
+                add(PLAYERS_SKETCH, new_players_sketch, user_id)
+            for name, fitted in db.session.query(
+                Strings.str_name, db.func.count()
+            ).group_by(Strings.str_name):
+                add(FITTED_SKETCH, CountMinSketch, name, fitted)
+            for user_id, name in (
+                db.session.query(Instruments.user_id, Strings.str_name)
+                .join(Strings, Strings.instr_id == Instruments.instr_id)
+                .distinct()
+            ):
+                add(players_sketch_name(name), new_model_players_sketch, user_id)
+            db.session.commit()
+    lifespans = db.session.query(
+        StringLifespan.string_model,
+        StringLifespan.instr_type,
+        StringLifespan.lifespan_hrs,
+    ).yield_per(1000)
+    for string_model, instr_type, lifespan_hrs in lifespans:
+        add(lifespan_sketch_name(string_model), QuantileSketch, lifespan_hrs)
+        if instr_type:
+            add(
+                lifespan_sketch_name(string_model, instr_type),
+                QuantileSketch,
+                lifespan_hrs,
+            )
+
+    CommunitySketch.query.delete()
+    for name, sketch in built.items():
+        db.session.add(
+            CommunitySketch(name=name, data=sketches.dumps(sketch), version=1)
+        )
+    db.session.commit()
+    logger.info("Rebuilt %d community statistics sketches.", len(built))
+
+
+@bp.cli.command("rebuild-string-totals")
+@per_shard
+def rebuild_string_totals():
+    """
+    Recomputes every StringTotals row from the Sessions table
+    """
+    StringTotals.query.delete()
+    totals_select = (
+        db.select(
+            [
+                Sessions.string_id,
+                db.func.sum(Sessions.playtime_mins),
+                db.func.count(Sessions.session_id),
+                db.func.min(Sessions.date),
+                db.func.max(Sessions.date),
+            ]
+        )
+        .where(Sessions.string_id.isnot(None))
+        .group_by(Sessions.string_id)
+    )
+    db.session.execute(
+        StringTotals.__table__.insert().from_select(
+            [
+                "string_id",
+                "total_playtime_mins",
+                "session_count",
+                "first_session_date",
+                "last_session_date",
+            ],
+            totals_select,
+        )
+    )
+    db.session.commit()
+    logger.info("Rebuilt totals for %d strings.", StringTotals.query.count())
+
+
+@bp.route("/changeinstr", methods=["POST"])
 @login_required
 def change_instr():
-    print("/changeinstr received POST request.")
     curr_instr_name = flask.request.form.get("instruments")
 
     # get the current instrument's ID
@@ -718,80 +2968,80 @@ def change_instr():
     curr_instr_id = curr_instr_db_obj.instr_id
 
     # attach this instr_id to the user's current_instr_id
-    current_user.current_instr_id = curr_instr_id
-    instr_names = getUserInstrumentNames()
-    instr_names_len = int(len(instr_names))
-
-    db.session.add(current_user)
-    db.session.commit()
+    set_current_instrument(curr_instr_id)
+    logger.debug(
+        "current instrument changed",
+        extra={"user_id": current_user.id, "instr_id": curr_instr_id},
+    )
+    return render_database(curr_instr_name, get_current_context().str_name)
 
-    str_names = getUserStringNames()
-    str_names_len = int(len(str_names))
 
-    print(f"Current user instrument changed to {current_user.current_instr_id}")
-    return flask.render_template(
-        "database.html",
-        curr_instr_name=curr_instr_name,
-        instr_names=instr_names,
-        instr_names_len=instr_names_len,
-        str_names=str_names,
-        str_names_len=str_names_len,
+def record_replaced_strings(user_id, instr_id):
+    """
+    Fitting new strings ends the life of the instrument's current set (the
+    one fitted last, see get_current_context): records its playtime as a
+    lifespan of its string model, in the caller's transaction. Sets that were
+    never played are skipped.
+    """
+    row = (
+        db.session.query(
+            Strings.str_name,
+            Instruments.instr_name,
+            Instruments.instr_type,
+            StringTotals.total_playtime_mins,
+        )
+        .join(Instruments, Instruments.instr_id == Strings.instr_id)
+        .outerjoin(StringTotals, StringTotals.string_id == Strings.str_id)
+        .filter(Strings.instr_id == instr_id)
+        .order_by(Strings.str_id.desc())
+        .first()
+    )
+    if row is None or not row.total_playtime_mins:
+        return
+    record_string_lifespan(
+        user_id,
+        row.str_name,
+        row.total_playtime_mins / 60,
+        label=f"{row.instr_name} - {row.str_name}",
+        instr_type=row.instr_type,
     )
 
 
-@app.route("/add_strings", methods=["POST"])
+@bp.route("/add_strings", methods=["POST"])
 @login_required
 def add_strings():
-    print(f"add_strings post received")
     str_name = flask.request.form.get("str_name")
     str_cost = flask.request.form.get("str_cost")
-    print(f"user is {current_user.id}")
-    print(f"current instrument id {current_user.current_instr_id}")
-    instr_id = current_user.current_instr_id
-    new_strings = Strings(str_name=str_name, str_cost=str_cost, instr_id=instr_id)
+    instr_id = get_write_context().instr_id
+    record_replaced_strings(current_user.id, instr_id)
+    new_strings = Strings(
+        str_name=str_name,
+        str_cost=str_cost,
+        instr_id=instr_id,
+        data_version=bump_data_version(current_user.id),
+    )
     db.session.add(new_strings)
     db.session.commit()
+    count_strings_fitted(current_user.id, str_name)
 
-    print(f"current strings for instr is {str_name}")
-    return flask.redirect(flask.url_for("database"))
+    logger.info(
+        "strings added",
+        extra={"user_id": current_user.id, "instr_id": instr_id, "str_name": str_name},
+    )
+    return flask.redirect(flask.url_for("tracker.database"))
 
 
-@app.route("/change_strings", methods=["POST"])
+@bp.route("/change_strings", methods=["POST"])
 @login_required
 def change_strings():
-    print(f"change_strings post received")
     curr_str_name = flask.request.form.get("strings")
-
-    str_names = getUserStringNames()
-    str_names_len = int(len(str_names))
-    instr_names = getUserInstrumentNames()
-    instr_names_len = int(len(instr_names))
-
-    try:
-        curr_instr_name = (
-            Instruments.query.filter_by(instr_id=current_user.current_instr_id)
-            .first()
-            .instr_name
-        )
-    except AttributeError:
-        curr_instr_name = ""
-
-    print(f"curr strings is {curr_str_name}")
-    return flask.render_template(
-        "database.html",
-        curr_instr_name=curr_instr_name,
-        curr_str_name=curr_str_name,
-        str_names=str_names,
-        str_names_len=str_names_len,
-        instr_names=instr_names,
-        instr_names_len=instr_names_len,
-    )
+    return render_database(get_current_context().instr_name, curr_str_name)
 
 
 if __name__ == "__main__":
-    app.run(
-        # debug = True
+    # development server only; production runs gunicorn (see Procfile)
+    create_app().run(
         host=os.getenv("IP", "0.0.0.0"),
         port=int(os.getenv("PORT", "8230")),
-        debug=True,
+        debug=os.getenv("FLASK_ENV") == "development",
     )
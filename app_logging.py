@@ -0,0 +1,212 @@
+"""
+Structured, non-blocking logging.
+
+setup_logging() routes every logger through a QueueHandler: request threads
+only enqueue records, and a background QueueListener formats and writes
+them (one JSON object per line by default). On the way in, credential-like
+fields are redacted and DEBUG records can be sampled. If the queue is full,
+records are dropped rather than blocking the request.
+
+Log with fields instead of formatting them into the message:
+
+    logger.info("session added", extra={"user_id": 3, "playtime_mins": 45})
+"""
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+REDACTED = "[REDACTED]"
+# matched as substrings of lower-cased field names
+SENSITIVE_KEYS = ("password", "passwd", "secret", "token", "authorization", "cookie")
+
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {
+    "message",
+    "asctime",
+    "sample_rate",
+}
+
+
+def is_sensitive(key):
+    key = str(key).lower()
+    return any(word in key for word in SENSITIVE_KEYS)
+
+
+def redact(value):
+    """
+    Copy of `value` with the values of credential-like keys replaced, at any
+    depth of dicts and lists
+    """
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if is_sensitive(key) else redact(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    return value
+
+
+def record_fields(record):
+    """
+    The `extra` fields of a record
+    """
+    return {
+        key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS
+    }
+
+
+class RedactingFilter(logging.Filter):
+    def filter(self, record):
+        for key, value in record_fields(record).items():
+            setattr(record, key, REDACTED if is_sensitive(key) else redact(value))
+        if isinstance(record.args, dict):
+            record.args = redact(record.args)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through a `rate` fraction of DEBUG records (all other levels pass).
+    A record can carry its own rate: extra={"sample_rate": 0.01}.
+    """
+
+    def __init__(self, rate=1.0, rand=random.random):
+        super().__init__()
+        self.rate = rate
+        self._rand = rand
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = getattr(record, "sample_rate", self.rate)
+        return rate >= 1 or self._rand() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(record_fields(record))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Human-readable lines for local development, fields as key=value
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record):
+        line = super().format(record)
+        fields = record_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value!r}" for key, value in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops (and counts) records when the queue is full
+    """
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DroppingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Like QueueHandler.prepare, merge the args into the message now,
+        # but leave exc_info to the listener's formatter instead of
+        # flattening the traceback into the message
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        return record
+
+
+class _State:
+    handler = None
+    listener = None
+    queue_size = 10000
+
+
+def setup_logging(config):
+    """
+    (Re)configures the root logger from a mapping of settings:
+
+        LOG_LEVEL              root level (default INFO)
+        LOG_LEVELS             per-logger levels, e.g. "app=DEBUG,metrics=WARNING"
+        LOG_FORMAT             "json" (default) or "text"
+        LOG_DEBUG_SAMPLE_RATE  fraction of DEBUG records kept (default 1)
+        LOG_QUEUE_SIZE         records buffered before dropping (default 10000)
+    """
+    teardown_logging()
+    output = logging.StreamHandler(sys.stdout)
+    if str(config.get("LOG_FORMAT", "json")).lower() == "text":
+        output.setFormatter(TextFormatter())
+    else:
+        output.setFormatter(JsonFormatter())
+
+    _State.queue_size = int(config.get("LOG_QUEUE_SIZE", 10000))
+    handler = DroppingQueueHandler(queue.Queue(_State.queue_size))
+    handler.addFilter(SamplingFilter(float(config.get("LOG_DEBUG_SAMPLE_RATE", 1))))
+    handler.addFilter(RedactingFilter())
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(str(config.get("LOG_LEVEL", "INFO")).upper())
+    for item in str(config.get("LOG_LEVELS", "")).split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    _State.handler = handler
+    _State.listener = logging.handlers.QueueListener(handler.queue, output)
+    _State.listener.start()
+
+
+def teardown_logging():
+    """
+    Flushes queued records and removes the handler installed by setup_logging
+    """
+    if _State.listener is not None:
+        _State.listener.stop()
+    if _State.handler is not None:
+        logging.getLogger().removeHandler(_State.handler)
+    _State.handler = _State.listener = None
+
+
+def _restart_in_child():
+    # The listener thread doesn't survive fork (e.g. gunicorn workers of a
+    # preloaded app), and the queue's lock may have been held by it; give
+    # the child a fresh queue and listener.
+    if _State.listener is None:
+        return
+    handlers = _State.listener.handlers
+    _State.handler.queue = queue.Queue(_State.queue_size)
+    _State.listener = logging.handlers.QueueListener(_State.handler.queue, *handlers)
+    _State.listener.start()
+
+
+os.register_at_fork(after_in_child=_restart_in_child)
+atexit.register(teardown_logging)
@@ -0,0 +1,259 @@
+"""
+Static asset pipeline.
+
+`python assets.py` builds static/ into build/static/: every file gets its
+content hash in its name (style.css -> style.3f9c2a1b7d4e.css), CSS is
+minified, text assets are precompressed (.gz, and .br when the brotli
+package is installed) and, when Pillow is installed, images are scaled down
+to ASSET_IMAGE_MAX_WIDTH pixels (default 1920) with WebP/AVIF variants.
+manifest.json maps the source names to the built ones.
+
+init_assets(app) serves the build when there is one: templates link assets
+with asset_url("style.css"), fingerprinted files are cached by browsers for a
+year without revalidating, and each request gets the smallest variant its
+Accept/Accept-Encoding headers allow. Without a build, static/ is served as
+is, which is what development wants.
+"""
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import re
+import shutil
+
+import flask
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+COMPRESSIBLE = {".css", ".js", ".json", ".map", ".svg", ".txt", ".xml"}
+IMAGES = {".jpg", ".jpeg", ".png"}
+# best first; served when the browser lists them in Accept
+IMAGE_VARIANTS = (("image/avif", ".avif", "AVIF"), ("image/webp", ".webp", "WEBP"))
+# best first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def minify_css(text):
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}").strip()
+
+
+def fingerprint(name, data):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+
+
+def _image_outputs(data, ext, max_width):
+    """
+    The image scaled down to `max_width` in its own format, and its WebP and
+    AVIF variants as {mimetype: (ext, data)}. The original bytes and no
+    variants without Pillow.
+    """
+    if Image is None:
+        return data, {}
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if image.width > max_width:
+            height = round(image.height * max_width / image.width)
+            image = image.resize((max_width, height), Image.LANCZOS)
+        if ext in (".jpg", ".jpeg"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(
+            out, format=Image.registered_extensions()[ext], optimize=True, quality=82
+        )
+        variants = {}
+        for mimetype, variant_ext, fmt in IMAGE_VARIANTS:
+            if variant_ext not in Image.registered_extensions():
+                continue
+            variant = io.BytesIO()
+            image.save(variant, format=fmt, quality=70)
+            variants[mimetype] = (variant_ext, variant.getvalue())
+    # keep whichever is smaller: recompressing can grow small images
+    return min(out.getvalue(), data, key=len), variants
+
+
+def _write(target, name, data, compress):
+    with open(os.path.join(target, name), "wb") as stream:
+        stream.write(data)
+    if not compress:
+        return
+    # mtime=0 keeps the output identical between builds
+    with open(os.path.join(target, name + ".gz"), "wb") as stream, gzip.GzipFile(
+        filename="", mode="wb", compresslevel=9, fileobj=stream, mtime=0
+    ) as compressed:
+        compressed.write(data)
+    if brotli is not None:
+        with open(os.path.join(target, name + ".br"), "wb") as stream:
+            stream.write(brotli.compress(data, quality=11))
+
+
+def build(source, target, max_image_width=1920):
+    """
+    Builds `source` into `target` (replacing it) and returns the manifest:
+    {"files": {source name: built name}, "variants": {built name:
+    {mimetype: built name}}}
+    """
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    os.makedirs(target)
+    files = {}
+    variants = {}
+    names = []
+    for root, _, filenames in os.walk(source):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            names.append(os.path.relpath(path, source).replace(os.sep, "/"))
+    # images first, so stylesheets can point at their built names
+    names.sort(key=lambda name: (os.path.splitext(name)[1].lower() not in IMAGES, name))
+    for name in names:
+        with open(os.path.join(source, name), "rb") as stream:
+            data = stream.read()
+        ext = os.path.splitext(name)[1].lower()
+        os.makedirs(os.path.join(target, os.path.dirname(name)), exist_ok=True)
+        image_variants = {}
+        if ext in IMAGES:
+            data, image_variants = _image_outputs(data, ext, max_image_width)
+        elif ext == ".css":
+            data = rewrite_css_urls(
+                minify_css(data.decode("utf-8")), name, files
+            ).encode("utf-8")
+        built = fingerprint(name, data)
+        _write(target, built, data, ext in COMPRESSIBLE)
+        files[name] = built
+        for mimetype, (variant_ext, variant_data) in image_variants.items():
+            variant = fingerprint(os.path.splitext(name)[0] + variant_ext, variant_data)
+            _write(target, variant, variant_data, False)
+            variants.setdefault(built, {})[mimetype] = variant
+    manifest = {"files": files, "variants": variants}
+    with open(os.path.join(target, MANIFEST), "w", encoding="utf-8") as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    return manifest
+
+
+def rewrite_css_urls(text, name, files):
+    """
+    Points url(...) references of a stylesheet at the built files
+    """
+    base = os.path.dirname(name)
+
+    def replace(match):
+        url = match.group(2)
+        target = os.path.normpath(os.path.join(base, url)).replace(os.sep, "/")
+        if target not in files:
+            return match.group(0)
+        built = os.path.relpath(files[target], base or ".").replace(os.sep, "/")
+        return f"url({match.group(1)}{built}{match.group(1)})"
+
+    return re.sub(r"url\(\s*(['\"]?)([^'\")]+)\1\s*\)", replace, text)
+
+
+class Assets:
+    """
+    Serves a static folder, built (with a manifest) or not
+    """
+
+    def __init__(self, folder, manifest=None):
+        self.folder = folder
+        self.files = (manifest or {}).get("files", {})
+        self.variants = (manifest or {}).get("variants", {})
+        self.built = set(self.files.values()) | {
+            name for names in self.variants.values() for name in names.values()
+        }
+
+    @classmethod
+    def load(cls, build_folder, source_folder):
+        path = os.path.join(build_folder, MANIFEST)
+        if not os.path.exists(path):
+            return cls(source_folder)
+        with open(path, encoding="utf-8") as stream:
+            return cls(build_folder, json.load(stream))
+
+    def url(self, name):
+        return flask.url_for("static", filename=self.files.get(name, name))
+
+    def send(self, filename):
+        headers = {}
+        vary = []
+        served = filename
+        accepted = {
+            value for value, quality in flask.request.accept_mimetypes if quality > 0
+        }
+        variants = self.variants.get(filename, {})
+        if variants:
+            vary.append("Accept")
+            for mimetype, _, _ in IMAGE_VARIANTS:
+                if mimetype in variants and mimetype in accepted:
+                    served = variants[mimetype]
+                    break
+        mimetype = mimetypes.guess_type(served)[0] or "application/octet-stream"
+        if os.path.splitext(served)[1].lower() in COMPRESSIBLE:
+            vary.append("Accept-Encoding")
+            for encoding, suffix in ENCODINGS:
+                path = safe_join(self.folder, served + suffix)
+                if (
+                    flask.request.accept_encodings[encoding]
+                    and path
+                    and os.path.exists(path)
+                ):
+                    served += suffix
+                    headers["Content-Encoding"] = encoding
+                    break
+        response = flask.send_from_directory(self.folder, served, mimetype=mimetype)
+        response.headers.update(headers)
+        for header in vary:
+            response.vary.add(header)
+        if filename in self.built:
+            response.headers["Cache-Control"] = IMMUTABLE
+            # nothing to revalidate: the name changes with the content
+            response.headers.pop("Last-Modified", None)
+        return response
+
+
+def init_assets(app):
+    """
+    Serves /static from ASSET_DIR (default build/static) when it has been
+    built, else from static/, and adds asset_url() to the templates
+    """
+    build_folder = os.path.join(
+        app.root_path, app.config.get("ASSET_DIR", os.path.join("build", "static"))
+    )
+    assets = Assets.load(build_folder, os.path.join(app.root_path, "static"))
+    app.extensions["assets"] = assets
+    app.add_url_rule(
+        "/static/<path:filename>", endpoint="static", view_func=assets.send
+    )
+
+    @app.context_processor
+    def asset_helpers():
+        return {"asset_url": assets.url}
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(os.path.abspath(__file__))
+    built = build(
+        os.path.join(here, "static"),
+        os.path.join(here, os.getenv("ASSET_DIR", os.path.join("build", "static"))),
+        max_image_width=int(os.getenv("ASSET_IMAGE_MAX_WIDTH", "1920")),
+    )
+    logging.basicConfig(level=logging.INFO)
+    logger.info("Built %d assets.", len(built["files"]))
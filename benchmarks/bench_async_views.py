@@ -0,0 +1,133 @@
+"""
+Benchmark: how long one signup takes with the async signup view, which asks
+the email validation API while it looks up the username and the email, and
+in sync mode, where the two run one after another as they did before.
+
+The email validation API is a local stand-in that answers after
+--email-latency-ms, and every SELECT is delayed by --query-latency-ms to
+stand in for a database across the network. Signups are sent one at a time
+through Flask's test client: this measures the latency of a request, not
+how many requests a worker can serve (an async view still holds its worker
+thread until it returns).
+
+    python benchmarks/bench_async_views.py --signups 200
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["DATABASE_URL1"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "bench.db"
+)
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+# hashing is not what this measures
+os.environ.setdefault("PASSWORD_HASH_METHOD", "pbkdf2:sha256:1000")
+
+
+class SlowEmailAPI(BaseHTTPRequestHandler):
+    """
+    Answers every isitarealemail.com style lookup with "valid", slowly
+    """
+
+    latency = 0.0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = b'{"status": "valid"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def one_after_another(app_module):
+    async def gather(*calls):
+        # sync mode: the same calls, each waiting for the one before it
+        return [await app_module.run_sync(func, *args) for func, *args in calls]
+
+    return gather
+
+
+def run(app, signups, prefix):
+    client = app.test_client()
+    latencies = []
+    for number in range(signups):
+        start = time.perf_counter()
+        response = client.post(
+            "/signup",
+            data={
+                "email": f"{prefix}{number}@example.com",
+                "username": f"{prefix}{number}",
+                "password": "Bench-pass1",
+            },
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 302:
+            raise RuntimeError(f"signup failed with {response.status_code}")
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--signups", type=int, default=200)
+    parser.add_argument("--email-latency-ms", type=float, default=50)
+    parser.add_argument("--query-latency-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    SlowEmailAPI.latency = args.email_latency_ms / 1000
+    email_api = ThreadingHTTPServer(("127.0.0.1", 0), SlowEmailAPI)
+    threading.Thread(target=email_api.serve_forever, daemon=True).start()
+    os.environ[
+        "EMAIL_VALIDATOR_URL"
+    ] = f"http://127.0.0.1:{email_api.server_port}/api/email/validate"
+
+    import app as app_module  # pylint: disable=import-outside-toplevel
+
+    app = app_module.create_app()
+    app.secret_key = "bench"
+    with app.app_context():
+        app_module.db.create_all()
+
+        @event.listens_for(app_module.db.engine, "before_cursor_execute")
+        def network(conn, cursor, statement, *_):  # pylint: disable=unused-argument
+            if statement.lstrip().upper().startswith("SELECT"):
+                time.sleep(args.query_latency_ms / 1000)
+
+    concurrent = app_module.run_concurrently
+    results = {}
+    for mode, gather in [
+        ("sync", one_after_another(app_module)),
+        ("async", concurrent),
+    ]:
+        app_module.run_concurrently = gather
+        results[mode] = run(app, args.signups, mode)
+        print(
+            f"{mode:<6} p50 {results[mode]['p50_ms']:7.1f} ms"
+            f"  p99 {results[mode]['p99_ms']:7.1f} ms"
+        )
+    app_module.run_concurrently = concurrent
+    print(
+        f"a signup takes {results['async']['p50_ms'] / results['sync']['p50_ms']:.2f}x"
+        " as long (p50) in async mode"
+    )
+
+
+if __name__ == "__main__":
+    main()
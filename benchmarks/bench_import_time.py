@@ -0,0 +1,83 @@
+"""
+Measures how long `import app` and `create_app()` take in a fresh
+interpreter, and lists the slowest imports. Exits with status 1 when the
+median import time is over budget.
+
+    python benchmarks/bench_import_time.py --runs 5 --budget-ms 1000
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# importing must not touch the database, so point it at one that doesn't exist
+ENV = dict(os.environ, DATABASE_URL1="postgresql://unreachable.invalid/db")
+
+
+def import_profile(module="app"):
+    """
+    {module: cumulative microseconds} from python -X importtime
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=ENV,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if cumulative.strip().isdigit():
+            profile[name.strip()] = int(cumulative)
+    return profile
+
+
+def create_app_seconds():
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import time; start = time.perf_counter(); import app; app.create_app(); "
+            "print(time.perf_counter() - start)",
+        ],
+        cwd=ROOT,
+        env=ENV,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    profiles = [import_profile() for _ in range(args.runs)]
+    import_ms = statistics.median(profile["app"] for profile in profiles) / 1000
+    startup_ms = (
+        statistics.median(create_app_seconds() for _ in range(args.runs)) * 1000
+    )
+    print(f"import app               {import_ms:8.1f} ms (median of {args.runs})")
+    print(f"import app + create_app  {startup_ms:8.1f} ms")
+    print("slowest imports (cumulative):")
+    slowest = sorted(profiles[-1].items(), key=lambda item: item[1], reverse=True)
+    for name, micros in slowest[1 : args.top + 1]:
+        print(f"  {name:<40} {micros / 1000:8.1f} ms")
+    if import_ms > args.budget_ms:
+        print(f"over budget: {import_ms:.1f} ms > {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
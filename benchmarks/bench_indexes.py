@@ -0,0 +1,195 @@
+"""
+Query-plan benchmark for the Instruments/Strings/Sessions lookups.
+
+Seeds a throwaway SQLite database with a few million sessions, then times the
+app's lookup helpers with the model indexes dropped and again with them
+created. Run from the repo root:
+
+    python benchmarks/bench_indexes.py --sessions 2000000
+
+Pass --json to get machine-readable output that can be diffed between commits.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--instruments-per-user", type=int, default=3)
+    parser.add_argument("--strings-per-instrument", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--json", action="store_true")
+    return parser.parse_args()
+
+
+def seed(db, args):
+    """
+    Bulk loads users, instruments, strings and sessions with executemany
+    """
+    rng = random.Random(0)
+    conn = db.engine.raw_connection()
+    cur = conn.cursor()
+    cur.executemany(
+        "INSERT INTO user (id, email, username, password) VALUES (?, ?, ?, ?)",
+        (
+            (u, f"user{u}@example.com", f"user{u}", "x")
+            for u in range(1, args.users + 1)
+        ),
+    )
+    instruments = []
+    for u in range(1, args.users + 1):
+        for i in range(args.instruments_per_user):
+            instr_id = len(instruments) + 1
+            instruments.append(
+                (instr_id, f"Guitar {i} - guitar", u, f"Guitar {i}", "guitar")
+            )
+    cur.executemany(
+        "INSERT INTO instruments (instr_id, compound_name, user_id, instr_name, instr_type)"
+        " VALUES (?, ?, ?, ?, ?)",
+        instruments,
+    )
+    strings = []
+    for instr_id, _, user_id, _, _ in instruments:
+        for s in range(args.strings_per_instrument):
+            strings.append((len(strings) + 1, instr_id, f"EXL11{s}", 12, user_id))
+    cur.executemany(
+        "INSERT INTO strings (str_id, instr_id, str_name, str_cost) VALUES (?, ?, ?, ?)",
+        (row[:4] for row in strings),
+    )
+
+    def sessions():
+        for _ in range(args.sessions):
+            str_id, instr_id, _, _, user_id = strings[rng.randrange(len(strings))]
+            yield (user_id, instr_id, str_id, rng.randint(5, 120), rng.randint(0, 365))
+
+    cur.executemany(
+        "INSERT INTO sessions (user_id, instr_id, string_id, playtime_mins, date)"
+        " VALUES (?, ?, ?, ?, ?)",
+        sessions(),
+    )
+    conn.commit()
+    conn.close()
+    return strings
+
+
+def time_case(fn, repeat):
+    samples = [fn() for _ in range(repeat)]
+    return {"p50_ms": statistics.median(samples), "max_ms": max(samples)}
+
+
+def run_cases(app, app_module, strings, args):
+    from flask_login import login_user
+
+    db = app_module.db
+    rng = random.Random(1)
+    results = {}
+    picks = [strings[rng.randrange(len(strings))] for _ in range(args.repeat)]
+    picks_iter = iter(picks * 8)
+
+    def with_user(fn):
+        def run():
+            str_id, instr_id, _, _, user_id = next(picks_iter)
+            user = app_module.User.query.get(user_id)
+            user.current_instr_id = instr_id
+            with app.test_request_context():
+                login_user(user)
+                start = time.perf_counter()
+                fn(str_id)
+                return (time.perf_counter() - start) * 1000
+
+        return run
+
+    results["getCurrentInstrument"] = time_case(
+        with_user(lambda _: app_module.getCurrentInstrument("Guitar 1")), args.repeat
+    )
+    results["getUserStringNames"] = time_case(
+        with_user(lambda _: app_module.getUserStringNames()), args.repeat
+    )
+    results["sessions_by_string"] = time_case(
+        with_user(
+            lambda str_id: app_module.Sessions.query.filter_by(string_id=str_id).all()
+        ),
+        args.repeat,
+    )
+    results["sessions_by_string_and_date_range"] = time_case(
+        with_user(
+            lambda str_id: app_module.Sessions.query.filter(
+                app_module.Sessions.string_id == str_id,
+                app_module.Sessions.date.between(30, 60),
+            ).all()
+        ),
+        args.repeat,
+    )
+    db.session.rollback()
+    return results
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="stringtracker-bench-")
+    os.environ["DATABASE_URL1"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("SECRET_KEY", "bench")
+    import app as app_module  # pylint: disable=import-outside-toplevel
+
+    app = app_module.create_app()
+    db = app_module.db
+    with app.app_context():
+        db.create_all()
+        indexes = [
+            index for table in db.metadata.sorted_tables for index in table.indexes
+        ]
+        for index in indexes:
+            index.drop(bind=db.engine, checkfirst=True)
+
+        start = time.perf_counter()
+        strings = seed(db, args)
+        seeded_in = time.perf_counter() - start
+
+        before = run_cases(app, app_module, strings, args)
+        start = time.perf_counter()
+        for index in indexes:
+            index.create(bind=db.engine, checkfirst=True)
+        db.session.execute("ANALYZE")
+        indexed_in = time.perf_counter() - start
+        after = run_cases(app, app_module, strings, args)
+
+    report = {
+        "sessions": args.sessions,
+        "strings": len(strings),
+        "seed_seconds": round(seeded_in, 2),
+        "index_build_seconds": round(indexed_in, 2),
+        "cases": {
+            name: {
+                "before_p50_ms": round(before[name]["p50_ms"], 3),
+                "after_p50_ms": round(after[name]["p50_ms"], 3),
+                "speedup": round(before[name]["p50_ms"] / after[name]["p50_ms"], 1),
+            }
+            for name in before
+        },
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(
+        f"{report['sessions']} sessions over {report['strings']} strings "
+        f"(seeded in {report['seed_seconds']}s, indexed in {report['index_build_seconds']}s)"
+    )
+    for name, case in report["cases"].items():
+        print(
+            f"  {name:<36} {case['before_p50_ms']:>10.3f} ms -> "
+            f"{case['after_p50_ms']:>8.3f} ms  ({case['speedup']}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
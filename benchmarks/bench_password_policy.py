@@ -0,0 +1,147 @@
+"""
+Micro-benchmark: single-pass PasswordPolicy vs the original per-character
+`in` scans that password_meet_requirements used to do.
+
+    python benchmarks/bench_password_policy.py --passwords 200000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from password_policy import PasswordPolicy  # pylint: disable=wrong-import-position
+
+# The original implementation from app.py, copied verbatim as the baseline
+def legacy_meet_requirements(password):
+    contains_special_char = does_contains_special_char(password)
+    contains_number = does_contains_number(password)
+    mixed_case = is_mixed_case(password)
+    if len(password) >= 8 and contains_special_char and contains_number and mixed_case:
+        return True
+    else:
+        return False
+
+
+def does_contains_special_char(password):
+    if (
+        ("!" in password)
+        or ("@" in password)
+        or ("~" in password)
+        or ("#" in password)
+        or ("$" in password)
+        or ("%" in password)
+        or ("^" in password)
+        or ("^" in password)
+        or ("&" in password)
+        or ("*" in password)
+        or ("(" in password)
+        or (")" in password)
+        or ("_" in password)
+        or ("-" in password)
+        or ("+" in password)
+        or ("=" in password)
+        or ("{" in password)
+        or ("}" in password)
+        or ("[" in password)
+        or ("]" in password)
+        or (":" in password)
+        or (";" in password)
+        or ("'" in password)
+        or ('"' in password)
+        or ("<" in password)
+        or (">" in password)
+        or ("," in password)
+        or ("." in password)
+        or ("?" in password)
+        or ("/" in password)
+    ):
+        return True
+    else:
+        return False
+
+
+def does_contains_number(password):
+    if (
+        ("0" in password)
+        or ("1" in password)
+        or ("2" in password)
+        or ("3" in password)
+        or ("4" in password)
+        or ("5" in password)
+        or ("6" in password)
+        or ("7" in password)
+        or ("8" in password)
+        or ("9" in password)
+    ):
+        return True
+    else:
+        return False
+
+
+def is_mixed_case(
+    password,
+):  # are there upper and lowercase letters? https://www.kite.com/python/answers/how-to-check-if-a-string-is-upper,-lower,-or-mixed-case-in-python
+    if password.islower() or password.isupper():
+        return False
+    elif not password.islower() and not password.isupper():
+        return True
+    else:
+        return False
+
+
+def make_passwords(count, seed=0):
+    rng = random.Random(seed)
+    alphabet = string.ascii_letters + string.digits + "!@#$%^&*"
+    passwords = []
+    for _ in range(count):
+        length = rng.randint(6, 24)
+        if rng.random() < 0.5:
+            # weak password: letters only, the worst case for the old scans
+            passwords.append(
+                "".join(rng.choice(string.ascii_letters) for _ in range(length))
+            )
+        else:
+            passwords.append("".join(rng.choice(alphabet) for _ in range(length)))
+    return passwords
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--passwords", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=15)
+    args = parser.parse_args()
+
+    passwords = make_passwords(args.passwords)
+    policy = PasswordPolicy()
+
+    def legacy():
+        for password in passwords:
+            legacy_meet_requirements(password)
+
+    def engine():
+        for password in passwords:
+            policy.check(password)
+
+    def engine_batch():
+        for _ in policy.check_many(passwords):
+            pass
+
+    runs = [("legacy", legacy), ("engine", engine), ("engine_batch", engine_batch)]
+    # the rounds take turns, so a noisy moment doesn't favour one of them
+    best = {name: float("inf") for name, _ in runs}
+    for _ in range(args.repeat):
+        for name, fn in runs:
+            best[name] = min(best[name], timeit.timeit(fn, number=1))
+    for name, _ in runs:
+        per_call_us = best[name] / len(passwords) * 1e6
+        print(
+            f"{name:<14} {best[name] * 1000:9.1f} ms total  {per_call_us:6.2f} us/password"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark: vectorized string-health scoring vs the per-string Python formula
+the analytics page used to run, plus the compute-string-health job end to end
+on a throwaway SQLite database.
+
+    python benchmarks/bench_string_health.py --strings 1000000 --job-strings 100000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import string_health  # pylint: disable=wrong-import-position
+
+
+def legacy_health(playtime_mins, avg_lifespan_hrs, cost):
+    total_playtime_hrs = playtime_mins / 60
+    string_life = 1 - total_playtime_hrs / avg_lifespan_hrs
+    if string_life > 0.3:
+        tier = 3
+    elif string_life > 0.10:
+        tier = 2
+    else:
+        tier = 1
+    cost_hr = cost / total_playtime_hrs if total_playtime_hrs > 0 else 0
+    return tier, cost_hr
+
+
+def bench_engine(count):
+    rng = np.random.default_rng(0)
+    playtime = rng.integers(0, 60 * 150, count)
+    lifespans = rng.uniform(60, 140, count)
+    costs = rng.uniform(5, 20, count)
+
+    start = time.perf_counter()
+    for args in zip(playtime.tolist(), lifespans.tolist(), costs.tolist()):
+        legacy_health(*args)
+    legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    string_health.compute_health(playtime, lifespans, costs)
+    vectorized = time.perf_counter() - start
+    print(f"per-string loop  {legacy * 1000:9.1f} ms for {count} strings")
+    print(f"vectorized       {vectorized * 1000:9.1f} ms for {count} strings")
+
+
+def bench_job(count):
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL1"] = f"sqlite:///{path}"
+    from app import (  # pylint: disable=import-outside-toplevel
+        create_app,
+        db,
+        Instruments,
+        Strings,
+        StringTotals,
+        User,
+    )
+
+    app = create_app()
+    rng = np.random.default_rng(1)
+    with app.app_context():
+        db.create_all()
+        user = User(email="bench@test.com", username="bench", password="x")
+        db.session.add(user)
+        db.session.commit()
+        instr = Instruments(
+            compound_name="Bench - guitar",
+            user_id=user.id,
+            instr_name="Bench",
+            instr_type="guitar",
+        )
+        db.session.add(instr)
+        db.session.commit()
+        db.session.execute(
+            Strings.__table__.insert(),
+            [
+                {
+                    "str_id": i,
+                    "instr_id": instr.instr_id,
+                    "str_name": f"S{i % 50}",
+                    "str_cost": 8,
+                }
+                for i in range(1, count + 1)
+            ],
+        )
+        db.session.execute(
+            StringTotals.__table__.insert(),
+            [
+                {
+                    "string_id": i,
+                    "total_playtime_mins": int(mins),
+                    "session_count": 1,
+                    "first_session_date": 0,
+                    "last_session_date": 0,
+                }
+                for i, mins in enumerate(rng.integers(0, 60 * 150, count).tolist(), 1)
+            ],
+        )
+        db.session.commit()
+
+    start = time.perf_counter()
+    result = app.test_cli_runner().invoke(args=["compute-string-health"])
+    elapsed = time.perf_counter() - start
+    print(result.output.strip())
+    print(f"compute-string-health  {elapsed * 1000:9.1f} ms for {count} strings")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--strings", type=int, default=1_000_000)
+    parser.add_argument("--job-strings", type=int, default=100_000)
+    args = parser.parse_args()
+    bench_engine(args.strings)
+    if args.job_strings:
+        bench_job(args.job_strings)
+
+
+if __name__ == "__main__":
+    main()
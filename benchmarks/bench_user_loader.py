@@ -0,0 +1,87 @@
+"""
+Benchmark: authenticated requests per second with the cached UserSnapshot
+loader vs loading the ORM User on every request (USER_CACHE_TTL=0).
+
+Requests go through Flask's test client against a throwaway SQLite
+database, so the numbers exclude network and WSGI server overhead.
+
+    python benchmarks/bench_user_loader.py --requests 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["DATABASE_URL1"] = "sqlite:///" + os.path.join(
+    tempfile.mkdtemp(), "bench.db"
+)
+os.environ.setdefault("PASSWORD_HASH_WORKERS", "0")
+
+import app as app_module  # pylint: disable=wrong-import-position
+from user_cache import UserCache  # pylint: disable=wrong-import-position
+
+app = app_module.create_app()
+db = app_module.db
+
+
+def seed():
+    with app.app_context():
+        db.create_all()
+        user = app_module.User(email="bench@test.com", username="bench", password="x")
+        db.session.add(user)
+        db.session.commit()
+        instr = app_module.Instruments(
+            compound_name="Bench - guitar",
+            user_id=user.id,
+            instr_name="Bench",
+            instr_type="guitar",
+        )
+        db.session.add(instr)
+        db.session.commit()
+        user.current_instr_id = instr.instr_id
+        db.session.commit()
+        return user.id
+
+
+def run(user_id, path, count, headers):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+    client.get(path, headers=headers)  # warm up
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get(path, headers=headers)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    app.secret_key = "bench"
+    user_id = seed()
+    load = lambda user_id: app_module.User.query.get(user_id)
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+        etag = client.get("/api/instruments").headers["ETag"]
+
+    for path, headers in [
+        ("/api/instruments", {"If-None-Match": etag}),
+        ("/api/instruments", {}),
+        ("/home", {}),
+    ]:
+        label = path + (" (304)" if headers else "")
+        for name, ttl in [("uncached", 0), ("cached", 10)]:
+            app_module.user_cache = UserCache(load, ttl=ttl)
+            rps = run(user_id, path, args.requests, headers)
+            print(f"{label:<24} {name:<9} {rps:9.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
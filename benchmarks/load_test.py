@@ -0,0 +1,428 @@
+"""
+HTTP load test: starts the app on a seeded throwaway SQLite database, with a
+local stand-in for the email validation API, and drives scripted user
+journeys against it from concurrent clients. Prints (or saves) per-route
+throughput and latency percentiles as JSON; pass --compare to diff against
+a previous run.
+
+    python benchmarks/load_test.py --journeys 200 --concurrency 16 --output after.json
+    python benchmarks/load_test.py --server gunicorn --compare after.json
+
+Journeys:
+    new        signup -> login -> add instrument -> add strings -> log sessions
+               -> analytics -> database
+    returning  login (a seeded user) -> home -> log sessions -> analytics
+               -> JSON API with and without If-None-Match
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SEED_PASSWORD = "Seeded-pass1"
+
+
+class StubEmailAPI(BaseHTTPRequestHandler):
+    """
+    Answers every isitarealemail.com style lookup with "valid"
+    """
+
+    def do_GET(self):
+        body = b'{"status": "valid"}'
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(users, instruments, strings, sessions):
+    """
+    Creates the schema and bulk loads `users` returning users, each with
+    instruments, strings and sessions. Returns their emails.
+    """
+    from app import (  # pylint: disable=import-outside-toplevel
+        create_app,
+        db,
+        Instruments,
+        Sessions,
+        Strings,
+        User,
+    )
+    import app as app_module  # pylint: disable=import-outside-toplevel
+
+    app = create_app()
+    rng = random.Random(0)
+    now = int(time.time())
+    with app.app_context():
+        db.create_all()
+        # one hash shared by every seeded user keeps seeding fast
+        password = app_module.password_hasher.hash(SEED_PASSWORD)
+        db.session.execute(
+            User.__table__.insert(),
+            [
+                {
+                    "id": u,
+                    "email": f"seed{u}@example.com",
+                    "username": f"seed{u}",
+                    "password": password,
+                    "current_instr_id": (u - 1) * instruments + 1,
+                }
+                for u in range(1, users + 1)
+            ],
+        )
+        instr_rows, string_rows = [], []
+        for u in range(1, users + 1):
+            for i in range(instruments):
+                instr_id = len(instr_rows) + 1
+                instr_rows.append(
+                    {
+                        "instr_id": instr_id,
+                        "compound_name": f"Guitar {i} - guitar",
+                        "user_id": u,
+                        "instr_name": f"Guitar {i}",
+                        "instr_type": "guitar",
+                    }
+                )
+                for s in range(strings):
+                    string_rows.append(
+                        {
+                            "str_id": len(string_rows) + 1,
+                            "instr_id": instr_id,
+                            "str_name": f"EXL11{s}",
+                            "str_cost": 8,
+                            "user_id": u,
+                        }
+                    )
+        db.session.execute(Instruments.__table__.insert(), instr_rows)
+        db.session.execute(
+            Strings.__table__.insert(),
+            [{k: v for k, v in row.items() if k != "user_id"} for row in string_rows],
+        )
+        session_rows = []
+        for _ in range(sessions):
+            row = string_rows[rng.randrange(len(string_rows))]
+            session_rows.append(
+                {
+                    "user_id": row["user_id"],
+                    "instr_id": row["instr_id"],
+                    "string_id": row["str_id"],
+                    "playtime_mins": rng.randint(5, 120),
+                    "date": now - rng.randint(0, 180 * 86400),
+                }
+            )
+        db.session.execute(Sessions.__table__.insert(), session_rows)
+        db.session.commit()
+    runner = app.test_cli_runner()
+    for command in (
+        "rebuild-string-totals",
+        "rebuild-rollups",
+        "compute-string-health",
+    ):
+        result = runner.invoke(args=[command])
+        if result.exit_code:
+            raise RuntimeError(f"{command} failed: {result.output}")
+    return [f"seed{u}@example.com" for u in range(1, users + 1)]
+
+
+def start_server(kind, port, env):
+    if kind == "gunicorn":
+        command = ["gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+    else:
+        command = [sys.executable, os.path.abspath(__file__), "--serve"]
+    process = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=dict(env, PORT=str(port)),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("the app did not start")
+
+
+def serve():
+    """
+    --serve: the threaded Werkzeug server, in its own process so the load
+    generator doesn't compete with it for the GIL
+    """
+    from werkzeug.serving import make_server  # pylint: disable=import-outside-toplevel
+
+    from wsgi import app  # pylint: disable=import-outside-toplevel
+
+    make_server(
+        "127.0.0.1", int(os.environ["PORT"]), app, threaded=True
+    ).serve_forever()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def request(self, session, method, base, path, label=None, **kwargs):
+        label = label or f"{method} {path}"
+        start = time.perf_counter()
+        try:
+            response = session.request(
+                method, base + path, allow_redirects=False, timeout=60, **kwargs
+            )
+            failed = response.status_code >= 400
+        except requests.RequestException:
+            response, failed = None, True
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples[label].append(elapsed_ms)
+            if failed:
+                self.errors[label] += 1
+        return response
+
+
+def new_user_journey(recorder, base, number, sessions_per_journey):
+    session = requests.Session()
+    email = f"load{number}@example.com"
+    password = "Load-test1"
+    recorder.request(
+        session,
+        "POST",
+        base,
+        "/signup",
+        data={"email": email, "username": f"load{number}", "password": password},
+    )
+    recorder.request(
+        session, "POST", base, "/login", data={"email": email, "password": password}
+    )
+    recorder.request(
+        session,
+        "POST",
+        base,
+        "/database",
+        data={"instr_type": "Guitar", "instr_name": "Load Paul"},
+    )
+    recorder.request(
+        session,
+        "POST",
+        base,
+        "/add_strings",
+        data={"str_name": "EXL110", "str_cost": "8"},
+    )
+    for _ in range(sessions_per_journey):
+        recorder.request(session, "POST", base, "/addsession", data={"playmins": "45"})
+    recorder.request(session, "GET", base, "/analytics")
+    recorder.request(session, "GET", base, "/database")
+
+
+def returning_user_journey(recorder, base, email, sessions_per_journey):
+    session = requests.Session()
+    recorder.request(
+        session,
+        "POST",
+        base,
+        "/login",
+        data={"email": email, "password": SEED_PASSWORD},
+    )
+    recorder.request(session, "GET", base, "/home")
+    for _ in range(sessions_per_journey):
+        recorder.request(session, "POST", base, "/addsession", data={"playmins": "30"})
+    recorder.request(session, "GET", base, "/analytics")
+    response = recorder.request(session, "GET", base, "/api/analytics")
+    etag = response.headers.get("ETag") if response is not None else None
+    if etag:
+        recorder.request(
+            session,
+            "GET",
+            base,
+            "/api/analytics",
+            label="GET /api/analytics (304)",
+            headers={"If-None-Match": etag},
+        )
+
+
+def percentile(sorted_samples, fraction):
+    index = max(0, int(round(fraction * len(sorted_samples) + 0.5)) - 1)
+    return sorted_samples[min(index, len(sorted_samples) - 1)]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for label, samples in sorted(recorder.samples.items()):
+        ordered = sorted(samples)
+        routes[label] = {
+            "requests": len(ordered),
+            "errors": recorder.errors[label],
+            "throughput_rps": round(len(ordered) / elapsed, 1),
+            "p50_ms": round(percentile(ordered, 0.50), 2),
+            "p90_ms": round(percentile(ordered, 0.90), 2),
+            "p99_ms": round(percentile(ordered, 0.99), 2),
+            "max_ms": round(ordered[-1], 2),
+        }
+    return routes
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    print(f"{'route':<28} {'p50 ms':^17} {'p99 ms':^19} {'rps':^15}")
+    for label, now in report["routes"].items():
+        before = baseline["routes"].get(label)
+        if before is None:
+            print(f"{label:<28} (new)")
+            continue
+        print(
+            f"{label:<28} {before['p50_ms']:>7.1f} -> {now['p50_ms']:<7.1f}"
+            f" {before['p99_ms']:>8.1f} -> {now['p99_ms']:<8.1f}"
+            f" {before['throughput_rps']:>6.1f} -> {now['throughput_rps']:<6.1f}"
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--server", choices=["werkzeug", "gunicorn"], default="werkzeug"
+    )
+    parser.add_argument("--journeys", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--returning-ratio",
+        type=float,
+        default=0.5,
+        help="share of journeys by seeded (returning) users",
+    )
+    parser.add_argument("--sessions-per-journey", type=int, default=3)
+    parser.add_argument("--seed-users", type=int, default=200)
+    parser.add_argument("--seed-sessions", type=int, default=20000)
+    parser.add_argument(
+        "--hash-method",
+        default=None,
+        help="PASSWORD_HASH_METHOD for the run, e.g. a cheaper pbkdf2 cost",
+    )
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument("--compare", help="JSON report of an earlier run")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.serve:
+        serve()
+        return
+
+    email_api = ThreadingHTTPServer(("127.0.0.1", 0), StubEmailAPI)
+    threading.Thread(target=email_api.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp(prefix="stringtracker-load-")
+    env = dict(
+        os.environ,
+        DATABASE_URL1=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        SECRET_KEY="load-test",
+        EMAIL_VALIDATOR_URL=f"http://127.0.0.1:{email_api.server_port}/api/email/validate",
+    )
+    if args.hash_method:
+        env["PASSWORD_HASH_METHOD"] = args.hash_method
+    os.environ.update(env)
+
+    emails = seed(args.seed_users, 2, 2, args.seed_sessions)
+    port = free_port()
+    server = start_server(args.server, port, env)
+    base = f"http://127.0.0.1:{port}"
+    recorder = Recorder()
+    rng = random.Random(1)
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            futures = []
+            for number in range(args.journeys):
+                if rng.random() < args.returning_ratio:
+                    futures.append(
+                        pool.submit(
+                            returning_user_journey,
+                            recorder,
+                            base,
+                            rng.choice(emails),
+                            args.sessions_per_journey,
+                        )
+                    )
+                else:
+                    futures.append(
+                        pool.submit(
+                            new_user_journey,
+                            recorder,
+                            base,
+                            number,
+                            args.sessions_per_journey,
+                        )
+                    )
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        email_api.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "server": args.server,
+        "journeys": args.journeys,
+        "concurrency": args.concurrency,
+        "returning_ratio": args.returning_ratio,
+        "seconds": round(elapsed, 2),
+        "routes": summarize(recorder, elapsed),
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            compare(report, json.load(baseline))
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
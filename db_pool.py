@@ -0,0 +1,44 @@
+"""
+SQLAlchemy connection pool settings for the production server.
+
+Every gunicorn worker process has its own engine and pool, so the pool is
+sized per worker: by default one connection per worker thread plus a little
+overflow, capped so that all workers together stay within DB_MAX_CONNECTIONS
+(e.g. the connection limit of the Heroku Postgres plan).
+"""
+from metrics import TimedQueuePool
+
+
+def engine_options(config, uri):
+    """
+    Keyword arguments for create_engine (SQLALCHEMY_ENGINE_OPTIONS) from:
+
+        DB_POOL_SIZE          connections kept open per worker (default: threads)
+        DB_MAX_OVERFLOW       extra connections allowed under load (default 2)
+        DB_MAX_CONNECTIONS    total budget shared by WEB_CONCURRENCY workers
+        DB_POOL_PRE_PING      test connections before use, "0" to skip (default 1)
+        DB_POOL_RECYCLE       seconds before a connection is replaced (default 1800)
+        DB_POOL_TIMEOUT       seconds to wait for a free connection (default 10)
+
+    SQLite (tests, local development) keeps SQLAlchemy's defaults.
+    """
+    if not uri or uri.startswith("sqlite"):
+        return {}
+    threads = int(config.get("GUNICORN_THREADS", 4))
+    pool_size = int(config.get("DB_POOL_SIZE", threads))
+    max_overflow = int(config.get("DB_MAX_OVERFLOW", 2))
+    budget = config.get("DB_MAX_CONNECTIONS")
+    if budget:
+        per_worker = max(1, int(budget) // int(config.get("WEB_CONCURRENCY", 2)))
+        pool_size = min(pool_size, per_worker)
+        max_overflow = min(max_overflow, per_worker - pool_size)
+    return {
+        # a QueuePool that also records checkout wait times
+        "poolclass": TimedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_pre_ping": str(config.get("DB_POOL_PRE_PING", "1")).lower()
+        not in ("0", "false", "no"),
+        "pool_recycle": int(config.get("DB_POOL_RECYCLE", 1800)),
+        "pool_timeout": int(config.get("DB_POOL_TIMEOUT", 10)),
+    }
@@ -0,0 +1,235 @@
+"""
+Email validation for signup.
+
+EmailValidator puts a TTL+LRU cache and a fallback policy in front of two
+backends:
+
+- OfflineEmailBackend checks syntax and a list of disposable domains locally
+- RemoteEmailBackend asks an isitarealemail.com compatible API, over a pooled
+  HTTP session with strict timeouts
+
+Verdicts are the strings "valid" and "invalid", as before.
+"""
+import re
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from ttl_cache import TTLCache
+
+VALID = "valid"
+INVALID = "invalid"
+
+DEFAULT_REMOTE_URL = "https://isitarealemail.com/api/email/validate"
+
+DEFAULT_DISPOSABLE_DOMAINS = frozenset(
+    [
+        "10minutemail.com",
+        "discard.email",
+        "dispostable.com",
+        "fakeinbox.com",
+        "getnada.com",
+        "guerrillamail.com",
+        "mailinator.com",
+        "maildrop.cc",
+        "mintemail.com",
+        "sharklasers.com",
+        "temp-mail.org",
+        "tempmail.com",
+        "throwawaymail.com",
+        "trashmail.com",
+        "yopmail.com",
+    ]
+)
+
+# Deliberately loose: one @, no whitespace, a dotted domain of sane labels
+EMAIL_RE = re.compile(
+    r"^[^@\s]{1,64}@(?=.{1,253}$)(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$"
+)
+
+
+class EmailBackendUnavailable(Exception):
+    """
+    Raised when a backend can't give a verdict in time
+    """
+
+
+def split_domain(email):
+    return email.rpartition("@")[2]
+
+
+class OfflineEmailBackend:
+    """
+    Syntax and disposable-domain checks with no network access
+    """
+
+    def __init__(self, disposable_domains=DEFAULT_DISPOSABLE_DOMAINS):
+        self.disposable_domains = frozenset(d.lower() for d in disposable_domains)
+
+    def validate(self, email):
+        if not EMAIL_RE.match(email):
+            return INVALID
+        domain = split_domain(email)
+        # also catches subdomains like foo.mailinator.com
+        labels = domain.split(".")
+        for i in range(len(labels) - 1):
+            if ".".join(labels[i:]) in self.disposable_domains:
+                return INVALID
+        return VALID
+
+
+class RemoteEmailBackend:
+    """
+    Client for an isitarealemail.com style API returning {"status": ...}.
+    Connections are pooled and every call is bounded by `timeout`
+    (seconds, or a (connect, read) tuple); there are no retries.
+    """
+
+    def __init__(self, url=DEFAULT_REMOTE_URL, timeout=(1.0, 2.0), pool_size=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def validate(self, email):
+        try:
+            response = self.session.get(
+                self.url, params={"email": email}, timeout=self.timeout
+            )
+            response.raise_for_status()
+            status = response.json()["status"]
+        except (requests.RequestException, ValueError, KeyError, TypeError) as exc:
+            raise EmailBackendUnavailable(str(exc)) from exc
+        return VALID if status == VALID else INVALID
+
+
+class EmailValidator:
+    """
+    Validates addresses offline first, then through the remote backend (if
+    any), caching verdicts per domain and per address.
+
+    If the remote backend fails or times out, `fallback` decides the verdict:
+    "offline" trusts the offline checks, "accept" lets the address through
+    and "reject" refuses it. Fallback verdicts are not cached. After
+    `breaker_threshold` consecutive failures the remote is skipped for
+    `breaker_cooldown` seconds so a slow upstream doesn't cost every signup
+    a full timeout.
+    """
+
+    FALLBACKS = ("offline", "accept", "reject")
+
+    def __init__(
+        self,
+        remote=None,
+        offline=None,
+        cache=None,
+        fallback="offline",
+        breaker_threshold=3,
+        breaker_cooldown=30,
+        clock=time.monotonic,
+    ):
+        if fallback not in self.FALLBACKS:
+            raise ValueError(f"fallback must be one of {', '.join(self.FALLBACKS)}")
+        self.remote = remote
+        self.offline = offline or OfflineEmailBackend()
+        self.cache = cache if cache is not None else TTLCache()
+        self.fallback = fallback
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self._clock = clock
+        self._failures = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+
+    def validate(self, email):
+        email = (email or "").strip().lower()
+        domain = split_domain(email)
+        cached = self.cache.get(("domain", domain)) or self.cache.get(
+            ("address", email)
+        )
+        if cached is not None:
+            return cached
+
+        if self.offline.validate(email) == INVALID:
+            if EMAIL_RE.match(email):
+                # well formed, so it was rejected for its domain
+                self.cache.set(("domain", domain), INVALID)
+            return INVALID
+        if self.remote is None:
+            return VALID
+
+        if self._breaker_open():
+            return self._fallback_verdict()
+        try:
+            verdict = self.remote.validate(email)
+        except EmailBackendUnavailable:
+            self._record_failure()
+            return self._fallback_verdict()
+        self._record_success()
+        self.cache.set(("address", email), verdict)
+        return verdict
+
+    def _fallback_verdict(self):
+        return INVALID if self.fallback == "reject" else VALID
+
+    def _breaker_open(self):
+        return self._open_until > self._clock()
+
+    def _record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.breaker_threshold:
+                self._open_until = self._clock() + self.breaker_cooldown
+                self._failures = 0
+
+    def _record_success(self):
+        with self._lock:
+            self._failures = 0
+
+
+def load_domain_list(path):
+    with open(path, encoding="utf-8") as domains:
+        return [
+            line.strip()
+            for line in domains
+            if line.strip() and not line.startswith("#")
+        ]
+
+
+def build_validator(config):
+    """
+    Builds an EmailValidator from a mapping of settings (os.environ or
+    app.config):
+
+    EMAIL_VALIDATOR_BACKEND     "remote" (default) or "offline"
+    EMAIL_VALIDATOR_URL         remote API endpoint
+    EMAIL_VALIDATOR_TIMEOUT     seconds allowed per remote call (default 2)
+    EMAIL_VALIDATOR_FALLBACK    "offline" (default), "accept" or "reject"
+    EMAIL_VALIDATOR_CACHE_TTL   seconds a verdict is cached (default 86400)
+    EMAIL_VALIDATOR_CACHE_SIZE  max cached verdicts (default 10000)
+    EMAIL_DISPOSABLE_DOMAINS_FILE  extra disposable domains, one per line
+    """
+    domains = set(DEFAULT_DISPOSABLE_DOMAINS)
+    if config.get("EMAIL_DISPOSABLE_DOMAINS_FILE"):
+        domains.update(load_domain_list(config["EMAIL_DISPOSABLE_DOMAINS_FILE"]))
+
+    remote = None
+    if config.get("EMAIL_VALIDATOR_BACKEND", "remote") == "remote":
+        timeout = float(config.get("EMAIL_VALIDATOR_TIMEOUT", 2))
+        remote = RemoteEmailBackend(
+            url=config.get("EMAIL_VALIDATOR_URL") or DEFAULT_REMOTE_URL,
+            timeout=(min(timeout, 1.0), timeout),
+        )
+    return EmailValidator(
+        remote=remote,
+        offline=OfflineEmailBackend(domains),
+        cache=TTLCache(
+            maxsize=int(config.get("EMAIL_VALIDATOR_CACHE_SIZE", 10000)),
+            ttl=float(config.get("EMAIL_VALIDATOR_CACHE_TTL", 86400)),
+        ),
+        fallback=config.get("EMAIL_VALIDATOR_FALLBACK", "offline"),
+    )
@@ -0,0 +1,31 @@
+"""
+Production server settings: gunicorn -c gunicorn.conf.py wsgi:app
+
+Pre-forks WEB_CONCURRENCY worker processes with GUNICORN_THREADS threads
+each. The app is loaded once in the master and shared copy-on-write, and
+workers are recycled after a (jittered) number of requests. create_app opens
+no database connections, so forked workers never share one. `kill -HUP` on
+the master restarts the workers gracefully, finishing in-flight requests.
+"""
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8230')}"
+# write-behind reads a user's unwritten sessions from its own process's
+# journal, so it runs one worker (see session_journal.py)
+write_behind = os.environ.get("SESSION_WRITE_BEHIND", "").lower()
+write_behind_off = write_behind in ("", "0", "false", "no")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 if write_behind_off else 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+preload_app = True
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+
+accesslog = "-"
+errorlog = "-"
+forwarded_allow_ips = "*"
+
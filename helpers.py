@@ -0,0 +1,38 @@
+"""
+Pure helper functions used by the app, with no Flask or database dependency,
+so they can be imported (and tested) without building the app.
+"""
+import calendar
+import datetime
+
+
+def getCompoundName(instr_name, instr_type):
+    return f"{instr_name} - {instr_type}"
+
+
+def validate_new_instr_form(instr_name, instr_type):
+    if instr_name != "" and instr_type != "":
+        return True
+    return False
+
+
+def check_email(email):
+    if (
+        email.endswith("@gmail.com")
+        or email.endswith("@yahoo.com")
+        or email.endswith("@aol.com")
+        or email.endswith("@hotmail.com")
+    ):
+        return True
+    else:
+        return False
+
+
+def legacy_date_to_timestamp(value):
+    """
+    Epoch seconds (UTC midnight) of an old MMDDYYYY session date
+    """
+    digits = f"{value:08d}"
+    return calendar.timegm(
+        datetime.date(int(digits[4:]), int(digits[:2]), int(digits[2:4])).timetuple()
+    )
@@ -0,0 +1,301 @@
+"""
+Per-request instrumentation, exposed in the Prometheus text format.
+
+init_metrics(app) records, for every request, the route latency, the number
+and duration of SQL statements it ran (through SQLAlchemy engine events) and
+warns when a request runs more than METRICS_QUERY_WARN_THRESHOLD statements,
+the usual sign of an N+1 pattern. TimedQueuePool adds the time spent waiting
+for a pooled connection, and timed() wraps outbound HTTP calls.
+
+Metrics live in the process that recorded them: with several gunicorn
+workers each /metrics response covers the worker that served it (see the
+"pid" label).
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+import flask
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class Registry:
+    """
+    Thread-safe counters and histograms keyed by name and label values
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._counters = {}
+        self._histograms = {}
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+        self._counters.setdefault(name, {})
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+        self._histograms.setdefault(name, {})
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters[name]
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets = self._meta[name][2]
+        with self._lock:
+            series = self._histograms[name]
+            counts = series.get(key)
+            if counts is None:
+                # one count per bucket, then +Inf, then the sum
+                counts = series[key] = [0] * (len(buckets) + 1) + [0.0]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            else:
+                counts[len(buckets)] += 1
+            counts[-1] += value
+
+    def value(self, name, **labels):
+        """
+        Current value of a counter, or (count, sum) of a histogram
+        """
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name].get(key, 0)
+            counts = self._histograms[name].get(key)
+            return (sum(counts[:-1]), counts[-1]) if counts else (0, 0.0)
+
+    def clear(self):
+        with self._lock:
+            for series in self._counters.values():
+                series.clear()
+            for series in self._histograms.values():
+                series.clear()
+
+    def render(self, **const_labels):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, buckets) in sorted(self._meta.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                if kind == "counter":
+                    for key, value in sorted(self._counters[name].items()):
+                        lines.append(f"{name}{_labels(key, const_labels)} {value}")
+                    continue
+                for key, counts in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets + ("+Inf",), counts):
+                        cumulative += count
+                        le = (("le", _number(bound)),)
+                        lines.append(
+                            f"{name}_bucket{_labels(key + le, const_labels)} {cumulative}"
+                        )
+                    lines.append(
+                        f"{name}_sum{_labels(key, const_labels)} {_number(counts[-1])}"
+                    )
+                    lines.append(
+                        f"{name}_count{_labels(key, const_labels)} {cumulative}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def _number(value):
+    return value if isinstance(value, str) else repr(float(value))
+
+
+def _labels(key, const_labels):
+    pairs = list(key) + sorted(const_labels.items())
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+REGISTRY = Registry()
+REGISTRY.counter("stringtracker_http_requests_total", "Requests served.")
+REGISTRY.histogram(
+    "stringtracker_http_request_duration_seconds", "Time to serve a request."
+)
+REGISTRY.counter("stringtracker_db_queries_total", "SQL statements executed.")
+REGISTRY.histogram(
+    "stringtracker_db_query_duration_seconds", "Time to execute one SQL statement."
+)
+REGISTRY.histogram(
+    "stringtracker_db_queries_per_request",
+    "SQL statements executed by one request.",
+    buckets=QUERY_COUNT_BUCKETS,
+)
+REGISTRY.counter(
+    "stringtracker_db_query_warnings_total",
+    "Requests that ran more SQL statements than METRICS_QUERY_WARN_THRESHOLD.",
+)
+REGISTRY.histogram(
+    "stringtracker_db_pool_wait_seconds", "Time spent waiting for a pooled connection."
+)
+REGISTRY.histogram(
+    "stringtracker_outbound_http_duration_seconds", "Time spent on outbound HTTP calls."
+)
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            REGISTRY.observe(
+                "stringtracker_db_pool_wait_seconds", time.perf_counter() - start
+            )
+
+
+def timed(fn, service, registry=REGISTRY):
+    """
+    Wraps an outbound call so its duration is recorded with an outcome label
+    """
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            result = fn(*args, **kwargs)
+            outcome = "ok"
+            return result
+        finally:
+            registry.observe(
+                "stringtracker_outbound_http_duration_seconds",
+                time.perf_counter() - start,
+                service=service,
+                outcome=outcome,
+            )
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    route = "none"
+    if flask.has_request_context():
+        stats = flask.g.get("metrics_queries")
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+        route = _route()
+    REGISTRY.inc("stringtracker_db_queries_total", route=route)
+    REGISTRY.observe("stringtracker_db_query_duration_seconds", elapsed, route=route)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for a failed statement
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("metrics_query_start"):
+        conn.info["metrics_query_start"].pop()
+
+
+_engine_events_installed = False
+
+
+def _install_engine_events():
+    global _engine_events_installed  # pylint: disable=global-statement
+    if not _engine_events_installed:
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _engine_events_installed = True
+
+
+def _route():
+    return flask.request.endpoint or "none"
+
+
+def init_metrics(app):
+    """
+    Records request metrics for `app`. Settings:
+
+        METRICS_QUERY_WARN_THRESHOLD  warn above this many statements (default 20)
+    """
+    _install_engine_events()
+
+    @app.before_request
+    def start_request_metrics():
+        flask.g.metrics_start = time.perf_counter()
+        flask.g.metrics_queries = [0, 0.0]
+
+    @app.after_request
+    def record_request_metrics(response):
+        _record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(error):
+        if error is not None:
+            _record(500)
+
+
+def _record(status):
+    start = flask.g.pop("metrics_start", None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    queries, query_seconds = flask.g.pop("metrics_queries", (0, 0.0))
+    route = _route()
+    method = flask.request.method
+    REGISTRY.inc(
+        "stringtracker_http_requests_total", route=route, method=method, status=status
+    )
+    REGISTRY.observe(
+        "stringtracker_http_request_duration_seconds",
+        elapsed,
+        route=route,
+        method=method,
+    )
+    REGISTRY.observe("stringtracker_db_queries_per_request", queries, route=route)
+    threshold = int(flask.current_app.config.get("METRICS_QUERY_WARN_THRESHOLD", 20))
+    if queries > threshold:
+        REGISTRY.inc("stringtracker_db_query_warnings_total", route=route)
+        logger.warning(
+            "%s %s ran %d SQL statements (%.1f ms) in %.1f ms; threshold is %d",
+            method,
+            flask.request.path,
+            queries,
+            query_seconds * 1000,
+            elapsed * 1000,
+            threshold,
+        )
+
+
+def render():
+    return REGISTRY.render(pid=os.getpid())
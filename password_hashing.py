@@ -0,0 +1,152 @@
+"""
+Password hashing off the request thread.
+
+Hashing and verification are deliberately slow, so PasswordHasher runs them
+in a small process pool. The number of calls queued or running is capped;
+once the cap is hit new calls fail fast with PoolSaturated instead of piling
+up behind a login storm (the app turns that into a 503).
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+
+class PoolSaturated(Exception):
+    """
+    Raised when the hashing pool can't take more work right now
+    """
+
+
+def normalize_method(method):
+    """
+    Spells out werkzeug's default pbkdf2 iteration count, so the configured
+    method can be compared with the prefix of stored hashes
+    """
+    if method.startswith("pbkdf2:") and method.count(":") == 1:
+        return f"{method}:{DEFAULT_PBKDF2_ITERATIONS}"
+    return method
+
+
+def pool_context():
+    """
+    How pool processes are started: never by forking the calling process,
+    which runs request threads that may hold locks (logging, the database
+    pool) a forked child would wait on forever. "forkserver" forks them from
+    a single-threaded server process; "spawn" starts fresh interpreters where
+    there's no forkserver. The hashing functions are top-level werkzeug
+    functions, so both can pickle them.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class PasswordHasher:
+    """
+    Hashes and verifies passwords in a bounded process pool. workers=0
+    runs everything inline, which is what the unit tests and one-off
+    scripts want.
+    """
+
+    def __init__(
+        self,
+        method="pbkdf2:sha256",
+        salt_length=16,
+        workers=2,
+        max_pending=None,
+        timeout=10,
+    ):
+        self.method = normalize_method(method)
+        self.salt_length = salt_length
+        self.workers = workers
+        self.max_pending = workers * 4 if max_pending is None else max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending or 1)
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        PASSWORD_HASH_METHOD       werkzeug method string (default pbkdf2:sha256)
+        PASSWORD_SALT_LENGTH       salt length (default 16)
+        PASSWORD_HASH_WORKERS      pool processes, 0 for inline (default 2)
+        PASSWORD_HASH_MAX_PENDING  queued + running calls before shedding
+        PASSWORD_HASH_TIMEOUT      seconds to wait for a result (default 10);
+                                   bounds the wait, not the work: a call
+                                   already running in the pool finishes
+        """
+        max_pending = config.get("PASSWORD_HASH_MAX_PENDING")
+        return cls(
+            method=config.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256"),
+            salt_length=int(config.get("PASSWORD_SALT_LENGTH", 16)),
+            workers=int(config.get("PASSWORD_HASH_WORKERS", 2)),
+            max_pending=None if max_pending is None else int(max_pending),
+            timeout=float(config.get("PASSWORD_HASH_TIMEOUT", 10)),
+        )
+
+    def hash(self, password):
+        return self._run(
+            generate_password_hash, password, self.method, self.salt_length
+        )
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """
+        True when a stored hash was made with other cost parameters than the
+        configured ones and should be replaced at the next successful login
+        """
+        method, _, rest = (pwhash or "").partition("$")
+        salt = rest.partition("$")[0]
+        return method != self.method or len(salt) != self.salt_length
+
+    def _run(self, fn, *args):
+        if self.workers == 0:
+            return fn(*args)
+        if self.max_pending == 0 or not self._slots.acquire(blocking=False):
+            raise PoolSaturated("Password hashing pool is saturated")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            # only drops a queued call; a running one keeps its worker busy
+            # (and its slot taken) until it finishes
+            future.cancel()
+            raise PoolSaturated("Password hashing timed out") from None
+
+    def _get_executor(self):
+        # a pool inherited through fork (e.g. a preloading server) is unusable,
+        # so each process builds its own on first use
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=pool_context()
+                )
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                if sys.version_info >= (3, 9):
+                    self._executor.shutdown(wait=False, cancel_futures=True)
+                else:
+                    self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,190 @@
+"""
+Read replicas of the main database.
+
+Read-only pages can send their queries to one of the REPLICA_DATABASE_URLS
+instead of the primary. A replica is only used while it is less than
+REPLICA_MAX_LAG seconds behind: every REPLICA_CHECK_INTERVAL seconds each
+process compares the heartbeat row on the primary with the copy the replica
+has received. The row is bumped by a background thread of every process
+(Heartbeat), also every REPLICA_CHECK_INTERVAL seconds, so requests never
+write it. A replica that can't be reached counts as infinitely behind.
+
+As the heartbeat only moves every REPLICA_CHECK_INTERVAL seconds, a
+measured lag can be short by up to that much: a page read from a replica
+is at most about REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL seconds behind.
+
+Lag awareness bounds how stale a page can be, but a user who has just
+written must not see a page without their own write: after a write, a user
+is served from the primary for REPLICA_STICKY_SECONDS.
+"""
+import itertools
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def replica_urls(config):
+    """
+    URIs of the replicas from REPLICA_DATABASE_URLS (comma or whitespace
+    separated)
+    """
+    return str(config.get("REPLICA_DATABASE_URLS") or "").replace(",", " ").split()
+
+
+def replica_bind_key(replica):
+    """
+    Flask-SQLAlchemy bind of a replica
+    """
+    return f"replica{replica}"
+
+
+class ReplicaSet:
+    """
+    Picks a replica that is close enough to the primary, round robin.
+    `measure(replica)` returns how many seconds replica 0..count-1 is behind.
+    `sticky` is how long a user who wrote is kept on the primary.
+    """
+
+    def __init__(
+        self,
+        count,
+        measure,
+        max_lag=5,
+        check_interval=5,
+        sticky=10,
+        clock=time.monotonic,
+    ):
+        self.count = count
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.sticky = sticky
+        self._measure = measure
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._lags = [float("inf")] * count
+        self._turn = itertools.count()
+
+    @classmethod
+    def from_config(cls, config, measure):
+        """
+        REPLICA_DATABASE_URLS, REPLICA_MAX_LAG and REPLICA_CHECK_INTERVAL
+        (seconds, default 5 each) and REPLICA_STICKY_SECONDS (default 10)
+        """
+        return cls(
+            len(replica_urls(config)),
+            measure,
+            max_lag=float(config.get("REPLICA_MAX_LAG", 5)),
+            check_interval=float(config.get("REPLICA_CHECK_INTERVAL", 5)),
+            sticky=float(config.get("REPLICA_STICKY_SECONDS", 10)),
+        )
+
+    @property
+    def lags(self):
+        return list(self._lags)
+
+    def check(self):
+        """
+        Measures the lag of every replica
+        """
+        lags = []
+        for replica in range(self.count):
+            try:
+                lags.append(self._measure(replica))
+            except Exception:  # pylint: disable=broad-except
+                logger.warning(
+                    "replica unavailable", exc_info=True, extra={"replica": replica}
+                )
+                lags.append(float("inf"))
+        self._lags = lags
+        self._checked_at = self._clock()
+
+    def _due(self):
+        return (
+            self._checked_at is None
+            or self._clock() - self._checked_at >= self.check_interval
+        )
+
+    def choose(self):
+        """
+        A replica to read from, or None when all are too far behind
+        """
+        if not self.count:
+            return None
+        # one request re-measures; the others use the last measurements
+        if self._due() and self._lock.acquire(blocking=False):
+            try:
+                if self._due():
+                    self.check()
+            finally:
+                self._lock.release()
+        healthy = [
+            replica for replica, lag in enumerate(self._lags) if lag <= self.max_lag
+        ]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+
+class Heartbeat:
+    """
+    Calls `beat()`, which bumps the heartbeat row on the primary, every
+    `interval` seconds from a background thread of this process
+    """
+
+    def __init__(self, beat, interval=5.0):
+        self.interval = interval
+        self._beat = beat
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+
+    @classmethod
+    def from_config(cls, config, beat):
+        """
+        REPLICA_CHECK_INTERVAL (seconds, default 5)
+        """
+        return cls(beat, interval=float(config.get("REPLICA_CHECK_INTERVAL", 5)))
+
+    def start(self):
+        """
+        Starts beating in this process (a forked one starts a thread of its
+        own). Cheap once started.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping = False
+            self._wake.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="replica-heartbeat", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            if self._stopping:
+                break
+            try:
+                self._beat()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("replica heartbeat failed", exc_info=True)
+
+    def stop(self):
+        """
+        Stops the beating thread
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
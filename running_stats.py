@@ -0,0 +1,44 @@
+"""
+Incremental mean/variance (Welford), mergeable across partial results (Chan
+et al.), so statistics can be kept up to date one observation at a time.
+"""
+
+
+class RunningStats:
+    """
+    Count, mean and sum of squared deviations (m2) of the values seen so far
+    """
+
+    __slots__ = ("count", "mean", "m2")
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def push(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        """
+        Sample variance, 0 until there are two values
+        """
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return self.variance**0.5
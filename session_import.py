@@ -0,0 +1,173 @@
+"""
+Streaming parser for bulk practice-session imports (CSV or JSONL).
+
+Nothing here touches Flask or the database: callers pass in a lookup map of
+the user's instruments/strings and a callback that inserts one batch of rows.
+Files are read one record at a time, so memory stays flat however large the
+upload is.
+"""
+import csv
+import datetime
+import json
+from collections import namedtuple
+
+FORMATS = ("csv", "jsonl")
+REQUIRED_FIELDS = ("instrument", "string", "playtime_mins", "date")
+
+RowFailure = namedtuple("RowFailure", ["line", "error"])
+
+
+class ImportReport:
+    """
+    Running tally of an import: rows inserted plus the first `max_errors`
+    per-row errors (the rest are only counted)
+    """
+
+    def __init__(self, max_errors=100):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.max_errors = max_errors
+
+    def add_error(self, line, error):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append(RowFailure(line, error))
+
+    def to_dict(self):
+        return {
+            "imported": self.imported,
+            "failed": self.failed,
+            "errors": [error._asdict() for error in self.errors],
+            "errors_truncated": self.failed - len(self.errors),
+        }
+
+
+class RowError(ValueError):
+    """
+    Raised for a record that can't be imported; the message is user facing
+    """
+
+
+def detect_format(filename, requested=None):
+    """
+    Picks the import format from an explicit choice or the file extension
+    """
+    if requested:
+        fmt = requested.lower()
+    else:
+        fmt = (filename or "").rsplit(".", 1)[-1].lower()
+        if fmt == "json":
+            fmt = "jsonl"
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported import format '{fmt}'. Use CSV or JSONL.")
+    return fmt
+
+
+def iter_records(stream, fmt):
+    """
+    Yields (line_number, record) pairs from a text stream. A record that
+    can't be decoded is yielded as a RowError instead of a dict.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_number, RowError(f"Invalid JSON: {exc}")
+                continue
+            if not isinstance(record, dict):
+                yield line_number, RowError("Each line must be a JSON object.")
+                continue
+            yield line_number, record
+
+
+def parse_timestamp(value):
+    """
+    Epoch seconds from an integer timestamp or an ISO 8601 date/datetime
+    string. Dates without a timezone are taken as UTC.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return int(value)
+    value = str(value).strip()
+    if value.lstrip("-").isdigit():
+        return int(value)
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
+
+def parse_record(record, lookup):
+    """
+    Validates one record and resolves its instrument/string names through
+    `lookup`, a dict of (instr_name, str_name) -> (instr_id, str_id)
+    """
+    missing = [field for field in REQUIRED_FIELDS if record.get(field) in (None, "")]
+    if missing:
+        raise RowError(f"Missing {', '.join(missing)}.")
+    key = (str(record["instrument"]).strip(), str(record["string"]).strip())
+    if key not in lookup:
+        raise RowError(f"Unknown instrument/string '{key[0]}' / '{key[1]}'.")
+    try:
+        playtime_mins = int(record["playtime_mins"])
+    except (TypeError, ValueError):
+        raise RowError("playtime_mins must be a whole number.") from None
+    if playtime_mins <= 0:
+        raise RowError("playtime_mins must be positive.")
+    try:
+        date = parse_timestamp(record["date"])
+    except (TypeError, ValueError):
+        raise RowError("date must be epoch seconds or an ISO 8601 date/time.") from None
+    instr_id, str_id = lookup[key]
+    return {
+        "instr_id": instr_id,
+        "string_id": str_id,
+        "playtime_mins": playtime_mins,
+        "date": date,
+    }
+
+
+def import_sessions(stream, fmt, lookup, insert_batch, batch_size=500, max_errors=100):
+    """
+    Streams records from `stream`, validating each one and handing valid rows
+    to `insert_batch(rows)` in groups of `batch_size`. Bad rows are reported
+    and skipped. If `insert_batch` raises, the rows of that batch are reported
+    as failed and the import carries on with the next batch.
+    """
+    report = ImportReport(max_errors=max_errors)
+    batch, batch_lines = [], []
+
+    def flush():
+        nonlocal batch, batch_lines
+        try:
+            insert_batch(batch)
+        except Exception as exc:  # pylint: disable=broad-except
+            for line in batch_lines:
+                report.add_error(line, f"Could not save row: {exc}")
+        else:
+            report.imported += len(batch)
+        batch, batch_lines = [], []
+
+    for line_number, record in iter_records(stream, fmt):
+        if isinstance(record, RowError):
+            report.add_error(line_number, str(record))
+            continue
+        try:
+            batch.append(parse_record(record, lookup))
+        except RowError as exc:
+            report.add_error(line_number, str(exc))
+            continue
+        batch_lines.append(line_number)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return report
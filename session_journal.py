@@ -0,0 +1,266 @@
+"""
+Write-behind buffering of practice sessions.
+
+In write-behind mode a submitted session is appended to a local journal file
+(one JSON line, fsynced) and acknowledged right away. A background thread
+writes the pending sessions to the database in batches, once `max_batch` are
+waiting or every `interval` seconds, and keeps them pending (retrying) while
+the database is unavailable.
+
+The store records the sequence number of the last entry it wrote for each
+journal in the same transaction as the sessions, so entries are written
+exactly once: when a process dies, the next one to start replays the entries
+of its journal past that checkpoint. Every process has a journal of its own,
+held with an exclusive flock while the process lives; a journal nobody holds
+belongs to a process that is gone.
+
+Reads that must include a user's unwritten sessions (see pending()) only see
+this process's journal, so write-behind needs a single server process: with
+more, a session logged through one worker is missing from the analytics
+another worker serves until it's flushed. from_config refuses
+WEB_CONCURRENCY above 1, and gunicorn.conf.py starts one worker by default
+when write-behind is on. Likewise, run one instance of the app, since every
+machine has journals of its own.
+
+The store is any object with:
+
+    last_seq(journal)          sequence number already written (0 if none)
+    write(journal, entries)    writes [(seq, row), ...] and the checkpoint
+    forget(journal)            drops the checkpoint of a removed journal
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".journal"
+
+
+class SessionJournal:
+    def __init__(self, directory, store, max_batch=100, interval=1.0, fsync=True):
+        self.directory = directory
+        self.max_batch = max_batch
+        self.interval = interval
+        self._store = store
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+        self._file = None
+        self._seq = 0
+        self._pending = []
+        self._thread = None
+        self._stopping = False
+        self.name = None
+
+    @classmethod
+    def from_config(cls, config, store):
+        """
+        SESSION_JOURNAL_DIR (default "journal"), SESSION_FLUSH_BATCH,
+        SESSION_FLUSH_INTERVAL (seconds) and SESSION_JOURNAL_FSYNC. Raises
+        ValueError when WEB_CONCURRENCY asks for more than one worker process.
+        """
+        workers = int(config.get("WEB_CONCURRENCY", 1))
+        if workers > 1:
+            raise ValueError(
+                f"Write-behind needs a single worker process, not {workers}: "
+                "set WEB_CONCURRENCY=1 or turn off SESSION_WRITE_BEHIND."
+            )
+        return cls(
+            config.get("SESSION_JOURNAL_DIR", "journal"),
+            store,
+            max_batch=int(config.get("SESSION_FLUSH_BATCH", 100)),
+            interval=float(config.get("SESSION_FLUSH_INTERVAL", 1.0)),
+            fsync=str(config.get("SESSION_JOURNAL_FSYNC", "true")).lower()
+            not in ("0", "false", "no"),
+        )
+
+    def _open(self):
+        # A forked process (e.g. a gunicorn worker) starts a journal of its
+        # own. The file gets its final name only once it is locked, so a
+        # replaying process never mistakes it for an abandoned one.
+        os.makedirs(self.directory, exist_ok=True)
+        self.name = f"sessions-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+        path = os.path.join(self.directory, self.name)
+        stream = open(path + ".tmp", "ab")  # pylint: disable=consider-using-with
+        fcntl.flock(stream, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(path + ".tmp", path + SUFFIX)
+        self._file = stream
+        self._pid = os.getpid()
+        self._seq = 0
+        self._pending = []
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="session-journal", daemon=True
+        )
+        self._thread.start()
+
+    def start(self):
+        """
+        Opens this process's journal and starts flushing (and replaying
+        abandoned journals); append() does it too. Cheap once started.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+
+    def append(self, row):
+        """
+        Durably records a session (a dict of Sessions column values) and
+        returns without touching the database
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._open()
+            self._seq += 1
+            data = json.dumps({"seq": self._seq, "row": row}) + "\n"
+            self._file.write(data.encode("utf-8"))
+            self._file.flush()
+            if self._fsync:
+                os.fsync(self._file.fileno())
+            self._pending.append((self._seq, row))
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+
+    def pending(self, user_id=None):
+        """
+        Rows not written to the database yet, optionally only one user's.
+        Only this process's: see the module docstring.
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                return []
+            return [
+                row
+                for _, row in self._pending
+                if user_id is None or row["user_id"] == user_id
+            ]
+
+    def flush(self):
+        """
+        Writes the pending rows in batches of max_batch and returns how many
+        were written. Rows stay pending when the store raises.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if self._pid != os.getpid():
+                        return written
+                    batch = self._pending[: self.max_batch]
+                if not batch:
+                    return written
+                self._store.write(self.name, batch)
+                with self._lock:
+                    del self._pending[: len(batch)]
+                    if not self._pending:
+                        # everything in the file is behind the checkpoint
+                        self._file.truncate(0)
+                written += len(batch)
+
+    def replay(self):
+        """
+        Writes the unwritten entries of journals left by processes that are
+        gone, then removes those journals. Returns the number of rows written.
+        """
+        written = 0
+        for path in glob.glob(os.path.join(self.directory, "*" + SUFFIX)):
+            name = os.path.basename(path)[: -len(SUFFIX)]
+            if name == self.name:
+                continue
+            try:
+                stream = open(path, "rb")  # pylint: disable=consider-using-with
+            except FileNotFoundError:
+                continue  # replayed by another process meanwhile
+            with stream:
+                try:
+                    fcntl.flock(stream, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # its process is alive
+                if not os.path.exists(path):
+                    continue
+                last_seq = self._store.last_seq(name)
+                entries = [
+                    entry for entry in read_entries(stream) if entry[0] > last_seq
+                ]
+                for start in range(0, len(entries), self.max_batch):
+                    self._store.write(name, entries[start : start + self.max_batch])
+                written += len(entries)
+                # remove the file before its checkpoint: the other way round,
+                # a crash in between would replay it from the start
+                os.remove(path)
+                self._store.forget(name)
+                logger.info(
+                    "replayed session journal",
+                    extra={"journal": name, "sessions": len(entries)},
+                )
+        return written
+
+    def _run(self):
+        replayed = False
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                if not replayed:
+                    self.replay()
+                    replayed = True
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning(
+                    "session journal flush failed, retrying",
+                    exc_info=True,
+                    extra={"pending": len(self._pending)},
+                )
+
+    def stop(self):
+        """
+        Stops the flushing thread after a last flush. The journal file is
+        removed when everything reached the database and kept for replay
+        otherwise.
+        """
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("session journal kept for replay", exc_info=True)
+        with self._lock:
+            path = os.path.join(self.directory, self.name + SUFFIX)
+            if not self._pending:
+                os.remove(path)
+                try:
+                    self._store.forget(self.name)
+                except Exception:  # pylint: disable=broad-except
+                    # a stale checkpoint of a removed journal is harmless
+                    logger.warning("session journal checkpoint kept", exc_info=True)
+            self._file.close()
+            self._pid = None
+
+
+def read_entries(stream):
+    """
+    (seq, row) of every complete entry of a journal file. A torn last line
+    (the process died while appending) was never acknowledged and is skipped.
+    """
+    entries = []
+    for line in stream:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            logger.warning("skipping unreadable session journal entry")
+            continue
+        entries.append((entry["seq"], entry["row"]))
+    return entries
@@ -0,0 +1,105 @@
+"""
+User-keyed sharding.
+
+The user-owned tables (instruments, strings, sessions and everything derived
+from them) can be spread over several databases. Shard 0 is the main
+database, which also keeps the tables shared by all users (users, the shard
+lookup table, lifespan statistics); shards 1..N-1 are the URIs listed in
+SHARD_DATABASE_URLS. Each user lives on exactly one shard, recorded in the
+lookup table, so a user can be moved to another shard by updating one row.
+
+The router caches placements per process for SHARD_CACHE_TTL seconds; a
+move waits that long between its steps so every process sees each of them.
+"""
+import time
+from collections import namedtuple
+
+from ttl_cache import TTLCache
+
+# where a user's rows live; moving is set while they are copied to another
+# shard, and resync_after is the data version a change-feed client must
+# have synced past (the first version written on the new shard)
+Placement = namedtuple("Placement", ["shard", "moving", "resync_after"])
+
+DEFAULT_PLACEMENT = Placement(0, False, None)
+
+
+class ShardMoving(Exception):
+    """
+    Raised for a write to a user whose data is being moved between shards
+    """
+
+
+class NoShardSelected(RuntimeError):
+    """
+    Raised for a query on a sharded table outside a logged in request or an
+    explicit on_shard()/for_user() block
+    """
+
+
+def shard_urls(config):
+    """
+    URIs of shards 1..N-1 from SHARD_DATABASE_URLS (comma or whitespace
+    separated)
+    """
+    return str(config.get("SHARD_DATABASE_URLS") or "").replace(",", " ").split()
+
+
+def bind_key(shard):
+    """
+    Flask-SQLAlchemy bind of a shard (None is the main database)
+    """
+    return None if shard == 0 else f"shard{shard}"
+
+
+class ShardRouter:
+    """
+    Maps user ids to Placements, calling `load(user_id)` (returning a
+    Placement, or None for users without a lookup row, who live on shard 0)
+    on a cache miss
+    """
+
+    def __init__(self, count, load, ttl=5, maxsize=100000, clock=time.monotonic):
+        self.count = count
+        self.ttl = ttl
+        self._load = load
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, clock=clock)
+
+    @classmethod
+    def from_config(cls, config, load):
+        """
+        SHARD_DATABASE_URLS and SHARD_CACHE_TTL (seconds, default 5)
+        """
+        return cls(
+            1 + len(shard_urls(config)),
+            load,
+            ttl=float(config.get("SHARD_CACHE_TTL", 5)),
+        )
+
+    @property
+    def sharded(self):
+        return self.count > 1
+
+    def placement(self, user_id):
+        if not self.sharded:
+            return DEFAULT_PLACEMENT
+        placement = self._cache.get(user_id)
+        if placement is None:
+            placement = self._load(user_id) or DEFAULT_PLACEMENT
+            self._cache.set(user_id, placement)
+        return placement
+
+    def shard_for(self, user_id):
+        return self.placement(user_id).shard
+
+    def new_user_shard(self, user_id):
+        """
+        Shard for a user signing up: spread evenly, by id
+        """
+        return user_id % self.count
+
+    def invalidate(self, user_id):
+        self._cache.pop(user_id)
+
+    def clear(self):
+        self._cache.clear()
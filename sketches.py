@@ -0,0 +1,330 @@
+"""
+Mergeable streaming sketches, for statistics over every user's data.
+
+Each sketch summarises a stream in a bounded amount of space and can be
+merged with another sketch of the same shape, so every process folds the
+writes it serves into small deltas (SketchBuffer) that are merged into the
+stored sketches now and then.
+
+    CountMinSketch  estimated count per key, and the most common keys.
+                    Never under-estimates; over-estimates by at most
+                    e / width * total with probability 1 - e ** -depth.
+    HyperLogLog     distinct count, with a standard error of
+                    1.04 / sqrt(2 ** p).
+    QuantileSketch  quantiles (a DDSketch: log-spaced buckets) within a
+                    relative error of `alpha` of a true value.
+
+Keys are hashed with BLAKE2b, so sketches built by different processes line
+up.
+"""
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key, size):
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=size).digest()
+    return int.from_bytes(digest, "big")
+
+
+class CountMinSketch:
+    kind = "cms"
+
+    def __init__(self, width=2048, depth=4, top=20, counts=None, total=0, heavy=None):
+        self.width = width
+        self.depth = depth
+        self.top = top
+        self.counts = counts or [[0] * width for _ in range(depth)]
+        self.total = total
+        # the `top` keys with the largest estimates seen so far
+        self.heavy = heavy or {}
+
+    def _cells(self, key):
+        value = _hash(key, 16)
+        first, second = value >> 64, (value & (2**64 - 1)) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        cells = self._cells(key)
+        for row, cell in enumerate(cells):
+            self.counts[row][cell] += count
+        self.total += count
+        self._track(key, min(self.counts[row][cell] for row, cell in enumerate(cells)))
+
+    def _track(self, key, estimate):
+        if key in self.heavy or len(self.heavy) < self.top:
+            self.heavy[key] = estimate
+            return
+        smallest = min(self.heavy, key=self.heavy.get)
+        if estimate > self.heavy[smallest]:
+            del self.heavy[smallest]
+            self.heavy[key] = estimate
+
+    def estimate(self, key):
+        return min(
+            self.counts[row][cell] for row, cell in enumerate(self._cells(key))
+        )
+
+    def most_common(self, n=None):
+        """
+        (key, estimated count) of the most common keys, largest first
+        """
+        return sorted(self.heavy.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    @property
+    def error_bound(self):
+        """
+        Over-estimate of any count that holds with probability 1 - e ** -depth
+        """
+        return math.e / self.width * self.total
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Count-min sketches of different shapes.")
+        for row, other_row in zip(self.counts, other.counts):
+            for cell, count in enumerate(other_row):
+                if count:
+                    row[cell] += count
+        self.total += other.total
+        estimates = {key: self.estimate(key) for key in {*self.heavy, *other.heavy}}
+        self.heavy = dict(
+            sorted(estimates.items(), key=lambda item: -item[1])[: self.top]
+        )
+        return self
+
+    def state(self):
+        return {
+            "width": self.width,
+            "depth": self.depth,
+            "top": self.top,
+            "counts": self.counts,
+            "total": self.total,
+            "heavy": self.heavy,
+        }
+
+
+class HyperLogLog:
+    kind = "hll"
+
+    def __init__(self, p=12, registers=None):
+        self.p = p
+        self.registers = bytearray(registers or bytes(1 << p))
+
+    def add(self, key):
+        value = _hash(key, 8)
+        index = value >> (64 - self.p)
+        rest = value & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        size = len(self.registers)
+        estimate = (
+            0.7213
+            / (1 + 1.079 / size)
+            * size
+            * size
+            / sum(2.0**-rank for rank in self.registers)
+        )
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * size and zeros:
+            # linear counting is more accurate for small counts
+            estimate = size * math.log(size / zeros)
+        return estimate
+
+    @property
+    def standard_error(self):
+        """
+        Relative standard error of count()
+        """
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def merge(self, other):
+        if self.p != other.p:
+            raise ValueError("HyperLogLogs of different precisions.")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def state(self):
+        return {"p": self.p, "registers": base64.b64encode(self.registers).decode()}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state["p"], base64.b64decode(state["registers"]))
+
+
+class QuantileSketch:
+    kind = "quantiles"
+
+    def __init__(self, alpha=0.01, bins=None, zeros=0, count=0):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        # bucket i counts the values in (gamma ** (i - 1), gamma ** i]
+        self.bins = {int(key): value for key, value in (bins or {}).items()}
+        self.zeros = zeros
+        self.count = count
+
+    def add(self, value):
+        if value <= 0:
+            self.zeros += 1
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + 1
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimated q-quantile (0 <= q <= 1), None when empty
+        """
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma**key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def merge(self, other):
+        if self.alpha != other.alpha:
+            raise ValueError("Quantile sketches of different accuracies.")
+        for key, value in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + value
+        self.zeros += other.zeros
+        self.count += other.count
+        return self
+
+    def state(self):
+        return {
+            "alpha": self.alpha,
+            "bins": self.bins,
+            "zeros": self.zeros,
+            "count": self.count,
+        }
+
+
+KINDS = {kind.kind: kind for kind in (CountMinSketch, HyperLogLog, QuantileSketch)}
+
+
+def dumps(sketch):
+    return zlib.compress(
+        json.dumps({"kind": sketch.kind, **sketch.state()}).encode("utf-8")
+    )
+
+
+def loads(data):
+    state = json.loads(zlib.decompress(data))
+    kind = KINDS[state.pop("kind")]
+    if hasattr(kind, "from_state"):
+        return kind.from_state(state)
+    return kind(**state)
+
+
+class SketchBuffer:
+    """
+    Per-process deltas of named sketches. A background thread merges them
+    into the store every `interval` seconds; deltas stay pending (and keep
+    folding new values) while the store raises.
+
+    The store is any object with `merge(name, sketch)`.
+    """
+
+    def __init__(self, store, interval=60.0):
+        self.interval = interval
+        self._store = store
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._deltas = {}
+        self._pid = None
+        self._thread = None
+        self._stopping = False
+
+    def _start(self):
+        # a forked process (e.g. a gunicorn worker) starts from empty deltas
+        self._deltas = {}
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="sketch-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def add(self, name, factory, *args):
+        """
+        Folds a value into the delta of sketch `name`, created with
+        `factory()` if this process has none: sketch.add(*args)
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                self._start()
+            sketch = self._deltas.get(name)
+            if sketch is None:
+                sketch = self._deltas[name] = factory()
+            sketch.add(*args)
+
+    def pending(self):
+        with self._lock:
+            return len(self._deltas) if self._pid == os.getpid() else 0
+
+    def flush(self):
+        """
+        Merges every delta into the store and returns how many were merged
+        """
+        merged = 0
+        with self._flush_lock:
+            with self._lock:
+                if self._pid != os.getpid():
+                    return 0
+                deltas, self._deltas = self._deltas, {}
+            for name in list(deltas):
+                try:
+                    self._store.merge(name, deltas[name])
+                except Exception:
+                    with self._lock:
+                        # keep this and the remaining deltas for next time
+                        for key, value in deltas.items():
+                            if key in self._deltas:
+                                value.merge(self._deltas[key])
+                            self._deltas[key] = value
+                    raise
+                del deltas[name]
+                merged += 1
+            return merged
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            if self._stopping:
+                break
+            try:
+                self.flush()
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("community stats flush failed, retrying", exc_info=True)
+
+    def stop(self):
+        """
+        Stops the flushing thread after a last flush
+        """
+        if self._pid != os.getpid():
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception:  # pylint: disable=broad-except
+            logger.warning("community stats deltas lost", exc_info=True)
+        self._pid = None
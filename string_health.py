@@ -0,0 +1,49 @@
+"""
+Vectorized string-health engine.
+
+Works on NumPy arrays with one entry per string, so the same code scores a
+single string for a page view or every string of every user in a batch job.
+Health tiers match the colour coding on the analytics page. NumPy is
+imported on first use, keeping it out of the app's import time.
+"""
+
+HEALTHY = 3  # green: more than 30% of the expected lifespan left
+WORN = 2  # yellow: more than 10% left
+DUE = 1  # red: due for restringing
+
+HEALTHY_LIFE_LEFT = 0.3
+WORN_LIFE_LEFT = 0.10
+
+
+def compute_health(playtime_mins, avg_lifespan_hrs, cost):
+    """
+    Returns a dict of arrays: playtime_hrs, string_life (fraction of the
+    expected lifespan left), health_tier and cost_per_hr (0 until played)
+    """
+    import numpy as np  # pylint: disable=import-outside-toplevel
+
+    playtime_hrs = np.asarray(playtime_mins, dtype=np.float64) / 60.0
+    avg_lifespan_hrs = np.asarray(avg_lifespan_hrs, dtype=np.float64)
+    cost = np.asarray(cost, dtype=np.float64)
+
+    string_life = 1.0 - playtime_hrs / avg_lifespan_hrs
+    health_tier = np.full(playtime_hrs.shape, DUE, dtype=np.int8)
+    health_tier[string_life > WORN_LIFE_LEFT] = WORN
+    health_tier[string_life > HEALTHY_LIFE_LEFT] = HEALTHY
+
+    cost_per_hr = np.zeros_like(playtime_hrs)
+    np.divide(cost, playtime_hrs, out=cost_per_hr, where=playtime_hrs > 0)
+    return {
+        "playtime_hrs": playtime_hrs,
+        "string_life": string_life,
+        "health_tier": health_tier,
+        "cost_per_hr": cost_per_hr,
+    }
+
+
+def compute_one(playtime_mins, avg_lifespan_hrs, cost):
+    """
+    compute_health for a single string, returning plain Python numbers
+    """
+    result = compute_health([playtime_mins], [avg_lifespan_hrs], [cost])
+    return {key: values[0].item() for key, values in result.items()}
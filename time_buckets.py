@@ -0,0 +1,60 @@
+"""
+Bucket arithmetic for the practice-session rollups.
+
+Timestamps are epoch seconds and buckets are UTC days and ISO weeks
+(starting Monday), each identified by the epoch second it starts at.
+"""
+import time
+
+DAY = 86400
+WEEK = 7 * DAY
+# 1970-01-01 was a Thursday, three days after the Monday that starts its week
+WEEK_OFFSET = 3 * DAY
+
+PERIODS = ("day", "week")
+
+
+def day_start(timestamp):
+    return timestamp - timestamp % DAY
+
+
+def week_start(timestamp):
+    return timestamp - (timestamp + WEEK_OFFSET) % WEEK
+
+
+def bucket_start(period, timestamp):
+    return day_start(timestamp) if period == "day" else week_start(timestamp)
+
+
+def buckets_for(timestamp):
+    """
+    (period, bucket_start) of every rollup a session at `timestamp` counts in
+    """
+    return [(period, bucket_start(period, timestamp)) for period in PERIODS]
+
+
+def split_range(start, end):
+    """
+    Covers the days overlapping [start, end) with as few buckets as possible:
+    whole weeks in the middle and single days at the edges. Returns a list of
+    (period, first_bucket, last_bucket_exclusive) ranges.
+    """
+    first_day = day_start(start)
+    end_day = day_start(end - 1) + DAY if end > start else first_day
+    first_week = week_start(first_day)
+    if first_week < first_day:
+        first_week += WEEK
+    end_week = week_start(end_day)
+    if first_week >= end_week:
+        return [("day", first_day, end_day)] if first_day < end_day else []
+    ranges = []
+    if first_day < first_week:
+        ranges.append(("day", first_day, first_week))
+    ranges.append(("week", first_week, end_week))
+    if end_week < end_day:
+        ranges.append(("day", end_week, end_day))
+    return ranges
+
+
+def now():
+    return int(time.time())
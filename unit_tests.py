@@ -1,16 +1,122 @@
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import queue
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from flask_login import login_user
+
+from app_logging import (
+    REDACTED,
+    DroppingQueueHandler,
+    JsonFormatter,
+    RedactingFilter,
+    SamplingFilter,
+    redact,
+)
+import assets
+from db_pool import engine_options
+from email_validation import (
+    EmailBackendUnavailable,
+    EmailValidator,
+    OfflineEmailBackend,
+    RemoteEmailBackend,
+)
+from metrics import REGISTRY, Registry, timed
+from password_hashing import PasswordHasher, PoolSaturated, pool_context
+from password_policy import PasswordPolicy
+from replicas import Heartbeat, ReplicaSet
+from running_stats import RunningStats
+from session_import import import_sessions, parse_timestamp
+from session_journal import SessionJournal
+import sketches
+from sketches import CountMinSketch, HyperLogLog, QuantileSketch, SketchBuffer
+from sharding import NoShardSelected, Placement, ShardRouter, shard_urls
+import string_health
+import time_buckets
+from user_cache import UserCache, UserSnapshot
+from helpers import getCompoundName, validate_new_instr_form
+import app as app_module
 from app import (
+    create_app,
+    db,
+    CommunitySketch,
+    IdempotencyKey,
+    JournalCheckpoint,
+    JournalStore,
+    ReplicaHeartbeat,
+    ShardAssignment,
     User,
     Instruments,
+    Sessions,
+    Strings,
+    StringTotals,
+    StringHealth,
+    UserDataVersion,
+    for_user,
+    get_data_version,
+    load_user,
+    get_string_health,
+    get_strings_due,
+    add_to_string_totals,
+    get_current_context,
+    list_instruments,
+    list_strings,
+    reset_current_context,
+    run_session_import,
+    SessionRollups,
+    minutes_played,
+    playtime_series,
+    record_session_aggregates,
+    Stringlifespans,
+    StringLifespan,
+    StringLifespanStats,
+    get_average_lifespan,
+    record_string_lifespan,
     user_login_success,
     get_user_by_email,
     get_user_by_username,
-    getCompoundName,
-    validate_new_instr_form,
     does_contains_special_char,
+    password_meet_requirements,
 )
 
+# The tearDowns delete every row, so the suite must never reach a real
+# database: skip .env (which points DATABASE_URL1 at Heroku) and pin the app
+# to a throwaway SQLite file.
+os.environ["FLASK_SKIP_DOTENV"] = "1"
+TEST_DB_DIR = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+TEST_CONFIG = {
+    "SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(TEST_DB_DIR.name, "test.db"),
+    "SHARD_DATABASE_URLS": "",
+    "REPLICA_DATABASE_URLS": "",
+    "LOG_LEVEL": "WARNING",
+}
+app = create_app(TEST_CONFIG)
+
+
+def restore_services():
+    """
+    Points the process-wide services back at `app` after a test built them
+    for an app of its own
+    """
+    settings = {**os.environ, **app.config}
+    app_module.init_services(settings)
+    app_module.init_community_stats(app, settings)
+    app_module.init_replica_heartbeat(app, settings)
+
 
 class UnitTests(unittest.TestCase):
     def setUp(self):
@@ -77,5 +183,1947 @@ class UnitTests(unittest.TestCase):
         self.assertFalse(is_valid)
 
 
+class StringTotalsTests(unittest.TestCase):
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.rollback()
+        StringTotals.query.delete()
+        Sessions.query.delete()
+        db.session.commit()
+        self.ctx.pop()
+
+    def test_add_to_string_totals_accumulates(self):
+        add_to_string_totals(7, 30, 20)
+        db.session.commit()
+        add_to_string_totals(7, 45, 10)
+        add_to_string_totals(7, 15, 30)
+        db.session.commit()
+        totals = StringTotals.query.get(7)
+        self.assertEqual(totals.total_playtime_mins, 90)
+        self.assertEqual(totals.session_count, 3)
+        self.assertEqual(totals.first_session_date, 10)
+        self.assertEqual(totals.last_session_date, 30)
+
+    def test_rebuild_string_totals_matches_sessions(self):
+        for mins, date in [(20, 5), (40, 9)]:
+            db.session.add(
+                Sessions(
+                    user_id=1, instr_id=1, string_id=3, playtime_mins=mins, date=date
+                )
+            )
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=["rebuild-string-totals"])
+        self.assertEqual(result.exit_code, 0)
+        totals = StringTotals.query.get(3)
+        self.assertEqual(totals.total_playtime_mins, 60)
+        self.assertEqual(totals.session_count, 2)
+        self.assertEqual((totals.first_session_date, totals.last_session_date), (5, 9))
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Creates a user with one instrument in the test database
+    """
+
+    def setUp(self):
+        app.secret_key = "unit-tests"
+        # user ids are reused between tests
+        app_module.user_cache.clear()
+        self.ctx = app.app_context()
+        self.ctx.push()
+        db.create_all()
+        self.user = User(email="ctx@test.com", username="ctx", password="Secret1!")
+        db.session.add(self.user)
+        db.session.commit()
+        self.instr = Instruments(
+            compound_name="Strat - guitar",
+            user_id=self.user.id,
+            instr_name="Strat",
+            instr_type="guitar",
+        )
+        db.session.add(self.instr)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        for model in (StringHealth, Strings, Instruments, User):
+            model.query.delete()
+        db.session.commit()
+        self.ctx.pop()
+
+
+class CurrentContextTests(DatabaseTestCase):
+    def test_context_without_current_instrument_is_empty(self):
+        with app.test_request_context():
+            login_user(self.user)
+            context = get_current_context()
+        self.assertEqual(context.instr_name, "")
+        self.assertIsNone(context.str_id)
+
+    def test_context_joins_instrument_and_latest_string(self):
+        db.session.add(
+            Strings(instr_id=self.instr.instr_id, str_name="EXL110", str_cost=8)
+        )
+        db.session.add(
+            Strings(instr_id=self.instr.instr_id, str_name="EXL115", str_cost=9)
+        )
+        self.user.current_instr_id = self.instr.instr_id
+        db.session.commit()
+        with app.test_request_context():
+            login_user(self.user)
+            context = get_current_context()
+            self.assertIs(get_current_context(), context)
+            reset_current_context()
+            self.assertIsNot(get_current_context(), context)
+        self.assertEqual(context.instr_name, "Strat")
+        # the set fitted last is the current one
+        self.assertEqual((context.str_name, context.str_cost), ("EXL115", 9))
+
+    def test_context_for_instrument_without_strings(self):
+        self.user.current_instr_id = self.instr.instr_id
+        db.session.commit()
+        with app.test_request_context():
+            login_user(self.user)
+            context = get_current_context()
+        self.assertEqual(context.instr_name, "Strat")
+        self.assertEqual(
+            (context.str_id, context.str_name, context.str_cost), (None, "", 0)
+        )
+
+
+class SessionImportTests(unittest.TestCase):
+    lookup = {("Strat", "EXL110"): (1, 10)}
+
+    def run_import(self, text, fmt, batch_size=500):
+        batches = []
+        report = import_sessions(
+            io.StringIO(text), fmt, self.lookup, batches.append, batch_size=batch_size
+        )
+        return report, batches
+
+    def test_csv_rows_are_batched_and_bad_rows_reported(self):
+        text = (
+            "instrument,string,playtime_mins,date\n"
+            "Strat,EXL110,30,1\n"
+            "Strat,Unknown,30,2\n"
+            "Strat,EXL110,abc,3\n"
+            "Strat,EXL110,45,4\n"
+            "Strat,EXL110,15,5\n"
+        )
+        report, batches = self.run_import(text, "csv", batch_size=2)
+        self.assertEqual(report.imported, 3)
+        self.assertEqual([error.line for error in report.errors], [3, 4])
+        self.assertEqual([len(batch) for batch in batches], [2, 1])
+        self.assertEqual(batches[0][0]["string_id"], 10)
+
+    def test_jsonl_invalid_lines_do_not_abort(self):
+        text = (
+            '{"instrument": "Strat", "string": "EXL110", "playtime_mins": 20, "date": 1}\n'
+            "not json\n"
+            "\n"
+            '{"instrument": "Strat", "string": "EXL110", "playtime_mins": 25}\n'
+        )
+        report, batches = self.run_import(text, "jsonl")
+        self.assertEqual(report.imported, 1)
+        self.assertEqual(report.failed, 2)
+        self.assertIn("Missing date", report.errors[1].error)
+        # only the valid row was written
+        self.assertEqual(
+            [[row["playtime_mins"] for row in batch] for batch in batches], [[20]]
+        )
+
+    def test_failed_batch_is_reported_per_row(self):
+        def failing_insert(rows):
+            raise RuntimeError("db down")
+
+        text = '{"instrument": "Strat", "string": "EXL110", "playtime_mins": 5, "date": 1}\n'
+        report = import_sessions(
+            io.StringIO(text), "jsonl", self.lookup, failing_insert
+        )
+        self.assertEqual((report.imported, report.failed), (0, 1))
+
+
+class SessionImportDatabaseTests(DatabaseTestCase):
+    def test_import_inserts_sessions_and_totals(self):
+        string = Strings(instr_id=self.instr.instr_id, str_name="EXL110", str_cost=8)
+        db.session.add(string)
+        db.session.commit()
+        text = "instrument,string,playtime_mins,date\nStrat,EXL110,30,5\nStrat,EXL110,40,9\n"
+        report = run_session_import(self.user.id, io.StringIO(text), "csv")
+        self.assertEqual(report.imported, 2)
+        self.assertEqual(Sessions.query.filter_by(user_id=self.user.id).count(), 2)
+        totals = StringTotals.query.get(string.str_id)
+        self.assertEqual((totals.total_playtime_mins, totals.session_count), (70, 2))
+
+    def tearDown(self):
+        Sessions.query.delete()
+        StringTotals.query.delete()
+        super().tearDown()
+
+
+class StubEmailAPI(BaseHTTPRequestHandler):
+    """
+    Local stand-in for the isitarealemail.com API. Addresses starting with
+    "slow" sleep past the client timeout; "bad" ones are invalid.
+    """
+
+    calls = []
+
+    def do_GET(self):
+        email = parse_qs(urlparse(self.path).query)["email"][0]
+        StubEmailAPI.calls.append(email)
+        if email.startswith("slow"):
+            time.sleep(0.5)
+        status = "invalid" if email.startswith("bad") else "valid"
+        body = json.dumps({"status": status}).encode()
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client already gave up waiting
+
+    def log_message(self, *args):
+        pass
+
+
+class EmailValidationTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = HTTPServer(("127.0.0.1", 0), StubEmailAPI)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/api/email/validate"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StubEmailAPI.calls = []
+
+    def make_validator(self, **kwargs):
+        remote = RemoteEmailBackend(url=self.url, timeout=0.2)
+        return EmailValidator(remote=remote, **kwargs)
+
+    def test_remote_verdicts_are_cached(self):
+        validator = self.make_validator()
+        self.assertEqual(validator.validate("player@example.com"), "valid")
+        self.assertEqual(validator.validate("Player@Example.com "), "valid")
+        self.assertEqual(validator.validate("bad@example.com"), "invalid")
+        self.assertEqual(StubEmailAPI.calls, ["player@example.com", "bad@example.com"])
+
+    def test_offline_checks_skip_the_remote(self):
+        validator = self.make_validator()
+        self.assertEqual(validator.validate("not-an-email"), "invalid")
+        self.assertEqual(validator.validate("a@mailinator.com"), "invalid")
+        self.assertEqual(validator.validate("b@mailinator.com"), "invalid")
+        self.assertEqual(StubEmailAPI.calls, [])
+
+    def test_slow_remote_uses_fallback_policy(self):
+        validator = self.make_validator(fallback="reject", breaker_threshold=1)
+        self.assertEqual(validator.validate("slow@example.com"), "invalid")
+        # breaker is open, so the next address isn't even sent upstream
+        self.assertEqual(validator.validate("other@example.com"), "invalid")
+        self.assertEqual(StubEmailAPI.calls, ["slow@example.com"])
+
+        validator = self.make_validator(fallback="offline")
+        self.assertEqual(validator.validate("slow@example.com"), "valid")
+
+    def test_offline_backend(self):
+        backend = OfflineEmailBackend(disposable_domains=["throwaway.test"])
+        self.assertEqual(backend.validate("me@band.example.org"), "valid")
+        self.assertEqual(backend.validate("me@mail.throwaway.test"), "invalid")
+        self.assertEqual(backend.validate("me@@example.com"), "invalid")
+
+
+class PasswordHashingTests(unittest.TestCase):
+    def test_pool_hashes_and_verifies(self):
+        hasher = PasswordHasher(method="pbkdf2:sha256:1000", workers=1)
+        try:
+            pwhash = hasher.hash("Secret1!")
+            self.assertTrue(pwhash.startswith("pbkdf2:sha256:1000$"))
+            self.assertTrue(hasher.verify(pwhash, "Secret1!"))
+            self.assertFalse(hasher.verify(pwhash, "secret1!"))
+        finally:
+            hasher.shutdown()
+
+    def test_pool_processes_are_not_forked_from_request_threads(self):
+        self.assertIn(pool_context().get_start_method(), ("forkserver", "spawn"))
+
+    def test_saturated_pool_sheds_load(self):
+        hasher = PasswordHasher(workers=1, max_pending=0)
+        with self.assertRaises(PoolSaturated):
+            hasher.hash("Secret1!")
+
+    def test_saturated_pool_returns_503(self):
+        saturated = PasswordHasher(workers=1, max_pending=0)
+        with patch("app.password_hasher", saturated), patch(
+            "app.email_validator", return_value="valid"
+        ):
+            response = app.test_client().post(
+                "/signup",
+                data={"email": "x@test.com", "username": "x", "password": "Secret1!"},
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers["Retry-After"], "1")
+
+    def test_hash_upgraded_when_parameters_change(self):
+        old = PasswordHasher(method="pbkdf2:sha256:1000", workers=0)
+        new = PasswordHasher(method="pbkdf2:sha256:2000", workers=0)
+        with patch("app.password_hasher", old):
+            user = User(email="u@test.com", username="u", password="Secret1!")
+            self.assertFalse(user.upgrade_password_hash("Secret1!"))
+        with patch("app.password_hasher", new):
+            self.assertTrue(user.verify_password("Secret1!"))
+            self.assertTrue(user.upgrade_password_hash("Secret1!"))
+            self.assertTrue(user.password.startswith("pbkdf2:sha256:2000$"))
+            self.assertTrue(user.verify_password("Secret1!"))
+
+
+class PasswordPolicyTests(unittest.TestCase):
+    def test_reports_every_failed_rule(self):
+        result = PasswordPolicy().check("abc")
+        self.assertFalse(result.passed)
+        self.assertEqual(
+            result.failed_rules, ["min_length", "special_char", "number", "mixed_case"]
+        )
+
+    def test_strong_password_passes(self):
+        self.assertTrue(PasswordPolicy().check("Str1ngs!Rock").passed)
+        self.assertTrue(password_meet_requirements("Str1ngs!Rock"))
+        self.assertFalse(password_meet_requirements("str1ngs!rock"))
+
+    def test_rules_are_configurable(self):
+        policy = PasswordPolicy(min_length=4, require_special=False, special_chars="")
+        self.assertTrue(policy.check("Ab12").passed)
+        self.assertEqual(policy.check("ab12").failed_rules, ["mixed_case"])
+
+    def test_non_ascii_letters_count_towards_mixed_case(self):
+        self.assertTrue(PasswordPolicy().check("élan!Ü12").passed)
+
+    def test_check_many(self):
+        results = dict(
+            PasswordPolicy().check_many([("ana", "Str1ngs!"), ("bo", "x")], keyed=True)
+        )
+        self.assertTrue(results["ana"].passed)
+        self.assertIn("min_length", results["bo"].failed_rules)
+        plain = list(PasswordPolicy().check_many(["Str1ngs!", "x"]))
+        self.assertEqual([result.passed for result in plain], [True, False])
+
+
+class TimeBucketTests(unittest.TestCase):
+    def test_week_starts_on_monday(self):
+        monday = 1638748800  # 2021-12-06 00:00 UTC
+        self.assertEqual(time_buckets.week_start(monday + 3 * 86400 + 5), monday)
+        self.assertEqual(time_buckets.week_start(monday), monday)
+        self.assertEqual(time_buckets.week_start(monday - 1), monday - 7 * 86400)
+
+    def test_split_range_covers_each_day_once(self):
+        start = 1638748800 - 2 * 86400 + 100
+        for length_days in (0, 1, 5, 9, 30, 400):
+            end = start + length_days * 86400 + 50
+            covered = []
+            for period, first, last in time_buckets.split_range(start, end):
+                step = 86400 if period == "day" else 7 * 86400
+                for bucket in range(first, last, step):
+                    covered.extend(range(bucket, bucket + step, 86400))
+            expected = list(
+                range(
+                    time_buckets.day_start(start),
+                    time_buckets.day_start(end - 1) + 1,
+                    86400,
+                )
+            )
+            self.assertEqual(covered, expected)
+
+    def test_parse_timestamp(self):
+        self.assertEqual(parse_timestamp("1638748800"), 1638748800)
+        self.assertEqual(parse_timestamp("2021-12-06"), 1638748800)
+        self.assertEqual(parse_timestamp("2021-12-06T01:00:00+01:00"), 1638748800)
+
+
+class SessionRollupTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.string = Strings(
+            instr_id=self.instr.instr_id, str_name="EXL110", str_cost=8
+        )
+        db.session.add(self.string)
+        db.session.commit()
+        day = 86400
+        base = 1638748800
+        self.rows = [
+            {
+                "user_id": self.user.id,
+                "instr_id": self.instr.instr_id,
+                "string_id": self.string.str_id,
+                "playtime_mins": mins,
+                "date": base + offset * day + 3600,
+            }
+            for mins, offset in [(10, 0), (20, 1), (30, 8), (40, 20), (50, 21)]
+        ]
+        for row in self.rows:
+            db.session.add(Sessions(**row))
+        record_session_aggregates(self.rows)
+        db.session.commit()
+
+    def tearDown(self):
+        for model in (SessionRollups, StringTotals, Sessions):
+            model.query.delete()
+        db.session.commit()
+        super().tearDown()
+
+    def raw_minutes(self, start, end):
+        return sum(
+            row["playtime_mins"]
+            for row in self.rows
+            if time_buckets.day_start(start)
+            <= row["date"]
+            < time_buckets.day_start(end - 1) + 86400
+        )
+
+    def test_minutes_played_matches_raw_sessions(self):
+        base = 1638748800
+        for start_day, end_day in [(0, 1), (0, 2), (1, 9), (0, 22), (2, 20)]:
+            start, end = base + start_day * 86400, base + end_day * 86400
+            self.assertEqual(
+                minutes_played(self.string.str_id, start, end),
+                self.raw_minutes(start, end),
+            )
+
+    def test_playtime_series_by_week(self):
+        base = 1638748800
+        series = playtime_series(self.string.str_id, base, base + 28 * 86400, "week")
+        self.assertEqual([mins for _, mins in series], [30, 30, 40, 50])
+
+    def test_rebuild_rollups_matches_incremental(self):
+        before = sorted(
+            (r.period, r.bucket_start, r.total_playtime_mins, r.session_count)
+            for r in SessionRollups.query.all()
+        )
+        result = app.test_cli_runner().invoke(args=["rebuild-rollups"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        after = sorted(
+            (r.period, r.bucket_start, r.total_playtime_mins, r.session_count)
+            for r in SessionRollups.query.all()
+        )
+        self.assertEqual(before, after)
+
+    def test_migrate_legacy_dates(self):
+        Sessions.query.update({Sessions.date: 12022021})
+        db.session.commit()
+        result = app.test_cli_runner().invoke(args=["migrate-session-dates"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        dates = {date for (date,) in db.session.query(Sessions.date)}
+        self.assertEqual(dates, {1638403200})  # 2021-12-02 00:00 UTC
+        self.assertEqual(SessionRollups.query.filter_by(period="day").count(), 1)
+
+
+class RunningStatsTests(unittest.TestCase):
+    values = [80.0, 95.5, 120.0, 60.0, 101.0, 99.0]
+
+    def test_push_matches_statistics_module(self):
+        stats = RunningStats()
+        for value in self.values:
+            stats.push(value)
+        self.assertAlmostEqual(stats.mean, statistics.mean(self.values))
+        self.assertAlmostEqual(stats.variance, statistics.variance(self.values))
+
+    def test_merge_matches_single_pass(self):
+        left, right = RunningStats(), RunningStats()
+        for value in self.values[:2]:
+            left.push(value)
+        for value in self.values[2:]:
+            right.push(value)
+        left.merge(right)
+        self.assertEqual(left.count, len(self.values))
+        self.assertAlmostEqual(left.variance, statistics.variance(self.values))
+
+
+class StringLifespanTests(DatabaseTestCase):
+    def tearDown(self):
+        for model in (StringLifespan, StringLifespanStats, Stringlifespans):
+            model.query.delete()
+        db.session.commit()
+        super().tearDown()
+
+    def test_recorded_lifespans_update_running_stats(self):
+        values = [80.0, 100.0, 120.0, 90.0]
+        for value in values:
+            record_string_lifespan(self.user.id, "EXL110", value)
+            db.session.commit()
+        stats = StringLifespanStats.query.get("EXL110")
+        self.assertEqual(stats.count, 4)
+        self.assertAlmostEqual(stats.mean_hrs, statistics.mean(values))
+        self.assertAlmostEqual(stats.m2 / 3, statistics.variance(values))
+        self.assertAlmostEqual(get_average_lifespan("EXL110"), 97.5)
+
+    def test_default_lifespan_until_enough_samples(self):
+        record_string_lifespan(self.user.id, "EXL110", 40.0)
+        db.session.commit()
+        self.assertEqual(
+            get_average_lifespan("EXL110"), app.config["DEFAULT_LIFESPAN_HRS"]
+        )
+        self.assertEqual(
+            get_average_lifespan("Unknown"), app.config["DEFAULT_LIFESPAN_HRS"]
+        )
+
+    def test_import_legacy_blobs_once(self):
+        blob = {"Les Paul - Guitar - EXL110": [80, 90], "Strat - EXL115": [100]}
+        db.session.add(
+            Stringlifespans(user_id=self.user.id, string_lifespans=json.dumps(blob))
+        )
+        db.session.commit()
+        runner = app.test_cli_runner()
+        for _ in range(2):
+            result = runner.invoke(args=["import-lifespan-blobs"])
+            self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(StringLifespan.query.count(), 3)
+        self.assertEqual(StringLifespanStats.query.get("EXL110").count, 2)
+        self.assertAlmostEqual(StringLifespanStats.query.get("EXL110").mean_hrs, 85.0)
+        self.assertEqual(StringLifespanStats.query.get("EXL115").count, 1)
+
+
+class StringHealthTests(unittest.TestCase):
+    def test_tiers_and_cost_per_hour(self):
+        health = string_health.compute_health(
+            [0, 60 * 50, 60 * 75, 60 * 95, 60 * 120], [100] * 5, [10] * 5
+        )
+        self.assertEqual(
+            health["health_tier"].tolist(),
+            [
+                string_health.HEALTHY,
+                string_health.HEALTHY,
+                string_health.WORN,
+                string_health.DUE,
+                string_health.DUE,
+            ],
+        )
+        self.assertEqual(
+            health["cost_per_hr"].tolist(), [0, 0.2, 10 / 75, 10 / 95, 10 / 120]
+        )
+        self.assertAlmostEqual(health["string_life"][1], 0.5)
+
+    def test_compute_one_returns_python_numbers(self):
+        health = string_health.compute_one(90, 100, 6)
+        self.assertEqual(health["health_tier"], string_health.HEALTHY)
+        self.assertIsInstance(health["health_tier"], int)
+        self.assertAlmostEqual(health["cost_per_hr"], 4.0)
+
+
+class StringHealthTableTests(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fresh = Strings(
+            instr_id=self.instr.instr_id, str_name="EXL110", str_cost=8
+        )
+        self.worn_out = Strings(
+            instr_id=self.instr.instr_id, str_name="EXL115", str_cost=9
+        )
+        db.session.add_all([self.fresh, self.worn_out])
+        db.session.commit()
+        # the CLI runner pushes its own app context, detaching these objects
+        self.fresh_id = self.fresh.str_id
+        self.user_id = self.user.id
+        self.row = {
+            "user_id": self.user.id,
+            "instr_id": self.instr.instr_id,
+            "string_id": self.worn_out.str_id,
+            "playtime_mins": 60 * 95,
+            "date": 1638748800,
+        }
+
+    def tearDown(self):
+        for model in (SessionRollups, StringTotals, Sessions):
+            model.query.delete()
+        db.session.commit()
+        super().tearDown()
+
+    def test_logging_a_session_rescores_the_string(self):
+        db.session.add(Sessions(**self.row))
+        record_session_aggregates([self.row])
+        db.session.commit()
+        health = StringHealth.query.get(self.worn_out.str_id)
+        self.assertTrue(health.due_for_restring)
+        self.assertEqual(health.health_tier, string_health.DUE)
+        self.assertEqual(get_strings_due(self.user.id), [("Strat", "EXL115")])
+
+    def test_job_scores_every_string(self):
+        add_to_string_totals(self.worn_out.str_id, 60 * 95, 1638748800)
+        db.session.commit()
+        result = app.test_cli_runner().invoke(
+            args=["compute-string-health", "--chunk-size", "1"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(StringHealth.query.count(), 2)
+        self.assertFalse(StringHealth.query.get(self.fresh_id).due_for_restring)
+        self.assertEqual(get_strings_due(self.user_id), [("Strat", "EXL115")])
+
+    def test_unscored_string_is_computed_on_the_fly(self):
+        health = get_string_health(self.fresh.str_id)
+        self.assertEqual(health["health_tier"], string_health.HEALTHY)
+        self.assertEqual(health["cost_per_hr"], 0)
+        self.assertEqual(StringHealth.query.count(), 0)
+
+
+class UserCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.loads = []
+        self.users = {1: User(email="a@test.com", username="a", password="x")}
+        self.users[1].id = 1
+        self.users[1].current_instr_id = 7
+        self.cache = UserCache(self.load, ttl=10, clock=lambda: self.now)
+
+    def load(self, user_id):
+        self.loads.append(user_id)
+        return self.users.get(user_id)
+
+    def test_snapshot_is_cached_until_it_expires(self):
+        snapshot = self.cache.get("1")
+        self.assertIsInstance(snapshot, UserSnapshot)
+        self.assertEqual((snapshot.id, snapshot.current_instr_id), (1, 7))
+        self.assertEqual(snapshot.get_id(), "1")
+        self.assertIs(self.cache.get("1"), snapshot)
+        self.assertEqual(self.loads, [1])
+        self.now = 11
+        self.assertIsNot(self.cache.get("1"), snapshot)
+        self.assertEqual(self.loads, [1, 1])
+
+    def test_invalidate_reloads(self):
+        self.cache.get("1")
+        self.users[1].current_instr_id = 8
+        self.cache.invalidate(1)
+        self.assertEqual(self.cache.get("1").current_instr_id, 8)
+
+    def test_unknown_users_are_not_cached(self):
+        self.assertIsNone(self.cache.get("2"))
+        self.assertIsNone(self.cache.get("2"))
+        self.assertIsNone(self.cache.get("not-an-id"))
+        self.assertEqual(self.loads, [2, 2])
+
+    def test_snapshot_has_no_dict(self):
+        with self.assertRaises(AttributeError):
+            UserSnapshot(1, "a", None).__dict__
+
+
+class EngineOptionsTests(unittest.TestCase):
+    def test_sqlite_keeps_defaults(self):
+        self.assertEqual(engine_options({}, "sqlite:///:memory:"), {})
+
+    def test_pool_defaults_to_one_connection_per_thread(self):
+        options = engine_options({"GUNICORN_THREADS": "6"}, "postgresql://db/app")
+        self.assertEqual(options["pool_size"], 6)
+        self.assertEqual(options["max_overflow"], 2)
+        self.assertTrue(options["pool_pre_ping"])
+
+    def test_connection_budget_is_split_between_workers(self):
+        config = {
+            "GUNICORN_THREADS": "8",
+            "WEB_CONCURRENCY": "3",
+            "DB_MAX_CONNECTIONS": "20",
+            "DB_POOL_PRE_PING": "0",
+        }
+        options = engine_options(config, "postgresql://db/app")
+        self.assertEqual(options["pool_size"], 6)
+        self.assertEqual(options["max_overflow"], 0)
+        self.assertFalse(options["pool_pre_ping"])
+
+
+class ClientTestCase(DatabaseTestCase):
+    """
+    Logs the user in on a test client, with the instrument as current
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.user.current_instr_id = self.instr.instr_id
+        db.session.commit()
+        self.user_id = self.user.id
+        # requests need app contexts of their own, or flask.g outlives them
+        self.ctx.pop()
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user_id)
+            session["_fresh"] = True
+
+    def tearDown(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        for model in (UserDataVersion, SessionRollups, StringTotals, Sessions):
+            model.query.delete()
+        db.session.commit()
+        super().tearDown()
+
+
+class JsonApiTests(ClientTestCase):
+    def test_instruments_and_strings(self):
+        response = self.client.get("/api/instruments")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json, {"instruments": ["Strat"], "current": "Strat"})
+        self.assertEqual(self.client.get("/api/strings").json["strings"], [])
+        self.assertEqual(response.headers["Cache-Control"], "private, no-cache")
+
+    def test_unchanged_data_is_not_modified(self):
+        etag = self.client.get("/api/analytics").headers["ETag"]
+        with patch("app.analytics_summary") as summary:
+            response = self.client.get(
+                "/api/analytics", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+        summary.assert_not_called()
+
+    def test_writes_change_the_etag(self):
+        etag = self.client.get("/api/strings").headers["ETag"]
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        with app.app_context():
+            self.assertEqual(get_data_version(self.user_id), 1)
+        response = self.client.get("/api/strings", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["strings"], ["EXL110"])
+
+        etag = self.client.get("/api/analytics").headers["ETag"]
+        self.client.post("/addsession", data={"playmins": "90"})
+        response = self.client.get("/api/analytics", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total_playtime_hrs"], 1.5)
+        self.assertEqual(response.json["current_str_name"], "EXL110")
+
+    def test_changing_instrument_refreshes_cached_user(self):
+        self.client.get("/api/instruments")
+        with app.app_context():
+            self.assertIsInstance(load_user(self.user_id), UserSnapshot)
+        self.client.post("/database", data={"instr_type": "Bass", "instr_name": "Jazz"})
+        response = self.client.get("/api/instruments")
+        self.assertEqual(response.json["instruments"], ["Strat", "Jazz"])
+        self.assertEqual(response.json["current"], "Jazz")
+        self.client.post("/changeinstr", data={"instruments": "Strat"})
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Strat")
+
+    def test_writes_use_an_instrument_changed_by_another_worker(self):
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        # this worker now holds a snapshot with Strat as the current instrument
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Strat")
+        this_worker = app_module.user_cache
+        app_module.user_cache = UserCache(lambda user_id: User.query.get(user_id))
+        self.addCleanup(setattr, app_module, "user_cache", this_worker)
+        self.client.post("/database", data={"instr_type": "Bass", "instr_name": "Jazz"})
+        app_module.user_cache = this_worker
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Strat")
+
+        self.client.post("/add_strings", data={"str_name": "EXL170", "str_cost": "9"})
+        self.client.post("/addsession", data={"playmins": "30"})
+        with app.app_context():
+            jazz = Instruments.query.filter_by(instr_name="Jazz").one()
+            strings = Strings.query.filter_by(str_name="EXL170").one()
+            session = Sessions.query.one()
+            self.assertEqual(strings.instr_id, jazz.instr_id)
+            self.assertEqual(
+                (session.instr_id, session.string_id), (jazz.instr_id, strings.str_id)
+            )
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Jazz")
+
+
+class StringReplacementTests(ClientTestCase):
+    def tearDown(self):
+        with app.app_context():
+            for model in (StringLifespan, StringLifespanStats):
+                model.query.delete()
+            db.session.commit()
+        super().tearDown()
+
+    def test_fitting_new_strings_records_a_lifespan(self):
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        self.client.post("/addsession", data={"playmins": "90"})
+        self.client.post("/add_strings", data={"str_name": "EXL115", "str_cost": "9"})
+        self.client.post("/addsession", data={"playmins": "60"})
+        analytics = self.client.get("/api/analytics").json
+        self.assertEqual(analytics["current_str_name"], "EXL115")
+        self.assertEqual(analytics["total_playtime_hrs"], 1.0)
+        self.client.post("/add_strings", data={"str_name": "EXL120", "str_cost": "9"})
+        # the unplayed set replaced here has no lifespan to record
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        with app.app_context():
+            sessions = Sessions.query.order_by(Sessions.session_id).all()
+            names = [Strings.query.get(s.string_id).str_name for s in sessions]
+            self.assertEqual(names, ["EXL110", "EXL115"])
+            lifespans = StringLifespan.query.order_by(StringLifespan.lifespan_id)
+            self.assertEqual(
+                [(row.string_model, row.lifespan_hrs) for row in lifespans],
+                [("EXL110", 1.5), ("EXL115", 1.0)],
+            )
+            self.assertEqual(lifespans[1].label, "Strat - EXL115")
+            self.assertEqual(StringLifespanStats.query.get("EXL115").count, 1)
+
+
+class AsyncViewTests(ClientTestCase):
+    def test_signup_checks_run_concurrently(self):
+        # the email check and the lookups wait for each other, so they only
+        # pass when they run concurrently
+        barrier = threading.Barrier(2, timeout=5)
+
+        def check(result):
+            def wait(_):
+                barrier.wait()
+                return result
+
+            return wait
+
+        with patch("app.email_validator", check("valid")), patch(
+            "app.get_user_by_username", check(None)
+        ):
+            response = self.client.post(
+                "/signup",
+                data={"email": "a@test.com", "username": "a", "password": "Secret1!"},
+            )
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            self.assertIsNotNone(get_user_by_username("a"))
+
+    def test_run_sync_uses_sessions_of_its_own(self):
+        with app.app_context():
+            session = db.session()
+            scopes = len(db.session.registry.registry)
+            first, second = asyncio.run(
+                app_module.run_concurrently((db.session,), (db.session,))
+            )
+            self.assertIs(db.session(), session)
+            self.assertEqual(len({id(session), id(first), id(second)}), 3)
+            # and closes them
+            self.assertEqual(len(db.session.registry.registry), scopes)
+
+    def test_analytics_page(self):
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        self.client.post("/addsession", data={"playmins": "90"})
+        summary = self.client.get("/api/analytics").json
+        page = self.client.get("/analytics").get_data(as_text=True)
+        self.assertEqual(summary["total_playtime_hrs"], 1.5)
+        self.assertIn("EXL110", page)
+        self.assertIn("1.5", page)
+
+    def test_addsession_rejects_invalid_playtime(self):
+        for playmins in ("", "abc", "-5", "0", "1.5"):
+            response = self.client.post("/addsession", data={"playmins": playmins})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn("whole number of minutes", response.get_data(as_text=True))
+        with app.app_context():
+            self.assertEqual(Sessions.query.count(), 0)
+
+    def test_login_upgrades_password_hash(self):
+        stronger = PasswordHasher(method="pbkdf2:sha256:2000", workers=0)
+        with patch("app.password_hasher", stronger):
+            response = app.test_client().post(
+                "/login", data={"email": "ctx@test.com", "password": "Secret1!"}
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers["Location"].endswith("/home"))
+        with app.app_context():
+            user = get_user_by_email("ctx@test.com")
+            self.assertTrue(user.password.startswith("pbkdf2:sha256:2000$"))
+
+
+class ListingTests(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ctx.push()
+        for name in ("Tele", "Jazz Bass", "Taylor 100%", "Taylor_2"):
+            db.session.add(
+                Instruments(
+                    compound_name=name,
+                    user_id=self.user_id,
+                    instr_name=name,
+                    instr_type="guitar",
+                )
+            )
+        db.session.commit()
+        self.ctx.pop()
+
+    def test_keyset_pages(self):
+        with app.app_context():
+            first = list_instruments(self.user_id, limit=2)
+            self.assertEqual([e.name for e in first.entries], ["Strat", "Tele"])
+            second = list_instruments(self.user_id, after=first.next_after, limit=2)
+            self.assertEqual(
+                [e.name for e in second.entries], ["Jazz Bass", "Taylor 100%"]
+            )
+            last = list_instruments(self.user_id, after=second.next_after, limit=2)
+            self.assertEqual([e.name for e in last.entries], ["Taylor_2"])
+            self.assertIsNone(last.next_after)
+            self.assertEqual(len(list_instruments(self.user_id).entries), 5)
+
+    def test_prefix_filter_escapes_wildcards(self):
+        with app.app_context():
+            names = lambda prefix: [
+                e.name for e in list_instruments(self.user_id, prefix=prefix).entries
+            ]
+            self.assertEqual(names("t"), ["Tele", "Taylor 100%", "Taylor_2"])
+            self.assertEqual(names("Taylor_"), ["Taylor_2"])
+            self.assertEqual(names("%"), [])
+            instr_id = list_instruments(self.user_id, prefix="Strat").entries[0].id
+            db.session.add(Strings(str_name="EXL110", str_cost=5, instr_id=instr_id))
+            db.session.commit()
+            self.assertEqual(list_strings(instr_id, prefix="exl")[0][0].name, "EXL110")
+
+    def test_database_page_renders_one_page(self):
+        app.config["LISTING_PAGE_SIZE"] = 2
+        try:
+            body = self.client.get("/database").get_data(as_text=True)
+            self.assertIn('value="Tele"', body)
+            self.assertNotIn('value="Jazz Bass"', body)
+            self.assertIn("More instruments", body)
+            body = self.client.get("/database?instr_q=taylor").get_data(as_text=True)
+            self.assertIn('value="Taylor_2"', body)
+            self.assertNotIn('value="Tele"', body)
+        finally:
+            app.config.pop("LISTING_PAGE_SIZE")
+
+
+class FakeJournalStore:
+    def __init__(self, checkpoints=None):
+        self.checkpoints = dict(checkpoints or {})
+        self.rows = []
+        self.batches = 0
+        self.fail = False
+
+    def last_seq(self, journal):
+        return self.checkpoints.get(journal, 0)
+
+    def write(self, journal, entries):
+        if self.fail:
+            raise ConnectionError("database unavailable")
+        self.rows.extend(row for _, row in entries)
+        self.batches += 1
+        self.checkpoints[journal] = entries[-1][0]
+
+    def forget(self, journal):
+        self.checkpoints.pop(journal, None)
+
+
+class SessionJournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = FakeJournalStore()
+        # flushed by hand: the thread would only wake up after an hour
+        self.journal = SessionJournal(self.tmp.name, self.store, interval=3600)
+
+    def tearDown(self):
+        self.journal.stop()
+        self.tmp.cleanup()
+
+    def row(self, mins, user_id=1):
+        return {"user_id": user_id, "string_id": 7, "playtime_mins": mins}
+
+    def journal_path(self, journal=None):
+        return os.path.join(self.tmp.name, (journal or self.journal).name + ".journal")
+
+    def test_flushes_in_batches_and_truncates(self):
+        for mins in (10, 20, 30):
+            self.journal.append(self.row(mins))
+        self.journal.append(self.row(40, user_id=2))
+        self.assertEqual(len(self.journal.pending(1)), 3)
+        self.assertGreater(os.path.getsize(self.journal_path()), 0)
+        self.journal.max_batch = 3
+        self.assertEqual(self.journal.flush(), 4)
+        self.assertEqual(self.store.batches, 2)
+        self.assertEqual(
+            [r["playtime_mins"] for r in self.store.rows], [10, 20, 30, 40]
+        )
+        self.assertEqual(self.journal.pending(), [])
+        self.assertEqual(self.store.checkpoints[self.journal.name], 4)
+        self.assertEqual(os.path.getsize(self.journal_path()), 0)
+
+    def test_full_batch_wakes_the_flusher(self):
+        self.journal.max_batch = 1
+        self.journal.append(self.row(10))
+        deadline = time.monotonic() + 5
+        while not self.store.rows and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.store.rows), 1)
+
+    def test_failed_flush_keeps_rows(self):
+        self.journal.append(self.row(10))
+        self.store.fail = True
+        with self.assertRaises(ConnectionError):
+            self.journal.flush()
+        self.assertEqual(len(self.journal.pending()), 1)
+        self.store.fail = False
+        self.assertEqual(self.journal.flush(), 1)
+
+    def test_replays_abandoned_journals_past_checkpoint(self):
+        path = os.path.join(self.tmp.name, "sessions-1-dead.journal")
+        with open(path, "w", encoding="utf-8") as stream:
+            for seq in (1, 2, 3):
+                stream.write(json.dumps({"seq": seq, "row": self.row(seq)}) + "\n")
+            stream.write('{"seq": 4, "ro')  # torn by the crash
+        self.store.checkpoints["sessions-1-dead"] = 1
+
+        # a journal still held by a live process is left alone
+        live = SessionJournal(self.tmp.name, FakeJournalStore(), interval=3600)
+        live.append(self.row(99))
+        try:
+            with self.assertLogs("session_journal", "WARNING"):
+                self.assertEqual(self.journal.replay(), 2)
+            self.assertEqual([r["playtime_mins"] for r in self.store.rows], [2, 3])
+            self.assertFalse(os.path.exists(path))
+            self.assertNotIn("sessions-1-dead", self.store.checkpoints)
+            self.assertTrue(os.path.exists(self.journal_path(live)))
+        finally:
+            live.stop()
+
+    def test_stop_flushes_and_removes_journal(self):
+        self.journal.append(self.row(10))
+        path = self.journal_path()
+        self.journal.stop()
+        self.assertEqual(len(self.store.rows), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_stop_keeps_unwritten_journal(self):
+        self.journal.append(self.row(10))
+        path = self.journal_path()
+        self.store.fail = True
+        with self.assertLogs("session_journal", "WARNING"):
+            self.journal.stop()
+        self.assertTrue(os.path.exists(path))
+
+        self.store.fail = False
+        restarted = SessionJournal(self.tmp.name, self.store, interval=3600)
+        self.assertEqual(restarted.replay(), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_needs_a_single_worker_process(self):
+        config = {"SESSION_JOURNAL_DIR": self.tmp.name}
+        self.assertIsInstance(
+            SessionJournal.from_config({**config, "WEB_CONCURRENCY": "1"}, self.store),
+            SessionJournal,
+        )
+        with self.assertRaises(ValueError):
+            SessionJournal.from_config({**config, "WEB_CONCURRENCY": "2"}, self.store)
+
+
+class WriteBehindTests(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.journal = SessionJournal(self.tmp.name, JournalStore(app), interval=3600)
+        patcher = patch("app.session_journal", self.journal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+
+    def tearDown(self):
+        self.journal.stop()
+        self.tmp.cleanup()
+        super().tearDown()
+        with app.app_context():
+            JournalCheckpoint.query.delete()
+            db.session.commit()
+
+    def test_buffered_sessions_are_read_back_then_flushed(self):
+        etag = self.client.get("/api/analytics").headers["ETag"]
+        self.client.post("/addsession", data={"playmins": "90"})
+        with app.app_context():
+            self.assertEqual(Sessions.query.count(), 0)
+
+        response = self.client.get("/api/analytics", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json["total_playtime_hrs"], 1.5)
+        self.assertEqual(response.json["recent_playtime_hrs"], 1.5)
+
+        self.assertEqual(self.journal.flush(), 1)
+        with app.app_context():
+            self.assertEqual(Sessions.query.count(), 1)
+            self.assertEqual(JournalCheckpoint.query.get(self.journal.name).last_seq, 1)
+        response = self.client.get("/api/analytics")
+        self.assertEqual(response.json["total_playtime_hrs"], 1.5)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+
+class ChangeFeedTests(ClientTestCase):
+    def tearDown(self):
+        super().tearDown()
+        with app.app_context():
+            IdempotencyKey.query.delete()
+            db.session.commit()
+
+    def upload(self, sessions, key="k1"):
+        headers = {"Idempotency-Key": key} if key else {}
+        return self.client.post(
+            "/api/sessions", json={"sessions": sessions}, headers=headers
+        )
+
+    def test_feed_returns_only_new_rows(self):
+        full = self.client.get("/api/changes").json
+        self.assertEqual(full["cursor"], 0)
+        self.assertEqual([i["instr_name"] for i in full["instruments"]], ["Strat"])
+        self.assertEqual(full["current_instr_id"], full["instruments"][0]["instr_id"])
+
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        self.client.post("/addsession", data={"playmins": "30"})
+        delta = self.client.get("/api/changes?cursor=0").json
+        self.assertEqual(delta["cursor"], 2)
+        self.assertEqual(delta["instruments"], [])
+        self.assertEqual([s["str_name"] for s in delta["strings"]], ["EXL110"])
+        self.assertEqual([s["playtime_mins"] for s in delta["sessions"]], [30])
+
+        response = self.client.get("/api/changes?cursor=2")
+        self.assertEqual(response.json["sessions"], [])
+        response = self.client.get(
+            "/api/changes?cursor=2", headers={"If-None-Match": response.headers["ETag"]}
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_upload_is_idempotent(self):
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        sessions = [
+            {"instrument": "Strat", "string": "EXL110", "playtime_mins": 20, "date": 1},
+            {
+                "instrument": "Strat",
+                "string": "EXL110",
+                "playtime_mins": 40,
+                "date": "2022-01-01",
+            },
+        ]
+        self.assertEqual(self.upload(sessions, key=None).status_code, 400)
+        first = self.upload(sessions)
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json, {"imported": 2, "cursor": 2})
+        retry = self.upload(sessions)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json, first.json)
+        with app.app_context():
+            self.assertEqual(Sessions.query.count(), 2)
+        delta = self.client.get("/api/changes?cursor=1").json
+        self.assertEqual([s["playtime_mins"] for s in delta["sessions"]], [20, 40])
+
+    def test_invalid_upload_adds_nothing(self):
+        response = self.upload(
+            [{"instrument": "Strat", "string": "Nope", "playtime_mins": 5, "date": 1}]
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json["errors"][0]["index"], 0)
+        with app.app_context():
+            self.assertEqual(Sessions.query.count(), 0)
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+
+
+class AddColumnsTests(unittest.TestCase):
+    def test_adds_missing_nullable_columns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            uri = "sqlite:///" + os.path.join(tmp, "old.db")
+            old = create_app({"SQLALCHEMY_DATABASE_URI": uri, "LOG_LEVEL": "WARNING"})
+            try:
+                with old.app_context():
+                    db.create_all()
+                    with db.engine.begin() as conn:
+                        conn.execute(
+                            db.text("DROP INDEX ix_sessions_user_id_data_version")
+                        )
+                        conn.execute(
+                            db.text("ALTER TABLE sessions DROP COLUMN data_version")
+                        )
+                result = old.test_cli_runner().invoke(args=["add-columns"])
+                self.assertEqual(result.exit_code, 0, result.output)
+                with old.app_context():
+                    columns = db.inspect(db.engine).get_columns("sessions")
+                    self.assertIn("data_version", [c["name"] for c in columns])
+                    db.engine.dispose()
+            finally:
+                restore_services()
+
+
+class ShardRouterTests(unittest.TestCase):
+    def test_single_database_is_not_sharded(self):
+        router = ShardRouter.from_config({}, load=lambda user_id: 1 / 0)
+        self.assertFalse(router.sharded)
+        self.assertEqual(router.placement(7), Placement(0, False, None))
+
+    def test_placements_are_cached(self):
+        loads = []
+
+        def load(user_id):
+            loads.append(user_id)
+            return Placement(2, False, None) if user_id == 5 else None
+
+        now = [0.0]
+        router = ShardRouter(3, load, ttl=5, clock=lambda: now[0])
+        self.assertEqual(router.shard_for(5), 2)
+        self.assertEqual(router.shard_for(6), 0)
+        self.assertEqual(router.shard_for(5), 2)
+        self.assertEqual(loads, [5, 6])
+        router.invalidate(5)
+        router.shard_for(5)
+        now[0] = 10
+        router.shard_for(6)
+        self.assertEqual(loads, [5, 6, 5, 6])
+        self.assertEqual([router.new_user_shard(i) for i in range(4)], [0, 1, 2, 0])
+
+    def test_shard_urls(self):
+        self.assertEqual(shard_urls({}), [])
+        self.assertEqual(
+            shard_urls({"SHARD_DATABASE_URLS": "sqlite:///a.db, sqlite:///b.db"}),
+            ["sqlite:///a.db", "sqlite:///b.db"],
+        )
+
+
+class ShardingTests(unittest.TestCase):
+    """
+    Two shards in SQLite files: the main database and s1.db
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp.cleanup)
+        self.main_path = os.path.join(tmp.name, "main.db")
+        self.shard_path = os.path.join(tmp.name, "s1.db")
+        self.app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.main_path,
+                "SHARD_DATABASE_URLS": "sqlite:///" + self.shard_path,
+                "SHARD_CACHE_TTL": 0,
+                "LOG_LEVEL": "WARNING",
+            }
+        )
+        self.app.secret_key = "unit-tests"
+        self.addCleanup(self.restore_services)
+        result = self.app.test_cli_runner().invoke(args=["init-db"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with self.app.app_context():
+            user = User(email="shard@test.com", username="shard", password="Secret1!")
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(ShardAssignment(user_id=user.id, shard=1))
+            db.session.commit()
+            self.user_id = user.id
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(self.user_id)
+            session["_fresh"] = True
+
+    def restore_services(self):
+        with self.app.app_context():
+            for shard in range(app_module.shard_router.count):
+                app_module.shard_engine(shard).dispose()
+        restore_services()
+
+    def count(self, path, table):
+        with sqlite3.connect(path) as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def add_data(self):
+        self.client.post("/database", data={"instr_type": "Bass", "instr_name": "Jazz"})
+        self.client.post("/add_strings", data={"str_name": "EXL170", "str_cost": "9"})
+        self.client.post("/addsession", data={"playmins": "45"})
+
+    def set_moving(self, moving):
+        with self.app.app_context():
+            ShardAssignment.query.get(self.user_id).moving = moving
+            db.session.commit()
+
+    def test_rows_live_on_the_users_shard(self):
+        self.add_data()
+        for table in ("instruments", "strings", "sessions", "string_totals"):
+            self.assertEqual(self.count(self.shard_path, table), 1, table)
+            self.assertEqual(self.count(self.main_path, table), 0, table)
+        with sqlite3.connect(self.shard_path) as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        self.assertNotIn("user", tables)
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Jazz")
+        self.assertEqual(
+            self.client.get("/api/analytics").json["total_playtime_hrs"], 0.75
+        )
+
+        with self.app.app_context():
+            with self.assertRaises(NoShardSelected):
+                Sessions.query.count()
+            with for_user(self.user_id):
+                self.assertEqual(Sessions.query.count(), 1)
+
+        with sqlite3.connect(self.shard_path) as conn:
+            conn.execute("DELETE FROM string_totals")
+        result = self.app.test_cli_runner().invoke(args=["rebuild-string-totals"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(self.count(self.shard_path, "string_totals"), 1)
+
+    def test_new_user_writes_to_their_shard(self):
+        app_module.shard_router = ShardRouter(2, app_module.load_placement, ttl=60)
+        new_user_id = self.user_id + 1
+        # a lookup made before the assignment was committed caches a miss
+        with self.app.app_context():
+            app_module.shard_router.placement(new_user_id)
+        with patch("app.email_validator", return_value="valid"), patch.object(
+            app_module.shard_router, "new_user_shard", return_value=1
+        ):
+            response = self.client.post(
+                "/signup",
+                data={
+                    "email": "new@test.com",
+                    "username": "new",
+                    "password": "Secret1!",
+                },
+            )
+        self.assertEqual(response.status_code, 302)
+        with self.client.session_transaction() as session:
+            session["_user_id"] = str(new_user_id)
+        self.add_data()
+        self.assertEqual(self.count(self.shard_path, "sessions"), 1)
+        self.assertEqual(self.count(self.main_path, "sessions"), 0)
+
+    def test_writes_wait_while_moving(self):
+        self.add_data()
+        self.set_moving(True)
+        response = self.client.post("/addsession", data={"playmins": "10"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        self.assertEqual(self.client.get("/api/strings").json["strings"], ["EXL170"])
+        self.set_moving(False)
+        self.assertEqual(self.count(self.shard_path, "sessions"), 1)
+
+    def test_move_user(self):
+        self.add_data()
+        cursor = self.client.get("/api/changes").json["cursor"]
+        result = self.app.test_cli_runner().invoke(
+            args=["move-user", "--user", "shard@test.com", "--to", "0", "--wait", "0"]
+        )
+        self.assertEqual(result.exit_code, 0, result.output)
+        for table in ("instruments", "strings", "sessions", "string_totals"):
+            self.assertEqual(self.count(self.main_path, table), 1, table)
+            self.assertEqual(self.count(self.shard_path, table), 0, table)
+
+        self.assertEqual(self.client.get("/api/instruments").json["current"], "Jazz")
+        self.assertEqual(
+            self.client.get("/api/analytics").json["total_playtime_hrs"], 0.75
+        )
+        feed = self.client.get(f"/api/changes?cursor={cursor}").json
+        self.assertTrue(feed["reset"])
+        self.assertEqual([s["playtime_mins"] for s in feed["sessions"]], [45])
+        self.assertEqual(feed["current_instr_id"], feed["instruments"][0]["instr_id"])
+        self.assertFalse(
+            self.client.get(f"/api/changes?cursor={feed['cursor']}").json["reset"]
+        )
+
+        # moving to where the user is only cleans up leftovers
+        with sqlite3.connect(self.shard_path) as conn:
+            conn.execute(
+                "INSERT INTO user_data_version (user_id, version) VALUES (?, 1)",
+                (self.user_id,),
+            )
+        with self.app.app_context():
+            self.assertEqual(app_module.move_user(self.user_id, 0, wait=0), 0)
+        self.assertEqual(self.count(self.shard_path, "user_data_version"), 0)
+
+
+class ReplicaSetTests(unittest.TestCase):
+    def test_lagging_and_failing_replicas_are_skipped(self):
+        lags = {0: 1.0, 1: 30.0, 2: 0.0}
+
+        def measure(replica):
+            if replica == 2:
+                raise OSError("unreachable")
+            return lags[replica]
+
+        now = [0.0]
+        replicas = ReplicaSet(
+            3, measure, max_lag=5, check_interval=10, clock=lambda: now[0]
+        )
+        with self.assertLogs("replicas", "WARNING"):
+            self.assertEqual([replicas.choose() for _ in range(2)], [0, 0])
+        self.assertEqual(replicas.lags, [1.0, 30.0, float("inf")])
+        lags[1] = 0.5
+        self.assertEqual(replicas.choose(), 0)
+        now[0] = 10
+        with self.assertLogs("replicas", "WARNING"):
+            self.assertEqual(sorted({replicas.choose() for _ in range(4)}), [0, 1])
+        lags[0] = lags[1] = 60.0
+        now[0] = 20
+        with self.assertLogs("replicas", "WARNING"):
+            self.assertIsNone(replicas.choose())
+
+    def test_no_replicas(self):
+        replicas = ReplicaSet.from_config({}, measure=lambda replica: 1 / 0)
+        self.assertIsNone(replicas.choose())
+
+    def test_heartbeat_beats_in_the_background(self):
+        beats = threading.Semaphore(0)
+        heartbeat = Heartbeat(beats.release, interval=0.01)
+        heartbeat.start()
+        heartbeat.start()
+        for _ in range(3):
+            self.assertTrue(beats.acquire(timeout=5))
+        heartbeat.stop()
+        while beats.acquire(blocking=False):
+            pass
+        self.assertFalse(beats.acquire(timeout=0.05))
+
+
+class ReplicaRoutingTests(unittest.TestCase):
+    """
+    A primary and a replica in SQLite files; the replica is a snapshot of the
+    primary that only changes when the test copies it again
+    """
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp.cleanup)
+        self.primary_path = os.path.join(tmp.name, "primary.db")
+        self.replica_path = os.path.join(tmp.name, "replica.db")
+        self.app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": "sqlite:///" + self.primary_path,
+                "REPLICA_DATABASE_URLS": "sqlite:///" + self.replica_path,
+                # measured once per app; the heartbeat thread stays asleep
+                "REPLICA_CHECK_INTERVAL": 3600,
+                "LOG_LEVEL": "WARNING",
+            }
+        )
+        self.app.secret_key = "unit-tests"
+        self.addCleanup(self.restore_services)
+        result = self.app.test_cli_runner().invoke(args=["init-db"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        with self.app.app_context():
+            user = User(email="replica@test.com", username="replica", password="x")
+            db.session.add(user)
+            db.session.flush()
+            instr = Instruments(
+                compound_name="Strat - guitar",
+                user_id=user.id,
+                instr_name="Strat",
+                instr_type="guitar",
+            )
+            db.session.add(instr)
+            db.session.flush()
+            user.current_instr_id = instr.instr_id
+            db.session.commit()
+            db.session.add(ReplicaHeartbeat(id=1, beat_at=time.time()))
+            db.session.commit()
+            self.user_id = user.id
+        self.replicate()
+
+    def restore_services(self):
+        with self.app.app_context():
+            db.get_engine(self.app).dispose()
+            db.get_engine(self.app, bind="replica0").dispose()
+        restore_services()
+
+    def replicate(self):
+        with sqlite3.connect(self.primary_path) as src, sqlite3.connect(
+            self.replica_path
+        ) as dst:
+            src.backup(dst)
+
+    def add_instrument_behind_the_apps_back(self, name):
+        with sqlite3.connect(self.primary_path) as conn:
+            conn.execute(
+                "INSERT INTO instruments (compound_name, user_id, instr_name,"
+                " instr_type) VALUES (?, ?, ?, 'bass')",
+                (name, self.user_id, name),
+            )
+
+    def login(self):
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(self.user_id)
+            session["_fresh"] = True
+        return client
+
+    def test_read_only_pages_use_the_replica(self):
+        self.add_instrument_behind_the_apps_back("Jazz")
+        client = self.login()
+        page = client.get("/database").get_data(as_text=True)
+        self.assertIn("Strat", page)
+        self.assertNotIn("Jazz", page)
+        # the JSON API isn't marked as read-only
+        self.assertIn("Jazz", client.get("/api/instruments").json["instruments"])
+
+        self.replicate()
+        self.assertIn("Jazz", client.get("/database").get_data(as_text=True))
+
+    def test_own_writes_stick_to_the_primary(self):
+        client = self.login()
+        client.post("/database", data={"instr_type": "Bass", "instr_name": "Precision"})
+        self.assertIn("Precision", client.get("/database").get_data(as_text=True))
+        self.assertIn("Precision", client.get("/home").get_data(as_text=True))
+        # other users' sessions still read the replica
+        self.assertNotIn(
+            "Precision", self.login().get("/database").get_data(as_text=True)
+        )
+
+    def test_requests_do_not_write_the_heartbeat(self):
+        def primary_beat():
+            with sqlite3.connect(self.primary_path) as conn:
+                return conn.execute("SELECT beat_at FROM replica_heartbeat").fetchone()
+
+        before = primary_beat()
+        self.login().get("/database")
+        self.assertEqual(primary_beat(), before)
+        app_module.beat_replica_heartbeat(self.app)
+        self.assertGreater(primary_beat(), before)
+
+    def test_lagging_replica_is_skipped(self):
+        self.add_instrument_behind_the_apps_back("Jazz")
+        with sqlite3.connect(self.primary_path) as conn:
+            conn.execute("UPDATE replica_heartbeat SET beat_at = beat_at + 60")
+        self.assertIn("Jazz", self.login().get("/database").get_data(as_text=True))
+        self.assertEqual(app_module.replica_set.lags, [60.0])
+
+
+class SketchTests(unittest.TestCase):
+    def test_count_min_never_under_counts(self):
+        sketch = CountMinSketch(width=64, depth=4, top=3)
+        for i in range(500):
+            sketch.add(f"string {i % 50}")
+        sketch.add("EXL110", 300)
+        sketch.add("NYXL", 200)
+        self.assertEqual(sketch.total, 1000)
+        for i in range(50):
+            estimate = sketch.estimate(f"string {i}")
+            self.assertGreaterEqual(estimate, 10)
+            self.assertLessEqual(estimate, 10 + 4 * sketch.error_bound)
+        self.assertEqual([key for key, _ in sketch.most_common(2)], ["EXL110", "NYXL"])
+
+    def test_merged_sketches_match_one_sketch(self):
+        whole, first, second = CountMinSketch(), CountMinSketch(), CountMinSketch()
+        whole_hll, first_hll, second_hll = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for i in range(2000):
+            part, part_hll = (first, first_hll) if i % 3 else (second, second_hll)
+            for sketch in (whole, part):
+                sketch.add(f"s{i % 37}", i % 5)
+            for sketch in (whole_hll, part_hll):
+                sketch.add(i)
+        merged = sketches.loads(sketches.dumps(first)).merge(second)
+        self.assertEqual(merged.counts, whole.counts)
+        self.assertEqual(merged.most_common(5), whole.most_common(5))
+        merged_hll = sketches.loads(sketches.dumps(first_hll)).merge(second_hll)
+        self.assertEqual(merged_hll.count(), whole_hll.count())
+
+    def test_hyperloglog_error(self):
+        sketch = HyperLogLog(p=12)
+        for i in range(20000):
+            sketch.add(i)
+            sketch.add(i)
+        self.assertLess(abs(sketch.count() - 20000) / 20000, 3 * sketch.standard_error)
+        small = HyperLogLog(p=10)
+        for i in range(30):
+            small.add(i)
+        self.assertEqual(round(small.count()), 30)
+
+    def test_quantiles_within_relative_error(self):
+        sketch = QuantileSketch(alpha=0.01)
+        values = [1.5**i % 997 + 1 for i in range(1000)]
+        for value in values:
+            sketch.add(value)
+        sketch = sketches.loads(sketches.dumps(sketch))
+        ordered = sorted(values)
+        for q in (0.1, 0.5, 0.9, 1.0):
+            exact = ordered[int(q * (len(values) - 1))]
+            self.assertLessEqual(
+                abs(sketch.quantile(q) - exact), 0.01 * exact + 1e-9, q
+            )
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+class FakeSketchStore:
+    def __init__(self):
+        self.stored = {}
+        self.fail = False
+
+    def merge(self, name, sketch):
+        if self.fail:
+            raise OSError("database down")
+        if name in self.stored:
+            self.stored[name].merge(sketch)
+        else:
+            self.stored[name] = sketch
+
+
+class SketchBufferTests(unittest.TestCase):
+    def test_deltas_are_kept_until_merged(self):
+        store = FakeSketchStore()
+        buffer = SketchBuffer(store, interval=3600)
+        self.addCleanup(buffer.stop)
+        buffer.add("players", HyperLogLog, 1)
+        buffer.add("playtime", CountMinSketch, "EXL110", 30)
+        store.fail = True
+        with self.assertRaises(OSError):
+            buffer.flush()
+        buffer.add("playtime", CountMinSketch, "EXL110", 15)
+        self.assertEqual(buffer.pending(), 2)
+        store.fail = False
+        self.assertEqual(buffer.flush(), 2)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(store.stored["playtime"].estimate("EXL110"), 45)
+        self.assertEqual(round(store.stored["players"].count()), 1)
+
+
+class CommunityStatsTests(ClientTestCase):
+    def setUp(self):
+        super().setUp()
+        # drop what earlier tests folded in
+        app_module.community_stats.flush()
+        self.delete_sketches()
+
+    def tearDown(self):
+        super().tearDown()
+        self.delete_sketches()
+
+    def delete_sketches(self):
+        with app.app_context():
+            for model in (CommunitySketch, StringLifespan, StringLifespanStats):
+                model.query.delete()
+            db.session.commit()
+
+    def test_writes_are_folded_into_the_sketches(self):
+        self.client.post("/add_strings", data={"str_name": "EXL110", "str_cost": "8"})
+        self.client.post("/addsession", data={"playmins": "90"})
+        self.client.post("/addsession", data={"playmins": "30"})
+        with app.app_context():
+            for hours in (50, 60, 70, 80, 90):
+                record_string_lifespan(
+                    self.user_id, "EXL110", hours, instr_type="Guitar"
+                )
+            record_string_lifespan(self.user_id, "EXL110", 500)
+            db.session.commit()
+        self.assertEqual(self.client.get("/api/community").json["players"], 0)
+
+        app_module.community_stats.flush()
+        summary = self.client.get("/api/community?string=EXL110&instr_type=guitar").json
+        self.assertEqual(summary["players"], 1)
+        self.assertEqual(
+            summary["most_played"], [{"string": "EXL110", "playtime_hrs": 2.0}]
+        )
+        self.assertEqual(summary["most_fitted"], [{"string": "EXL110", "fitted": 1}])
+        self.assertEqual(summary["string"]["players"], 1)
+        self.assertEqual(summary["string"]["lifespans"], 5)
+        self.assertAlmostEqual(
+            summary["string"]["lifespan_hrs"]["median"], 70, delta=0.7
+        )
+        everyone = self.client.get("/api/community?string=EXL110").json["string"]
+        self.assertEqual(everyone["lifespans"], 6)
+
+        page = self.client.get("/community?string=EXL110").get_data(as_text=True)
+        self.assertIn("EXL110", page)
+        self.assertIn("2.0 hours", page)
+
+        # a rebuild from the rows gives the same answers
+        with app.app_context():
+            CommunitySketch.query.delete()
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=["rebuild-community-stats"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        rebuilt = self.client.get("/api/community?string=EXL110&instr_type=guitar").json
+        self.assertEqual(rebuilt, summary)
+
+
+class RegistryTests(unittest.TestCase):
+    def test_prometheus_text_format(self):
+        registry = Registry()
+        registry.counter("requests_total", "Requests.")
+        registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        registry.inc("requests_total", route="home")
+        registry.inc("requests_total", route="home")
+        for value in (0.05, 0.5, 3.0):
+            registry.observe("latency_seconds", value, route='say "hi"')
+        lines = registry.render(pid=7).splitlines()
+        self.assertIn("# TYPE requests_total counter", lines)
+        self.assertIn('requests_total{route="home",pid="7"} 2', lines)
+        self.assertIn(
+            'latency_seconds_bucket{route="say \\"hi\\"",le="0.1",pid="7"} 1', lines
+        )
+        self.assertIn(
+            'latency_seconds_bucket{route="say \\"hi\\"",le="+Inf",pid="7"} 3', lines
+        )
+        self.assertIn('latency_seconds_count{route="say \\"hi\\"",pid="7"} 3', lines)
+        self.assertEqual(registry.value("latency_seconds", route='say "hi"'), (3, 3.55))
+
+    def test_timed_records_outcome(self):
+        registry = Registry()
+        registry.histogram("stringtracker_outbound_http_duration_seconds", "Outbound.")
+
+        def fail():
+            raise EmailBackendUnavailable("down")
+
+        timed(lambda: "valid", "email", registry)()
+        with self.assertRaises(EmailBackendUnavailable):
+            timed(fail, "email", registry)()
+        for outcome in ("ok", "error"):
+            count, _ = registry.value(
+                "stringtracker_outbound_http_duration_seconds",
+                service="email",
+                outcome=outcome,
+            )
+            self.assertEqual(count, 1)
+
+
+class RequestMetricsTests(ClientTestCase):
+    def test_route_latency_and_query_counts(self):
+        REGISTRY.clear()
+        self.client.get("/api/instruments")
+        route = "tracker.api_instruments"
+        self.assertEqual(
+            REGISTRY.value(
+                "stringtracker_http_requests_total",
+                route=route,
+                method="GET",
+                status=200,
+            ),
+            1,
+        )
+        queries, _ = REGISTRY.value("stringtracker_db_queries_per_request", route=route)
+        self.assertEqual(queries, 1)
+        self.assertGreater(
+            REGISTRY.value("stringtracker_db_queries_total", route=route), 0
+        )
+
+        body = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn(
+            "# TYPE stringtracker_http_request_duration_seconds histogram", body
+        )
+        self.assertIn('route="tracker.api_instruments"', body)
+
+    def test_warns_about_query_heavy_requests(self):
+        app.config["METRICS_QUERY_WARN_THRESHOLD"] = 1
+        try:
+            with self.assertLogs("metrics", "WARNING") as logs:
+                self.client.post(
+                    "/database", data={"instr_type": "Bass", "instr_name": "Jazz"}
+                )
+        finally:
+            app.config.pop("METRICS_QUERY_WARN_THRESHOLD")
+        self.assertIn("POST /database ran", logs.output[0])
+
+    def test_metrics_token(self):
+        app.config["METRICS_TOKEN"] = "secret"
+        try:
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get(
+                "/metrics", headers={"Authorization": "Bearer secret"}
+            )
+            self.assertEqual(response.status_code, 200)
+        finally:
+            app.config.pop("METRICS_TOKEN")
+
+
+class LoggingTests(unittest.TestCase):
+    def make_record(self, level=logging.INFO, msg="event", **extra):
+        record = logging.LogRecord("app", level, __file__, 1, msg, (), None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_redact_nested(self):
+        self.assertEqual(
+            redact({"user": {"password": "x", "name": "a"}, "tokens": ["t"]}),
+            {"user": {"password": REDACTED, "name": "a"}, "tokens": REDACTED},
+        )
+        self.assertEqual(
+            redact([{"Authorization": "Bearer x"}]), [{"Authorization": REDACTED}]
+        )
+
+    def test_redacting_filter(self):
+        record = self.make_record(
+            password="Secret1!", form={"new_password": "x"}, user_id=3
+        )
+        self.assertTrue(RedactingFilter().filter(record))
+        self.assertEqual(record.password, REDACTED)
+        self.assertEqual(record.form, {"new_password": REDACTED})
+        self.assertEqual(record.user_id, 3)
+
+    def test_sampling_only_applies_to_debug(self):
+        never = SamplingFilter(rate=0.5, rand=lambda: 0.9)
+        self.assertFalse(never.filter(self.make_record(logging.DEBUG)))
+        self.assertTrue(never.filter(self.make_record(logging.INFO)))
+        self.assertTrue(never.filter(self.make_record(logging.DEBUG, sample_rate=1)))
+        always = SamplingFilter(rate=0.5, rand=lambda: 0.1)
+        self.assertTrue(always.filter(self.make_record(logging.DEBUG)))
+
+    def test_json_formatter(self):
+        record = self.make_record(msg="added %d", user_id=3)
+        record.args = (2,)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry["message"], "added 2")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "app")
+        self.assertEqual(entry["user_id"], 3)
+        self.assertIn("ts", entry)
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        handler = DroppingQueueHandler(queue.Queue(1))
+        dropped = DroppingQueueHandler.dropped
+        handler.handle(self.make_record())
+        handler.handle(self.make_record())
+        self.assertEqual(handler.queue.qsize(), 1)
+        self.assertEqual(DroppingQueueHandler.dropped, dropped + 1)
+
+    def test_signup_does_not_log_password(self):
+        with patch("app.email_validator", return_value="invalid"), self.assertLogs(
+            "app", "DEBUG"
+        ) as logs:
+            app.test_client().post(
+                "/signup",
+                data={"email": "x@test.com", "username": "x", "password": "Secret1!"},
+            )
+        self.assertTrue(logs.records)
+        for record in logs.records:
+            self.assertNotIn("Secret1!", json.dumps(vars(record), default=str))
+
+
+class AssetTests(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(tmp.cleanup)
+        self.source = os.path.join(tmp.name, "static")
+        self.target = os.path.join(tmp.name, "build")
+        os.makedirs(os.path.join(self.source, "img"))
+        with open(os.path.join(self.source, "style.css"), "w") as stream:
+            stream.write(
+                "/* layout */\nbody {\n    color: red;\n"
+                "    background: url('img/bg.jpg');\n}\n" * 20
+            )
+        with open(os.path.join(self.source, "img", "bg.jpg"), "wb") as stream:
+            stream.write(b"not really a jpeg")
+
+    def build_app(self):
+        manifest = assets.build(self.source, self.target)
+        built_app = create_app({**TEST_CONFIG, "ASSET_DIR": self.target})
+        self.addCleanup(restore_services)
+        return built_app, manifest
+
+    def test_build(self):
+        with patch.object(assets, "Image", None):
+            manifest = assets.build(self.source, self.target)
+        css = manifest["files"]["style.css"]
+        image = manifest["files"]["img/bg.jpg"]
+        self.assertRegex(css, r"^style\.[0-9a-f]{12}\.css$")
+        self.assertRegex(image, r"^img/bg\.[0-9a-f]{12}\.jpg$")
+        with open(os.path.join(self.target, css), encoding="utf-8") as stream:
+            text = stream.read()
+        self.assertNotIn("layout", text)
+        self.assertIn(f"body{{color:red;background:url('{image}')}}", text)
+        with open(os.path.join(self.target, css + ".gz"), "rb") as stream:
+            self.assertEqual(gzip.decompress(stream.read()).decode("utf-8"), text)
+        # images are already compressed
+        self.assertFalse(os.path.exists(os.path.join(self.target, image + ".gz")))
+        with open(
+            os.path.join(self.target, "manifest.json"), encoding="utf-8"
+        ) as stream:
+            self.assertEqual(json.load(stream), manifest)
+        # same content, same names
+        self.assertEqual(assets.build(self.source, self.target), manifest)
+
+    def test_stylesheet_links_the_built_background(self):
+        static = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+        with patch.object(assets, "Image", None):
+            manifest = assets.build(static, self.target)
+        css = manifest["files"]["style.css"]
+        with open(os.path.join(self.target, css), encoding="utf-8") as stream:
+            self.assertIn(
+                manifest["files"]["stringbackground_login_signup.jpg"], stream.read()
+            )
+
+    def test_serves_fingerprinted_files(self):
+        built_app, manifest = self.build_app()
+        css = manifest["files"]["style.css"]
+        client = built_app.test_client()
+        page = client.get("/login").get_data(as_text=True)
+        self.assertIn(f'href="/static/{css}"', page)
+
+        response = client.get(f"/static/{css}", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.headers["Content-Type"], "text/css; charset=utf-8")
+        self.assertEqual(response.headers["Vary"], "Accept-Encoding")
+        self.assertEqual(response.headers["Cache-Control"], assets.IMMUTABLE)
+        self.assertNotIn("Last-Modified", response.headers)
+        self.assertIn("body{", gzip.decompress(response.data).decode("utf-8"))
+        response.close()
+
+        response = client.get(f"/static/{css}")
+        self.assertNotIn("Content-Encoding", response.headers)
+        self.assertTrue(response.get_data(as_text=True).startswith("body{"))
+        response.close()
+
+    def test_serves_image_variants(self):
+        built_app, manifest = self.build_app()
+        image = manifest["files"]["img/bg.jpg"]
+        webp = "img/bg.0123456789ab.webp"
+        with open(os.path.join(self.target, webp), "wb") as stream:
+            stream.write(b"webp")
+        built_app.extensions["assets"].variants[image] = {"image/webp": webp}
+        client = built_app.test_client()
+        response = client.get(f"/static/{image}", headers={"Accept": "image/webp,*/*"})
+        self.assertEqual(response.data, b"webp")
+        self.assertEqual(response.headers["Content-Type"], "image/webp")
+        self.assertEqual(response.headers["Vary"], "Accept")
+        response.close()
+        response = client.get(f"/static/{image}", headers={"Accept": "image/png"})
+        self.assertEqual(response.data, b"not really a jpeg")
+        response.close()
+
+    def test_vary_lists_every_negotiated_header(self):
+        built_app, manifest = self.build_app()
+        css = manifest["files"]["style.css"]
+        # a compressible file with image variants negotiates on both headers
+        built_app.extensions["assets"].variants[css] = {"image/webp": css}
+        response = built_app.test_client().get(
+            f"/static/{css}", headers={"Accept-Encoding": "gzip"}
+        )
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(response.vary.as_set(), {"accept", "accept-encoding"})
+        response.close()
+
+    def test_unbuilt_static_folder(self):
+        with app.test_request_context():
+            self.assertEqual(
+                app.extensions["assets"].url("style.css"), "/static/style.css"
+            )
+        response = app.test_client().get("/static/style.css")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response.headers.get("Cache-Control", ""))
+        response.close()
+
+
+class StartupTests(unittest.TestCase):
+    # importing must not touch the database, so point it at one that doesn't exist
+    env = dict(os.environ, DATABASE_URL1="postgresql://unreachable.invalid/db")
+
+    def run_python(self, code):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=self.env,
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.strip()
+
+    def test_helpers_need_no_flask_or_db(self):
+        loaded = self.run_python(
+            "import sys, helpers; "
+            "print(sorted({'flask', 'sqlalchemy', 'app'} & set(sys.modules)))"
+        )
+        self.assertEqual(loaded, "[]")
+
+    def test_import_and_factory_do_not_connect(self):
+        self.run_python("import app; app.create_app()")
+
+    def test_import_time_within_budget(self):
+        budget_ms = float(os.environ.get("IMPORT_TIME_BUDGET_MS", 1500))
+        elapsed_ms = float(
+            self.run_python(
+                "import time; start = time.perf_counter(); import app; "
+                "print((time.perf_counter() - start) * 1000)"
+            )
+        )
+        self.assertLess(elapsed_ms, budget_ms)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,83 @@
+"""
+Cached user loading for Flask-Login.
+
+Authenticated requests only need a few columns of the logged in user, so the
+login manager is handed a small UserSnapshot from an in-process TTL/LRU cache
+instead of a full ORM User loaded on every request. Writes load the ORM row
+explicitly and invalidate the cached snapshot.
+"""
+import time
+
+from ttl_cache import TTLCache
+
+
+class UserSnapshot:
+    """
+    The fields of a User that requests read, plus the Flask-Login interface
+    """
+
+    __slots__ = ("id", "username", "current_instr_id")
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, current_instr_id):  # pylint: disable=redefined-builtin
+        self.id = id
+        self.username = username
+        self.current_instr_id = current_instr_id
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.current_instr_id)
+
+    def get_id(self):
+        return str(self.id)
+
+    def __repr__(self):
+        return f"<UserSnapshot {self.id}, {self.username}>"
+
+
+class UserCache:
+    """
+    Maps user ids to UserSnapshots, calling `load(user_id)` (which returns an
+    ORM User or None) on a miss. Unknown users are not cached.
+
+    Each process has its own cache, so a change made in one worker reaches the
+    others once their entry expires; keep the TTL short.
+    """
+
+    def __init__(self, load, maxsize=10000, ttl=10, clock=time.monotonic):
+        self._load = load
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl, clock=clock)
+
+    @classmethod
+    def from_config(cls, config, load):
+        """
+        USER_CACHE_SIZE and USER_CACHE_TTL (seconds, 0 disables the cache)
+        """
+        return cls(
+            load,
+            maxsize=int(config.get("USER_CACHE_SIZE", 10000)),
+            ttl=float(config.get("USER_CACHE_TTL", 10)),
+        )
+
+    def get(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        snapshot = self._cache.get(user_id)
+        if snapshot is None:
+            user = self._load(user_id)
+            if user is None:
+                return None
+            snapshot = UserSnapshot.from_user(user)
+            self._cache.set(user_id, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id):
+        self._cache.pop(int(user_id))
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,8 @@
+"""
+Production entry point for gunicorn (see gunicorn.conf.py)
+"""
+from app import create_app
+
+app = create_app()
+# the interactive debugger must never be reachable in production
+app.debug = False